@@ -5,13 +5,15 @@ Streamlit UI for AI Code Understanding SME
 import streamlit as st
 import yaml
 from pathlib import Path
-import json
 import os
+import threading
+import time
 
 from main import CodeUnderstandingSME
 from ollama_client import OllamaClient
 from vector_db import VectorDatabase, CHROMADB_AVAILABLE
 from rag_service import RAGService
+from json_utils import dumps_pretty
 
 
 # Page configuration
@@ -22,39 +24,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+@st.cache_data
+def load_css() -> str:
+    """Read the custom stylesheet once and minify it"""
+    css = (Path(__file__).parent / "assets" / "app.css").read_text()
+    return "<style>" + " ".join(line.strip() for line in css.splitlines() if line.strip()) + "</style>"
+
+
 # Custom CSS
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f77b4;
-        margin-bottom: 1rem;
-    }
-    .sub-header {
-        font-size: 1.2rem;
-        color: #666;
-        margin-bottom: 2rem;
-    }
-    .stButton>button {
-        width: 100%;
-        background-color: #1f77b4;
-        color: white;
-    }
-    .info-box {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        background-color: #f0f2f6;
-        margin: 1rem 0;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(load_css(), unsafe_allow_html=True)
+
+
+@st.cache_data(ttl=30)
+def check_paths(paths: tuple) -> tuple:
+    """Existence of each configured path, re-checked at most every 30s instead of on every rerun"""
+    return tuple(os.path.exists(p) for p in paths)
 
 
 @st.cache_resource
 def initialize_sme(config_path: str = "config.yaml"):
     """Initialize the Code Understanding SME (cached)"""
-    return CodeUnderstandingSME(config_path)
+    sme = CodeUnderstandingSME(config_path)
+    if sme.ollama_client:
+        # Load the embedding model in the background so the first question skips the cold start
+        threading.Thread(target=sme.ollama_client.preload_model, daemon=True).start()
+    return sme
 
 
 @st.cache_resource
@@ -63,17 +58,39 @@ def initialize_rag_service(_sme: CodeUnderstandingSME, llm_model: str = "qwen2.5
     if not _sme.ollama_client or not _sme.vector_db:
         return None
     
+    # Load the LLM in the background as well
+    threading.Thread(target=_sme.ollama_client.preload_model, args=(llm_model, False), daemon=True).start()
+    
     # Check if on-demand extraction is enabled
     extract_on_demand = _sme.config.get('embeddings', {}).get('extract_mappings_on_ingestion', False) == False
     
+    llm_config = _sme.config.get('llm', {})
     return RAGService(
         ollama_client=_sme.ollama_client,
         vector_db=_sme.vector_db,
         llm_model=llm_model,
-        extract_mappings_on_demand=extract_on_demand
+        extract_mappings_on_demand=extract_on_demand,
+        semantic_cache_threshold=llm_config.get('semantic_cache_threshold', 0.92),
+        semantic_cache_size=llm_config.get('semantic_cache_size', 256),
+        semantic_cache_ttl=llm_config.get('semantic_cache_ttl', 3600),
+        max_context_tokens=llm_config.get('max_context_tokens', 8000),
+        min_retrieval_similarity=llm_config.get('min_retrieval_similarity', 0.0)
     )
 
 
+def render_retrievals(retrievals):
+    """Render retrieved chunks, computing similarities and previews in one pass"""
+    hits = [
+        (ret.get('metadata', {}), ret.get('document', '')[:500], 1.0 - ret.get('distance', 0))
+        for ret in retrievals
+    ]
+    for i, (metadata, preview, similarity) in enumerate(hits, 1):
+        st.markdown(f"**Retrieval {i}** (Similarity: {similarity:.2%})")
+        st.code(dumps_pretty(metadata), language='json')
+        st.text(preview)
+        st.divider()
+
+
 def main():
     # Header
     st.markdown('<div class="main-header">🔍 AI Code Understanding SME</div>', unsafe_allow_html=True)
@@ -105,11 +122,27 @@ def main():
         else:
             st.warning("Embeddings disabled")
         
+        with st.expander("⚡ Ollama Concurrency"):
+            st.markdown("""
+            Set these before starting `ollama serve` so question embedding and answer
+            generation can run side by side:
+            - `OLLAMA_NUM_PARALLEL`: parallel requests per loaded model (e.g. `4`)
+            - `OLLAMA_MAX_LOADED_MODELS`: keep the embedding model and LLM loaded together (e.g. `2`)
+            """)
+            for env_var in ("OLLAMA_NUM_PARALLEL", "OLLAMA_MAX_LOADED_MODELS"):
+                st.text(f"  {env_var} = {os.environ.get(env_var, '(not set)')}")
+        
         # Check LLM model
         llm_model = st.text_input("LLM Model", value="qwen2.5-coder:7b")
         if sme.ollama_client:
             if sme.ollama_client.check_llm_model(llm_model):
                 st.success(f"✓ {llm_model} available")
+                loaded = sme.ollama_client.loaded_models()
+                for model_name in (sme.ollama_client.model, llm_model):
+                    if any(model_name in name for name in loaded):
+                        st.text(f"  🔥 {model_name} warm")
+                    else:
+                        st.text(f"  ❄ {model_name} not loaded yet")
             else:
                 st.warning(f"⚠ {llm_model} not found")
                 st.info(f"Run: ollama pull {llm_model}")
@@ -135,29 +168,33 @@ def main():
         
         if projects:
             st.info(f"Configured {len(projects)} project(s):")
-            for i, project in enumerate(projects, 1):
-                if Path(project).exists():
+            for i, (project, exists) in enumerate(zip(projects, check_paths(tuple(projects))), 1):
+                if exists:
                     st.text(f"  {i}. ✓ {project}")
                 else:
                     st.text(f"  {i}. ✗ {project} (not found)")
             
+            force_reingest = st.checkbox("Force re-ingest unchanged files", value=False)
             if st.button("🔄 Process All Configured Projects"):
                 with st.spinner("Processing projects..."):
-                    results = sme.process_configured_codebase()
+                    results = sme.process_configured_codebase(force=force_reingest)
                     if results:
                         stored_count = sum(1 for r in results if r.get('summary', {}).get('code_stored', False))
-                        st.success(f"✓ Processed {len(results)} file(s), stored {stored_count} code file(s)")
+                        unchanged_count = sum(1 for r in results if r.get('status') == 'unchanged')
+                        st.success(f"✓ Processed {len(results)} file(s), stored {stored_count} code file(s) ({unchanged_count} unchanged)")
                     else:
                         st.error("Failed to process projects")
         elif codebase_path:
             st.info(f"Configured: `{codebase_path}`")
-            if Path(codebase_path).exists():
+            if check_paths((codebase_path,))[0]:
+                force_reingest = st.checkbox("Force re-ingest unchanged files", value=False)
                 if st.button("🔄 Process Configured Codebase"):
                     with st.spinner("Processing codebase..."):
-                        results = sme.process_configured_codebase()
+                        results = sme.process_configured_codebase(force=force_reingest)
                         if results:
                             stored_count = sum(1 for r in results if r.get('summary', {}).get('code_stored', False))
-                            st.success(f"✓ Processed {len(results)} file(s), stored {stored_count} code file(s)")
+                            unchanged_count = sum(1 for r in results if r.get('status') == 'unchanged')
+                            st.success(f"✓ Processed {len(results)} file(s), stored {stored_count} code file(s) ({unchanged_count} unchanged)")
                         else:
                             st.error("Failed to process codebase")
             else:
@@ -184,7 +221,7 @@ def main():
                     content = uploaded_file.read().decode('utf-8')
                     result = sme.process_content(content, uploaded_file.name)
                     st.success(f"Processed {uploaded_file.name}")
-                    st.json(result.get('summary', {}))
+                    st.code(dumps_pretty(result.get('summary', {})), language='json')
     
     # Main content area
     tab1, tab2, tab3 = st.tabs(["💬 Ask Questions", "📊 Database Stats", "🔍 Search Code"])
@@ -228,9 +265,14 @@ def main():
                 st.warning("Please enter a question")
             else:
                 with st.spinner("Thinking..."):
+                    # Load the vector indexes in the background while Ollama embeds the question
+                    warm_up_thread = threading.Thread(target=sme.vector_db.warm_up, daemon=True)
+                    warm_up_thread.start()
+                    
                     if use_streaming:
                         # Get retrievals first for display
                         question_embedding = sme.ollama_client.get_embeddings(question)
+                        warm_up_thread.join()
                         retrievals = []
                         if question_embedding:
                             retrievals = sme.vector_db.search_similar(question_embedding, n_retrievals)
@@ -238,31 +280,40 @@ def main():
                         # Show retrievals
                         with st.expander("📚 Retrieved Context", expanded=False):
                             if retrievals:
-                                for i, ret in enumerate(retrievals, 1):
-                                    st.markdown(f"**Retrieval {i}** (Similarity: {1 - ret.get('distance', 0):.2%})")
-                                    st.json(ret.get('metadata', {}))
-                                    st.text(ret.get('document', '')[:500])
-                                    st.divider()
+                                render_retrievals(retrievals)
                             else:
                                 st.info("No retrievals found")
                         
                         # Stream the answer
                         st.markdown("### 💡 Answer")
                         answer_placeholder = st.empty()
-                        full_answer = ""
+                        answer_chunks = []
+                        # Repaint at most every ~64 chars / 50ms instead of on every token
+                        pending_chars = 0
+                        last_flush = time.monotonic()
                         
                         try:
-                            for chunk_data in rag_service.answer_question_streaming(question, n_retrievals):
+                            for chunk_data in rag_service.answer_question_streaming(
+                                question, n_retrievals,
+                                precomputed_embedding=question_embedding,
+                                precomputed_retrievals=retrievals if question_embedding else None
+                            ):
                                 if 'error' in chunk_data:
                                     st.error(chunk_data['error'])
                                     break
                                 elif 'chunk' in chunk_data:
-                                    full_answer += chunk_data['chunk']
-                                    answer_placeholder.markdown(full_answer)
+                                    answer_chunks.append(chunk_data['chunk'])
+                                    pending_chars += len(chunk_data['chunk'])
+                                    if pending_chars > 64 or time.monotonic() - last_flush > 0.05:
+                                        answer_placeholder.markdown(''.join(answer_chunks))
+                                        pending_chars = 0
+                                        last_flush = time.monotonic()
                                     if chunk_data.get('done', False):
                                         break
                             
+                            full_answer = ''.join(answer_chunks)
                             if full_answer:
+                                answer_placeholder.markdown(full_answer)
                                 st.success("✓ Answer generated")
                         except Exception as e:
                             st.error(f"Error during streaming: {e}")
@@ -275,11 +326,7 @@ def main():
                         else:
                             # Show retrievals
                             with st.expander("📚 Retrieved Context", expanded=False):
-                                for i, ret in enumerate(result['retrievals'], 1):
-                                    st.markdown(f"**Retrieval {i}** (Similarity: {1 - ret.get('distance', 0):.2%})")
-                                    st.json(ret.get('metadata', {}))
-                                    st.text(ret.get('document', '')[:500])
-                                    st.divider()
+                                render_retrievals(result['retrievals'])
                             
                             # Show answer
                             st.markdown("### 💡 Answer")
@@ -292,7 +339,7 @@ def main():
         
         if sme.vector_db:
             stats = sme.get_vector_db_stats()
-            st.json(stats)
+            st.code(dumps_pretty(stats), language='json')
             
             # Show code files stats
             st.info("Code files are stored in vector database. Mappings are extracted on-demand when you ask questions.")
@@ -311,11 +358,12 @@ def main():
                             sample = sme.vector_db.code_collection.get(limit=10)
                             if sample.get('ids'):
                                 st.subheader("Sample Code Files")
-                                for i, (file_id, metadata) in enumerate(zip(sample['ids'], sample['metadatas']), 1):
+                                documents = sample.get('documents') or [''] * len(sample['ids'])
+                                for i, (metadata, document) in enumerate(zip(sample['metadatas'], documents), 1):
                                     with st.expander(f"File {i}: {metadata.get('file_name', 'N/A')}"):
-                                        st.json(metadata)
-                                        if sample.get('documents'):
-                                            st.code(sample['documents'][i][:500] if i < len(sample['documents']) else '')
+                                        st.code(dumps_pretty(metadata), language='json')
+                                        if document:
+                                            st.code(document[:500])
                         except Exception as e:
                             st.error(f"Error loading sample: {e}")
         else:
@@ -337,13 +385,14 @@ def main():
                     if results:
                         st.success(f"Found {len(results)} similar code file(s)")
                         
-                        for i, result in enumerate(results, 1):
+                        similarities = [1.0 - result.get('distance', 0) for result in results]
+                        for i, (result, similarity) in enumerate(zip(results, similarities), 1):
                             metadata = result.get('metadata', {})
                             code = result.get('code', '') or result.get('document', '')
-                            with st.expander(f"Result {i} (Similarity: {1 - result.get('distance', 0):.2%}) - {metadata.get('file_name', 'N/A')}"):
-                                st.json(metadata)
+                            with st.expander(f"Result {i} (Similarity: {similarity:.2%}) - {metadata.get('file_name', 'N/A')}"):
+                                st.code(dumps_pretty(metadata), language='json')
                                 st.markdown("**Code:**")
-                                st.code(code[:1000] if len(code) > 1000 else code, language='java')
+                                st.code(code[:1000], language='java')
                     else:
                         st.info("No similar code files found")
 
@@ -2,11 +2,17 @@
 """
 Diagnostic script to troubleshoot ingestion issues
 """
+import os
 import sys
-from main import CodeUnderstandingSME
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def diagnose():
+from mapping_extractor import extract_file_mappings
+
+def diagnose(sample_size: int = 5):
+    # Imported here so extraction worker processes don't load the whole app
+    from main import CodeUnderstandingSME
+    
     print("="*80)
     print("AI Code Understanding SME - Diagnostic Tool")
     print("="*80)
@@ -80,7 +86,9 @@ def diagnose():
         return
     
     test_path = Path(test_project)
-    if test_path.exists():
+    test_path_exists = test_path.exists()
+    java_files = []
+    if test_path_exists:
         exclude_patterns = sme.config.get('input', {}).get('exclude_patterns', [])
         java_files = sme.parser.find_java_files(
             str(test_path),
@@ -101,34 +109,29 @@ def diagnose():
     # Check 5: Test mapping extraction
     print("5. Testing Mapping Extraction...")
     if projects or codebase_path:
-        test_path = Path(projects[0] if projects else codebase_path)
-        if test_path.exists():
-            exclude_patterns = sme.config.get('input', {}).get('exclude_patterns', [])
-            java_files = sme.parser.find_java_files(
-                str(test_path),
-                recursive=True,
-                extensions=['.java'],
-                exclude_patterns=exclude_patterns
-            )
-            
+        # Reuse the files discovered in check 4
+        if test_path_exists:
             if len(java_files) > 0:
-                # Test first 5 files
-                test_files = java_files[:5]
+                # Test the first sample_size files, parsed in parallel worker processes
+                test_files = java_files[:sample_size]
                 total_mappings = 0
                 files_with_mappings = 0
                 
-                for test_file in test_files:
-                    try:
-                        result = sme.extractor.extract_mappings(test_file)
-                        num_mappings = len(result.get('mappings', []))
-                        if num_mappings > 0:
-                            files_with_mappings += 1
-                            total_mappings += num_mappings
-                            print(f"   ✓ {Path(test_file).name}: {num_mappings} mapping(s)")
-                        else:
-                            print(f"   ℹ {Path(test_file).name}: No mappings found")
-                    except Exception as e:
-                        print(f"   ✗ {Path(test_file).name}: Error - {e}")
+                workers = min(os.cpu_count() or 1, len(test_files))
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(extract_file_mappings, test_file) for test_file in test_files]
+                    for test_file, future in zip(test_files, futures):
+                        try:
+                            result = future.result()
+                            num_mappings = len(result.get('mappings', []))
+                            if num_mappings > 0:
+                                files_with_mappings += 1
+                                total_mappings += num_mappings
+                                print(f"   ✓ {Path(test_file).name}: {num_mappings} mapping(s)")
+                            else:
+                                print(f"   ℹ {Path(test_file).name}: No mappings found")
+                        except Exception as e:
+                            print(f"   ✗ {Path(test_file).name}: Error - {e}")
                 
                 print(f"   → Summary: {files_with_mappings}/{len(test_files)} files have mappings")
                 print(f"   → Total mappings in sample: {total_mappings}")
@@ -158,5 +161,6 @@ def diagnose():
     print("   python main.py --process-codebase --verbose")
 
 if __name__ == '__main__':
-    diagnose()
+    # Optional argument: number of files to test in check 5 (default 5)
+    diagnose(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
 
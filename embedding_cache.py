@@ -0,0 +1,201 @@
+"""
+Embedding caches - avoid recomputing embeddings for text that was already embedded
+"""
+import hashlib
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+# Bump when the on-disk vector format changes so old caches are discarded
+DISK_CACHE_FORMAT = 1
+
+# Supported on-disk vector encodings (bytes per dimension: float32=4, float16=2, int8=1)
+VECTOR_FORMATS = ('float32', 'float16', 'int8')
+
+
+def make_cache_key(model: str, text: str) -> bytes:
+    """Build a compact cache key from the model name and the text"""
+    return hashlib.blake2b(f"{model}\0{text}".encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class EmbeddingLRUCache:
+    """Thread-safe in-memory LRU cache of embeddings
+
+    Vectors are held as float32 arrays (4 bytes per dimension) rather than lists of
+    Python floats, so 5000 entries of a 1024-dim model stay around 20MB.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, array]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        """Return the cached embedding for key, or None"""
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                return None
+            self._entries.move_to_end(key)
+        return vector.tolist()
+
+    def put(self, key: bytes, embedding: List[float]):
+        """Store an embedding, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+        vector = array('f', embedding)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _encode_int8(embedding: List[float]) -> bytes:
+    """Symmetric per-vector int8 quantization: float32 scale followed by one byte per dim"""
+    max_abs = max((abs(x) for x in embedding), default=0.0)
+    scale = max_abs / 127.0 if max_abs > 0 else 1.0
+    quantized = array('b', (max(-127, min(127, round(x / scale))) for x in embedding))
+    return struct.pack('<f', scale) + quantized.tobytes()
+
+
+def _decode_int8(blob: bytes) -> List[float]:
+    """Inverse of _encode_int8"""
+    scale = struct.unpack_from('<f', blob)[0]
+    quantized = array('b')
+    quantized.frombytes(blob[4:])
+    return [x * scale for x in quantized]
+
+
+def _encode_float16(embedding: List[float]) -> bytes:
+    """IEEE half precision, two bytes per dim (values beyond +-65504 are clamped)"""
+    return struct.pack(f'<{len(embedding)}e', *(max(-65504.0, min(65504.0, x)) for x in embedding))
+
+
+def _decode_float16(blob: bytes) -> List[float]:
+    """Inverse of _encode_float16"""
+    return list(struct.unpack(f'<{len(blob) // 2}e', blob))
+
+
+class DiskEmbeddingCache:
+    """SQLite-backed embedding cache that survives process restarts
+
+    Vectors are stored as float32 blobs keyed by make_cache_key(model, text), as half
+    precision with vector_format='float16' (2x smaller), or as per-vector scaled int8
+    (~4x smaller, cosine error below 1e-4) with vector_format='int8'. The file is bound to one embedding model, vector format and
+    format version; opening it with different settings clears the stored vectors.
+    With max_entries > 0 the least recently used vectors are evicted once the cache
+    grows past that many entries.
+    """
+
+    def __init__(self, path: str, model: str, vector_format: str = 'float32', max_entries: int = 0):
+        if vector_format not in VECTOR_FORMATS:
+            raise ValueError(f"Unsupported vector_format '{vector_format}' (expected one of {VECTOR_FORMATS})")
+        self.vector_format = vector_format
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        # Last use (unix time) for LRU eviction; added in place to caches created before it
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if 'used' not in columns:
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN used INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+        
+        # Invalidate vectors written by another model or an older format
+        cache_id = f"v{DISK_CACHE_FORMAT}:{vector_format}:{model}"
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'cache_id'").fetchone()
+        if row is None or row[0] != cache_id:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('cache_id', ?)", (cache_id,))
+        self._conn.commit()
+        
+        self.max_entries = max(0, max_entries)
+        # Hits are recorded in memory and written with the next put (or every 256 hits)
+        self._touched: List[bytes] = []
+        self._approx_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] if self.max_entries else 0
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        """Return the stored embedding for key, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_entries:
+                self._touched.append(key)
+                if len(self._touched) >= 256:
+                    self._write_touched()
+                    self._conn.commit()
+        if row is None:
+            return None
+        return self._decode(row[0])
+
+    def put(self, key: bytes, embedding: List[float]):
+        """Store a single embedding"""
+        self.put_many([(key, embedding)])
+
+    def put_many(self, items: Iterable[Tuple[bytes, List[float]]]):
+        """Store several embeddings in one transaction"""
+        now = time.time()
+        rows = [(key, self._encode(embedding), now) for key, embedding in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)", rows)
+            if self.max_entries:
+                self._write_touched()
+                self._approx_count += len(rows)
+                if self._approx_count > self.max_entries:
+                    self._evict()
+            self._conn.commit()
+
+    def _write_touched(self):
+        """Store the last-use time of recent hits (caller holds the lock and commits)"""
+        if self._touched:
+            now = time.time()
+            self._conn.executemany("UPDATE embeddings SET used = ? WHERE key = ?",
+                                   [(now, key) for key in self._touched])
+            self._touched = []
+
+    def _evict(self):
+        """Drop the least recently used entries down to 90% of max_entries"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        target = self.max_entries * 9 // 10
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                (count - target,)
+            )
+            count = target
+        self._approx_count = count
+
+    def _encode(self, embedding: List[float]) -> bytes:
+        if self.vector_format == 'int8':
+            return _encode_int8(embedding)
+        if self.vector_format == 'float16':
+            return _encode_float16(embedding)
+        return array('f', embedding).tobytes()
+
+    def _decode(self, blob: bytes) -> List[float]:
+        if self.vector_format == 'int8':
+            return _decode_int8(blob)
+        if self.vector_format == 'float16':
+            return _decode_float16(blob)
+        vector = array('f')
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
@@ -0,0 +1,82 @@
+"""
+PCA projection of embeddings - shrink vectors before they are indexed in Chroma
+"""
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+class PCAProjector:
+    """Linear projection onto the top principal components of a sample of embeddings
+
+    Fitted once on stored vectors (e.g. 768 -> 256 dims) and persisted as an .npz file,
+    so indexing and querying both run on the smaller vectors.
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, n_components: int) -> "PCAProjector":
+        """Fit on an (n_samples, dim) matrix of embeddings"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n_components = min(n_components, vectors.shape[0], vectors.shape[1])
+        mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, vt[:n_components])
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjector":
+        data = np.load(path)
+        return cls(data['mean'], data['components'])
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # np.savez appends .npz unless given a file object
+        with open(path, 'wb') as f:
+            np.savez(f, mean=self.mean, components=self.components)
+
+    def transform(self, embeddings: List[List[float]]) -> List[List[float]]:
+        """Project a batch of embeddings, passing through vectors that are already projected"""
+        if not embeddings or len(embeddings[0]) != self.input_dim:
+            return embeddings
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        return ((matrix - self.mean) @ self.components.T).tolist()
+
+
+def recall_at_k(vectors: np.ndarray, projector: PCAProjector, n_queries: int = 200,
+                k: int = 10) -> Tuple[float, int]:
+    """Estimate how many exact top-k neighbours survive the projection
+
+    Uses the first n_queries vectors as held-out queries against the rest, comparing
+    exact L2 neighbours in the original and the projected space.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n_queries = min(n_queries, len(vectors) // 2)
+    k = min(k, len(vectors) - n_queries)
+    if n_queries == 0 or k <= 0:
+        return 1.0, 0
+
+    queries, corpus = vectors[:n_queries], vectors[n_queries:]
+    projected = np.asarray(projector.transform(vectors.tolist()), dtype=np.float32)
+    p_queries, p_corpus = projected[:n_queries], projected[n_queries:]
+
+    def top_k(q: np.ndarray, c: np.ndarray) -> np.ndarray:
+        # Squared L2 without the constant |q|^2 term
+        distances = (c * c).sum(axis=1)[None, :] - 2.0 * (q @ c.T)
+        return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+    exact = top_k(queries, corpus)
+    approx = top_k(p_queries, p_corpus)
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return hits / (n_queries * k), n_queries
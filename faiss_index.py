@@ -0,0 +1,70 @@
+"""
+FAISS search index - exact nearest-neighbour search over the code embeddings stored in Chroma
+"""
+import threading
+from typing import List, Tuple
+
+try:
+    import faiss
+    import numpy as np
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+
+class FaissCodeIndex:
+    """Flat (exact) L2 index over the embeddings of one or more Chroma collections
+
+    Built lazily from the collections on the first search and rebuilt after invalidate().
+    Distances are squared L2 like Chroma's default space, so results rank the same way.
+    Only ids are kept here; documents and metadata stay in Chroma.
+    """
+
+    def __init__(self, page_size: int = 5000):
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._index = None
+        self._ids: List[str] = []
+        self._owners: List[int] = []  # position of each row's collection
+        # Bumped by invalidate(); the index is current when it was built at this generation
+        self._generation = 0
+        self._built_generation = -1
+
+    def invalidate(self):
+        """Mark the index stale after the collections changed"""
+        self._generation += 1
+
+    def _build(self, collections: list):
+        generation = self._generation
+        index = None
+        ids: List[str] = []
+        owners: List[int] = []
+        for position, collection in enumerate(collections):
+            offset = 0
+            while True:
+                page = collection.get(limit=self.page_size, offset=offset, include=['embeddings'])
+                if not page['ids']:
+                    break
+                vectors = np.asarray(page['embeddings'], dtype=np.float32)
+                if index is None:
+                    index = faiss.IndexFlatL2(vectors.shape[1])
+                index.add(vectors)
+                ids.extend(page['ids'])
+                owners.extend([position] * len(page['ids']))
+                offset += len(page['ids'])
+        self._index, self._ids, self._owners = index, ids, owners
+        self._built_generation = generation
+
+    def search(self, collections: list, query_embedding: List[float],
+               n_results: int = 5) -> List[Tuple[int, str, float]]:
+        """Return (collection position, id, distance) of the nearest stored embeddings"""
+        with self._lock:
+            if self._built_generation != self._generation:
+                self._build(collections)
+            index, ids, owners = self._index, self._ids, self._owners
+        if index is None or index.ntotal == 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        distances, rows = index.search(query, min(n_results, index.ntotal))
+        return [(owners[row], ids[row], float(distance))
+                for distance, row in zip(distances[0], rows[0]) if row >= 0]
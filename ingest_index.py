@@ -0,0 +1,124 @@
+"""
+Ingestion index - remembers which file contents are already embedded in the vector database
+"""
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Files at least this large are decoded and hashed straight from a read-only mmap,
+# so no intermediate bytes copy of the whole file is made
+MMAP_MIN_SIZE = 1024 * 1024
+
+
+def content_digest(content: str) -> bytes:
+    """SHA-256 of the text content"""
+    return hashlib.sha256(content.encode('utf-8', 'surrogatepass')).digest()
+
+
+def read_text_with_digest(file_path: str) -> Tuple[str, bytes]:
+    """Read a file as text (like open(..., 'r', encoding='utf-8', errors='ignore')) with its content_digest
+    
+    For valid UTF-8 without carriage returns the text encodes back to the raw bytes, so
+    those are hashed directly instead of re-encoding the decoded text.
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _decode_with_digest(data)
+        return _decode_with_digest(f.read())
+
+
+def _decode_with_digest(data) -> Tuple[str, bytes]:
+    try:
+        content = str(data, 'utf-8')
+    except UnicodeDecodeError:
+        content = None
+    if content is not None and data.find(b'\r') == -1:
+        return content, hashlib.sha256(data).digest()
+    
+    if content is None:
+        content = str(data, 'utf-8', 'ignore')
+    # Universal newlines, as text mode would do
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content, content_digest(content)
+
+
+class IngestIndex:
+    """SQLite table of (path, sha256, mtime, size) for every stored file
+
+    Lets re-ingestion skip files whose content has not changed since they were embedded.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_index "
+            "(path TEXT PRIMARY KEY, sha256 BLOB NOT NULL, mtime REAL, size INTEGER)"
+        )
+        # Counter bumped on every change to the vector DB collections; kept in this file so
+        # other processes (the UI while the CLI ingests) see it too
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, path: str) -> Optional[Tuple[bytes, Optional[float], Optional[int]]]:
+        """Return (sha256, mtime, size) recorded for path, or None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sha256, mtime, size FROM ingest_index WHERE path = ?", (path,)
+            ).fetchone()
+
+    def is_unchanged_stat(self, path: str, mtime: float, size: int) -> bool:
+        """Cheap check: same mtime and size as when the file was stored"""
+        row = self.get(path)
+        return row is not None and row[1] == mtime and row[2] == size
+
+    def is_unchanged_content(self, path: str, digest: bytes) -> bool:
+        """Same content hash as when the file was stored"""
+        row = self.get(path)
+        return row is not None and row[0] == digest
+
+    def record(self, path: str, digest: bytes, mtime: Optional[float] = None, size: Optional[int] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ingest_index (path, sha256, mtime, size) VALUES (?, ?, ?, ?)",
+                (path, digest, mtime, size)
+            )
+            self._conn.commit()
+
+    def data_version(self) -> int:
+        """Current value of the change counter (0 before the first change)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM ingest_meta WHERE key = 'data_version'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump_data_version(self):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingest_meta (key, value) VALUES ('data_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+            self._conn.commit()
+
+    def remove(self, path: str):
+        """Forget path, so the next run ingests it again"""
+        with self._lock:
+            self._conn.execute("DELETE FROM ingest_index WHERE path = ?", (path,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM ingest_index")
+            self._conn.commit()
@@ -3,14 +3,73 @@ Java Code Parser for extracting MapStruct and POJO mappings
 """
 import re
 import os
-from typing import List, Dict, Optional, Tuple
+import fnmatch
+import hashlib
+import mmap
+import pickle
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import repeat
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from pathlib import Path
 
+try:
+    import numba
+    import numpy as np
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Files at least this large (and pure ASCII) use the numba brace scanner when available
+NUMBA_MIN_SIZE = 256 * 1024
+
+# Literals every match of the MapStruct / POJO patterns contains; files without them skip that pass
+MAPSTRUCT_KEYWORDS = ('@Mapper',)
+POJO_KEYWORDS = ('map', 'convert', 'transform', 'to')
+
+# Bump whenever extraction patterns or the result layout change, so cached parses are not reused
+PARSER_VERSION = "1.5"
+
+
+class MapStructMapping(NamedTuple):
+    """One @Mapping of a MapStruct mapper method (or an implicit same-name mapping)"""
+    interface: str
+    method: str
+    return_type: str
+    source_type: str
+    source_field: Optional[str]
+    target_field: Optional[str]
+    expression: Optional[str] = None
+    qualified_by: Optional[str] = None
+    ignore: bool = False
+    implicit: bool = False
+    
+    def to_dict(self) -> Dict:
+        return {'type': 'mapstruct', **self._asdict()}
+
+
+class PojoMapping(NamedTuple):
+    """A hand-written mapping method and the field assignments found in its body"""
+    method: Optional[str]
+    return_type: str
+    source_type: str
+    target_type: str
+    mappings: List[Dict]
+    
+    def to_dict(self) -> Dict:
+        return {'type': 'pojo', **self._asdict()}
+
 
 class JavaParser:
-    """Parser for Java code to extract mapping information"""
+    """Parser for Java code to extract mapping information
+    
+    With cache_dir set, parse_file keeps each result on disk keyed by the content hash
+    and PARSER_VERSION, so unchanged files are not parsed again.
+    """
     
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._cache_stats = {'hits': 0, 'misses': 0}
         self.mapstruct_patterns = {
             'mapper_interface': r'@Mapper\s*(?:\([^)]*\))?\s*(?:public\s+)?interface\s+(\w+)',
             'mapping_method': r'@Mapping\s*\([^)]*source\s*=\s*["\']([^"\']+)["\']\s*,\s*target\s*=\s*["\']([^"\']+)["\']',
@@ -18,12 +77,94 @@ class JavaParser:
             'method_signature': r'(\w+)\s+(\w+)\s*\([^)]*(\w+)\s+\w+[^)]*\)',
         }
         
+        # Compiled once per parser instead of going through re's pattern cache on every call
+        self._re_mapper = re.compile(r'@Mapper\s*(?:\([^)]*\))?\s*(?:public\s+)?interface\s+(\w+)\s*\{', re.MULTILINE)
+        self._re_method = re.compile(r'(\w+(?:<[^>]+>)?(?:\s*\[\])?)\s+(\w+)\s*\([^)]*\)\s*;')
+        self._re_params = re.compile(r'\(([^)]+)\)')
+        # '@Mapping(' but not '@Mappings(' - the inner @Mapping entries of @Mappings match on their own
+        self._re_mapping_start = re.compile(r'@Mapping\s*\(')
+        self._re_source = re.compile(r'source\s*=\s*["\']([^"\']+)["\']')
+        self._re_target = re.compile(r'target\s*=\s*["\']([^"\']+)["\']')
+        self._re_expr = re.compile(r'expression\s*=\s*["\']([^"\']+)["\']')
+        self._re_ignore = re.compile(r'ignore\s*=\s*(true|false)')
+        
+        # POJO mapping methods:
+        # - void mapXxx(SourceType source, TargetType target)
+        # - TargetType map(SourceType source)
+        # - private/protected/public void mapXxx(...)
+        # - Methods starting with map, convert, transform, to
+        # One alternation (one pass over the file); the first variant that matches a header wins
+        self._re_pojo = re.compile('|'.join((
+            # void mapXxx(SourceType source, TargetType target) - two params
+            r'(?P<two_params>(?:private|protected|public)?\s*void\s+(?P<v1_name>map\w+)\s*\([^)]*(?P<v1_st>\w+)\s+(?P<v1_sv>\w+)[^)]*,\s*(?P<v1_tt>\w+)\s+(?P<v1_tv>\w+)[^)]*\)\s*\{)',
+            # ReturnType mapXxx(SourceType source) - single param with return
+            r'(?P<single_param>(?:private|protected|public)?\s*(?P<v2_rt>\w+)\s+(?P<v2_name>map\w+)\s*\([^)]*(?P<v2_st>\w+)\s+(?P<v2_sv>\w+)[^)]*\)\s*\{)',
+            # void mapXxx(SourceType source) - single param void
+            r'(?P<single_param_void>(?:private|protected|public)?\s*void\s+(?P<v3_name>map\w+)\s*\([^)]*(?P<v3_st>\w+)\s+(?P<v3_sv>\w+)[^)]*\)\s*\{)',
+            # ReturnType map(SourceType source) - generic map methods
+            r'(?P<generic>(?:private|protected|public)?\s*(?P<v4_rt>\w+)\s+(?:map|convert|transform|to)\w*\s*\([^)]*(?P<v4_st>\w+)\s+(?P<v4_sv>\w+)[^)]*\)\s*\{)',
+        )), re.MULTILINE)
+        
+        self._re_misc_get = re.compile(r'\.get\(([^)]+)\)')
+        self._re_list_add = re.compile(r'(\w+)\.add\s*\((\w+)\)')
+        self._re_constant = re.compile(r'^[A-Z_][A-Z0-9_]*$')
+        # Class and interface headers in one alternation, so both lists come from a single pass
+        self._re_type_def = re.compile(
+            r'(?P<class>(?:public\s+)?(?:final\s+)?class\s+(?P<class_name>\w+)(?:\s+extends\s+\w+)?(?:\s+implements\s+[^{]+)?\s*\{)'
+            r'|(?P<interface>(?:public\s+)?interface\s+(?P<interface_name>\w+)(?:\s+extends\s+[^{]+)?\s*\{)'
+        )
+        
     def parse_file(self, file_path: str) -> Dict:
         """Parse a Java file and extract mapping information"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        digest = hashlib.sha256(f"{PARSER_VERSION}\0".encode()) if self.cache_dir is not None else None
+        content = self._read_source(file_path, digest)
+        
+        if self.cache_dir is None:
+            return self.parse_content(content, file_path)
+        
+        key = digest.hexdigest()
+        cache_file = self.cache_dir / key[:2] / key
+        try:
+            with open(cache_file, 'rb') as f:
+                result = pickle.load(f)
+            self._cache_stats['hits'] += 1
+            # Same content may live at another path
+            result['file_path'] = file_path
+            return result
+        except Exception:
+            # Missing, truncated or unreadable entry - parse again and (over)write it
+            pass
         
-        return self.parse_content(content, file_path)
+        self._cache_stats['misses'] += 1
+        result = self.parse_content(content, file_path)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(f"{key}.{os.getpid()}.tmp")
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+        return result
+    
+    @staticmethod
+    def _read_source(file_path: str, digest=None) -> str:
+        """Decode a source file straight from a memory map (no intermediate bytes copy)
+
+        Newlines are normalized as text-mode reading would; digest, if given, is
+        updated with the raw file bytes.
+        """
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if digest is not None:
+                    digest.update(mm)
+                content = str(mm, 'utf-8')
+                has_cr = mm.find(b'\r') != -1
+        if has_cr:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return content
     
     def parse_content(self, content: str, file_path: str = "") -> Dict:
         """Parse Java code content"""
@@ -35,52 +176,50 @@ class JavaParser:
             'interfaces': []
         }
         
+        # Comments are blanked out (same offsets) so no extractor matches commented-out code
+        content = _mask_comments(content)
+        blocks = _BlockIndex(content)
+        
         # Extract MapStruct mappings
-        result['mapstruct_mappings'] = self._extract_mapstruct_mappings(content)
+        if any(keyword in content for keyword in MAPSTRUCT_KEYWORDS):
+            result['mapstruct_mappings'] = self._extract_mapstruct_mappings(content, blocks)
         
         # Extract POJO mappings
-        result['pojo_mappings'] = self._extract_pojo_mappings(content)
+        if any(keyword in content for keyword in POJO_KEYWORDS):
+            result['pojo_mappings'] = self._extract_pojo_mappings(content, blocks)
         
         # Extract class and interface definitions
-        result['classes'] = self._extract_classes(content)
-        result['interfaces'] = self._extract_interfaces(content)
+        result['classes'], result['interfaces'] = self._extract_type_definitions(content)
         
         return result
     
-    def _extract_mapstruct_mappings(self, content: str) -> List[Dict]:
+    def _extract_mapstruct_mappings(self, content: str, blocks: Optional["_BlockIndex"] = None) -> List[MapStructMapping]:
         """Extract MapStruct annotation mappings"""
         mappings = []
+        if blocks is None:
+            blocks = _BlockIndex(content)
         
         # Find @Mapper interfaces
-        mapper_pattern = r'@Mapper\s*(?:\([^)]*\))?\s*(?:public\s+)?interface\s+(\w+)\s*\{'
-        mapper_matches = re.finditer(mapper_pattern, content, re.MULTILINE)
+        mapper_matches = self._re_mapper.finditer(content)
         
         for mapper_match in mapper_matches:
             interface_name = mapper_match.group(1)
             interface_start = mapper_match.start()
             
-            # Find the end of the interface
-            brace_count = 0
-            in_interface = False
-            interface_end = len(content)
-            
-            for i in range(interface_start, len(content)):
-                if content[i] == '{':
-                    brace_count += 1
-                    in_interface = True
-                elif content[i] == '}':
-                    brace_count -= 1
-                    if in_interface and brace_count == 0:
-                        interface_end = i + 1
-                        break
+            # Find the end of the interface body (the pattern ends on its opening brace, so
+            # braces inside @Mapper(uses = {...}) are not mistaken for the body)
+            interface_end = blocks.end_of(mapper_match.end() - 1)
+            if interface_end == -1:
+                interface_end = len(content)
             
             interface_content = content[interface_start:interface_end]
+            # Mappers relying only on implicit same-name mappings skip the per-method lookback
+            has_annotations = '@Mapping' in interface_content
             
             # Extract mapping methods - improved pattern to handle various method signatures
             # Pattern matches: ReturnType methodName(ParamType paramName);
             # Also handles generics, multiple parameters, etc.
-            method_pattern = r'(\w+(?:<[^>]+>)?(?:\s*\[\])?)\s+(\w+)\s*\([^)]*\)\s*;'
-            method_matches = re.finditer(method_pattern, interface_content)
+            method_matches = self._re_method.finditer(interface_content)
             
             for method_match in method_matches:
                 return_type = method_match.group(1).strip()
@@ -88,10 +227,10 @@ class JavaParser:
                 
                 # Extract parameter type from method signature
                 method_full = method_match.group(0)
-                param_match = re.search(r'\(([^)]+)\)', method_full)
+                param_match = self._re_params.search(method_full)
                 param_type = None
                 if param_match:
-                    param_str = param_match.group(1).strip()
+                    param_str = param_match[1].strip()
                     # Extract first parameter type
                     param_parts = param_str.split()
                     if len(param_parts) >= 1:
@@ -100,178 +239,149 @@ class JavaParser:
                 # Find @Mapping annotations for this method
                 method_start_in_interface = method_match.start()
                 
-                # Look backwards for @Mapping annotations (within interface content)
-                # Search up to 50 lines before the method
-                lines_before = interface_content[:method_start_in_interface].split('\n')
-                annotation_lines = lines_before[-50:] if len(lines_before) > 50 else lines_before
-                annotation_section = '\n'.join(annotation_lines)
-                
-                # Extract @Mapping annotations
-                mapping_annotations = self._extract_mapping_annotations(annotation_section)
+                mapping_annotations = []
+                if has_annotations:
+                    # Look backwards for @Mapping annotations (within interface content)
+                    # Search up to 50 lines before the method
+                    annotation_section = self._slice_last_n_lines(interface_content, method_start_in_interface, 50)
+                    
+                    # Extract @Mapping annotations
+                    mapping_annotations = self._extract_mapping_annotations(annotation_section)
                 
                 if mapping_annotations:
                     for mapping in mapping_annotations:
-                        mappings.append({
-                            'type': 'mapstruct',
-                            'interface': interface_name,
-                            'method': method_name,
-                            'return_type': return_type,
-                            'source_type': param_type or 'Unknown',
-                            'source_field': mapping.get('source'),
-                            'target_field': mapping.get('target'),
-                            'expression': mapping.get('expression'),
-                            'qualified_by': mapping.get('qualified_by'),
-                            'ignore': mapping.get('ignore', False)
-                        })
+                        mappings.append(MapStructMapping(
+                            interface=interface_name,
+                            method=method_name,
+                            return_type=return_type,
+                            source_type=param_type or 'Unknown',
+                            source_field=mapping.get('source'),
+                            target_field=mapping.get('target'),
+                            expression=mapping.get('expression'),
+                            qualified_by=mapping.get('qualified_by'),
+                            ignore=mapping.get('ignore', False)
+                        ))
                 elif param_type:  # Only add implicit if we have a parameter type
                     # Implicit mapping (same field names) - create one entry per method
-                    mappings.append({
-                        'type': 'mapstruct',
-                        'interface': interface_name,
-                        'method': method_name,
-                        'return_type': return_type,
-                        'source_type': param_type,
-                        'source_field': None,  # Will be inferred
-                        'target_field': None,  # Will be inferred
-                        'implicit': True
-                    })
+                    mappings.append(MapStructMapping(
+                        interface=interface_name,
+                        method=method_name,
+                        return_type=return_type,
+                        source_type=param_type,
+                        source_field=None,  # Will be inferred
+                        target_field=None,  # Will be inferred
+                        implicit=True
+                    ))
         
         return mappings
     
+    @staticmethod
+    def _slice_last_n_lines(text: str, end: int, n: int = 50) -> str:
+        """Return the last n lines of text[:end] without splitting the whole prefix"""
+        pos = end
+        for _ in range(n):
+            pos = text.rfind('\n', 0, pos)
+            if pos < 0:
+                return text[:end]
+        return text[pos + 1:end]
+    
     def _extract_mapping_annotations(self, annotation_section: str) -> List[Dict]:
         """Extract @Mapping annotation details"""
         mappings = []
         
-        # Improved pattern for @Mapping annotation - handles various formats
+        # Handles various formats, standalone or nested in @Mappings({...}):
         # Pattern 1: @Mapping(source = "...", target = "...")
         # Pattern 2: @Mapping(target = "...")
-        # Pattern 3: @Mapping(source = "...", target = "...", expression = "...")
-        pattern = r'@Mapping\s*\(\s*([^)]+)\s*\)'
-        
-        matches = re.finditer(pattern, annotation_section, re.MULTILINE | re.DOTALL)
-        
-        for match in matches:
-            params_str = match.group(1)
-            
-            # Extract source
-            source_match = re.search(r'source\s*=\s*["\']([^"\']+)["\']', params_str)
-            source = source_match.group(1) if source_match else None
-            
-            # Extract target
-            target_match = re.search(r'target\s*=\s*["\']([^"\']+)["\']', params_str)
-            target = target_match.group(1) if target_match else None
-            
-            # Extract expression
-            expr_match = re.search(r'expression\s*=\s*["\']([^"\']+)["\']', params_str)
-            expression = expr_match.group(1) if expr_match else None
-            
-            # Extract ignore
-            ignore_match = re.search(r'ignore\s*=\s*(true|false)', params_str)
-            ignore = ignore_match.group(1) == 'true' if ignore_match else False
+        # Pattern 3: @Mapping(source = "...", target = "...", expression = "java(...)")
+        # One pass over the section; the argument list is cut at the balancing ')'
+        for match in self._re_mapping_start.finditer(annotation_section):
+            params_end = _find_balanced_end(annotation_section, match.end(), 1, '(', ')')
+            if params_end == -1:
+                continue
+            params_str = annotation_section[match.end():params_end - 1]
             
             # At least target should be present for a valid mapping
-            if target:
-                mappings.append({
-                    'source': source,
-                    'target': target,
-                    'expression': expression,
-                    'ignore': ignore
-                })
-        
-        # Also check for @Mappings with multiple @Mapping
-        mappings_pattern = r'@Mappings\s*\(\s*\{([^}]+)\}\s*\)'
-        mappings_match = re.search(mappings_pattern, annotation_section, re.DOTALL)
-        
-        if mappings_match:
-            mappings_content = mappings_match.group(1)
-            inner_mappings = self._extract_mapping_annotations(mappings_content)
-            mappings.extend(inner_mappings)
+            target_match = self._re_target.search(params_str)
+            if not target_match:
+                continue
+            
+            # Match[1] instead of .group(1): same string, cheaper call
+            source_match = self._re_source.search(params_str)
+            expr_match = self._re_expr.search(params_str)
+            ignore_match = self._re_ignore.search(params_str)
+            mappings.append({
+                'source': source_match[1] if source_match else None,
+                'target': target_match[1],
+                'expression': expr_match[1] if expr_match else None,
+                'ignore': ignore_match[1] == 'true' if ignore_match else False
+            })
         
         return mappings
     
-    def _extract_pojo_mappings(self, content: str) -> List[Dict]:
+    def _extract_pojo_mappings(self, content: str, blocks: Optional["_BlockIndex"] = None) -> List[PojoMapping]:
         """Extract POJO-based mappings (manual mapping methods)"""
         mappings = []
+        if blocks is None:
+            blocks = _BlockIndex(content)
         
-        # Pattern for mapping methods:
-        # - void mapXxx(SourceType source, TargetType target)
-        # - TargetType map(SourceType source)
-        # - private/protected/public void mapXxx(...)
-        # - Methods starting with map, convert, transform, to
-        method_patterns = [
-            # void mapXxx(SourceType source, TargetType target) - two params
-            r'(?:private|protected|public)?\s*void\s+(map\w+)\s*\([^)]*(\w+)\s+(\w+)[^)]*,\s*(\w+)\s+(\w+)[^)]*\)\s*\{',
-            # ReturnType mapXxx(SourceType source) - single param with return
-            r'(?:private|protected|public)?\s*(\w+)\s+(map\w+)\s*\([^)]*(\w+)\s+(\w+)[^)]*\)\s*\{',
-            # void mapXxx(SourceType source) - single param void
-            r'(?:private|protected|public)?\s*void\s+(map\w+)\s*\([^)]*(\w+)\s+(\w+)[^)]*\)\s*\{',
-            # ReturnType map(SourceType source) - generic map methods
-            r'(?:private|protected|public)?\s*(\w+)\s+(?:map|convert|transform|to)\w*\s*\([^)]*(\w+)\s+(\w+)[^)]*\)\s*\{',
-        ]
-        
-        for pattern in method_patterns:
-            matches = re.finditer(pattern, content, re.MULTILINE)
+        for match in self._re_pojo.finditer(content):
+            variant = match.lastgroup
             
-            for match in matches:
-                groups = match.groups()
-                
-                # Handle different pattern formats
-                if len(groups) == 5:  # void mapXxx(SourceType source, TargetType target)
-                    method_name = groups[0]
-                    source_type = groups[1]
-                    source_var = groups[2]
-                    target_type = groups[3]
-                    target_var = groups[4]
-                    return_type = 'void'
-                elif len(groups) == 4:  # ReturnType mapXxx(SourceType source)
-                    return_type = groups[0]
-                    method_name = groups[1]
-                    source_type = groups[2]
-                    source_var = groups[3]
-                    target_type = return_type
-                    target_var = None  # Will be inferred from assignments
-                else:  # ReturnType map(SourceType source)
-                    return_type = groups[0]
-                    method_name = None
-                    source_type = groups[1]
-                    source_var = groups[2]
-                    target_type = return_type
-                    target_var = None
-                
-                # Find the method body
-                method_start = match.end()
-                brace_count = 1
+            # Handle different pattern formats
+            if variant == 'two_params':  # void mapXxx(SourceType source, TargetType target)
+                method_name = match.group('v1_name')
+                source_type = match.group('v1_st')
+                source_var = match.group('v1_sv')
+                target_type = match.group('v1_tt')
+                target_var = match.group('v1_tv')
+                return_type = 'void'
+            elif variant == 'single_param':  # ReturnType mapXxx(SourceType source)
+                return_type = match.group('v2_rt')
+                method_name = match.group('v2_name')
+                source_type = match.group('v2_st')
+                source_var = match.group('v2_sv')
+                target_type = return_type
+                target_var = None  # Will be inferred from assignments
+            elif variant == 'single_param_void':  # void mapXxx(SourceType source)
+                return_type = 'void'
+                method_name = match.group('v3_name')
+                source_type = match.group('v3_st')
+                source_var = match.group('v3_sv')
+                target_type = return_type
+                target_var = None
+            else:  # ReturnType map(SourceType source)
+                return_type = match.group('v4_rt')
+                method_name = None
+                source_type = match.group('v4_st')
+                source_var = match.group('v4_sv')
+                target_type = return_type
+                target_var = None
+            
+            # Find the method body (the pattern already consumed the opening brace)
+            method_start = match.end()
+            method_end = blocks.end_of(method_start - 1)
+            if method_end == -1:
                 method_end = method_start
-                
-                for i in range(method_start, len(content)):
-                    if content[i] == '{':
-                        brace_count += 1
-                    elif content[i] == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            method_end = i + 1
-                            break
-                
-                method_body = content[method_start:method_end]
-                
-                # Extract field assignments with improved detection
-                if target_var:
-                    field_assignments = self._extract_field_assignments_enhanced(
-                        method_body, source_var, source_type, target_var, target_type
-                    )
-                else:
-                    # Fallback to original extraction
-                    field_assignments = self._extract_field_assignments(method_body, source_var, target_type)
-                
-                if field_assignments:
-                    mappings.append({
-                        'type': 'pojo',
-                        'method': method_name,
-                        'return_type': return_type,
-                        'source_type': source_type,
-                        'target_type': target_type,
-                        'mappings': field_assignments
-                    })
+            
+            method_body = content[method_start:method_end]
+            
+            # Extract field assignments with improved detection
+            if target_var:
+                field_assignments = self._extract_field_assignments_enhanced(
+                    method_body, source_var, source_type, target_var, target_type
+                )
+            else:
+                # Fallback to original extraction
+                field_assignments = self._extract_field_assignments(method_body, source_var, target_type)
+            
+            if field_assignments:
+                mappings.append(PojoMapping(
+                    method=method_name,
+                    return_type=return_type,
+                    source_type=source_type,
+                    target_type=target_type,
+                    mappings=field_assignments
+                ))
         
         return mappings
     
@@ -279,10 +389,10 @@ class JavaParser:
                                             target_var: str, target_type: str) -> List[Dict]:
         """Extract field assignments from method body with enhanced detection"""
         assignments = []
+        var_res = _compile_for_var(source_var, target_var)
         
         # Pattern 1: target.setField(source.getField())
-        setter_pattern = r'(\w+)\.set(\w+)\s*\(\s*' + re.escape(source_var) + r'\.get(\w+)\s*\(\)\s*\)'
-        matches = re.finditer(setter_pattern, method_body)
+        matches = var_res.setter.finditer(method_body)
         
         for match in matches:
             target_var_name = match.group(1)
@@ -290,8 +400,8 @@ class JavaParser:
             source_field = match.group(3)
             
             # Convert to camelCase
-            target_field = target_field[0].lower() + target_field[1:] if target_field else target_field
-            source_field = source_field[0].lower() + source_field[1:] if source_field else source_field
+            target_field = _to_camel(target_field)
+            source_field = _to_camel(source_field)
             
             assignments.append({
                 'source_field': source_field,
@@ -300,8 +410,7 @@ class JavaParser:
             })
         
         # Pattern 2: target.field = source.field
-        direct_pattern = r'(\w+)\.(\w+)\s*=\s*' + re.escape(source_var) + r'\.(\w+)'
-        matches = re.finditer(direct_pattern, method_body)
+        matches = var_res.direct.finditer(method_body)
         
         for match in matches:
             target_var_name = match.group(1)
@@ -324,15 +433,14 @@ class JavaParser:
             
             # Pattern: source.getX().get(Y) instanceof String localVar
             # More flexible pattern to catch: purchaseLineItem.getMiscAttributes().get(SPECIAL_INSTRUCTIONS) instanceof String orderLineComment
-            instanceof_pattern = rf'{re.escape(source_var)}\.[^&]+instanceof\s+\w+\s+(\w+)'
-            instanceof_matches = re.finditer(instanceof_pattern, method_body, re.DOTALL)
+            instanceof_matches = var_res.instanceof.finditer(method_body)
             for im in instanceof_matches:
                 local_var = im.group(1)
                 full_match = im.group(0)
                 # Extract the source path - look for getMiscAttributes().get(...)
                 if "getMiscAttributes" in full_match:
                     # Extract what's inside .get(...) - could be SPECIAL_INSTRUCTIONS constant
-                    get_matches = list(re.finditer(r'\.get\(([^)]+)\)', full_match))
+                    get_matches = list(self._re_misc_get.finditer(full_match))
                     if get_matches:
                         # Get the last .get() call which is the key
                         key = get_matches[-1].group(1)
@@ -347,29 +455,26 @@ class JavaParser:
                         local_var_sources[local_var] = "miscAttributes"
                 else:
                     # Extract source field from nested_value
-                    source_path_match = re.search(rf'{re.escape(source_var)}\.get(\w+)\s*\(\)', full_match)
+                    source_path_match = var_res.getter.search(full_match)
                     if source_path_match:
                         base_field = source_path_match.group(1)
-                        local_var_sources[local_var] = base_field[0].lower() + base_field[1:] if base_field else "unknown"
+                        local_var_sources[local_var] = _to_camel(base_field) if base_field else "unknown"
             
             # Pattern: localVar = source.getX()
-            assignment_pattern = rf'(\w+)\s*=\s*{re.escape(source_var)}\.get(\w+)\s*\(\)'
-            assignment_matches = re.finditer(assignment_pattern, method_body)
+            assignment_matches = var_res.local_assignment.finditer(method_body)
             for am in assignment_matches:
                 local_var = am.group(1)
                 source_field = am.group(2)
-                local_var_sources[local_var] = source_field[0].lower() + source_field[1:] if source_field else source_field
+                local_var_sources[local_var] = _to_camel(source_field)
             
             # Find: target.setField(localVar) or target.getField().add(localVar)
             # Pattern should capture: orderLine.setNotes(notes) -> field=Notes, var=notes
-            target_setter_pattern = rf'{re.escape(target_var)}\.set(\w+)\s*\(\s*(\w+)\s*\)'
-            target_matches = re.finditer(target_setter_pattern, method_body)
+            target_matches = var_res.target_setter.finditer(method_body)
             
             # Track variables that are added to lists: listVar.add(itemVar)
             # This helps us find nested objects in collections
             list_items = {}  # Maps list variable to list of item variables
-            list_add_pattern = r'(\w+)\.add\s*\((\w+)\)'
-            list_add_matches = re.finditer(list_add_pattern, method_body)
+            list_add_matches = self._re_list_add.finditer(method_body)
             for lam in list_add_matches:
                 list_var = lam.group(1)
                 item_var = lam.group(2)
@@ -389,8 +494,7 @@ class JavaParser:
                 all_vars_to_check = item_vars if item_vars else [local_var]
                 local_setters = []
                 for item_var in all_vars_to_check:
-                    local_var_pattern = rf'{re.escape(item_var)}\.set(\w+)\s*\(([^)]+)\)'
-                    for setter_match in re.finditer(local_var_pattern, method_body):
+                    for setter_match in _compile_setter_for_var(item_var).finditer(method_body):
                         local_setters.append((item_var, setter_match, item_var in item_vars))
                 
                 for item_var, setter_match, is_list_item in local_setters:
@@ -401,10 +505,10 @@ class JavaParser:
                     source_field = None
                     if source_var in nested_value:
                         # Extract source field from nested_value
-                        source_field_match = re.search(rf'{re.escape(source_var)}\.get(\w+)\s*\(\)', nested_value)
+                        source_field_match = var_res.getter.search(nested_value)
                         if source_field_match:
                             source_field = source_field_match.group(1)
-                            source_field = source_field[0].lower() + source_field[1:] if source_field else source_field
+                            source_field = _to_camel(source_field)
                         elif "getMiscAttributes" in nested_value:
                             # Complex path like getMiscAttributes().get(SPECIAL_INSTRUCTIONS)
                             source_field = "miscAttributes.specialInstructions"
@@ -416,7 +520,7 @@ class JavaParser:
                     else:
                         # Constant or expression - check if it's a constant (all caps with underscores)
                         clean_value = nested_value.strip()
-                        if re.match(r'^[A-Z_][A-Z0-9_]*$', clean_value):
+                        if self._re_constant.match(clean_value):
                             # It's a constant like NOTE_TYPE_CUSTOMER_COMMENT
                             # Mark it as a constant but keep the value for reference
                             source_field = f"constant:{clean_value}"
@@ -425,8 +529,8 @@ class JavaParser:
                         else:
                             source_field = "constant"
                     
-                    target_field_camel = target_field[0].lower() + target_field[1:] if target_field else target_field
-                    nested_field_camel = nested_field[0].lower() + nested_field[1:] if nested_field else nested_field
+                    target_field_camel = _to_camel(target_field)
+                    nested_field_camel = _to_camel(nested_field)
                     
                     # Build target path - if it's a list item, use [] notation
                     if is_list_item:
@@ -445,10 +549,10 @@ class JavaParser:
                     
                     # Also extract if nested_value comes from source (like purchaseLineItem.getCreatedDate())
                     if source_var in nested_value:
-                        source_getter_match = re.search(rf'{re.escape(source_var)}\.get(\w+)\s*\(\)', nested_value)
+                        source_getter_match = var_res.getter.search(nested_value)
                         if source_getter_match:
                             direct_source_field = source_getter_match.group(1)
-                            direct_source_field = direct_source_field[0].lower() + direct_source_field[1:] if direct_source_field else direct_source_field
+                            direct_source_field = _to_camel(direct_source_field)
                             assignments.append({
                                 'source_field': direct_source_field,
                                 'target_field': f"{target_field_camel}[].{nested_field_camel}",
@@ -456,46 +560,18 @@ class JavaParser:
                                 'value': nested_value[:100]
                             })
         
-        # Pattern 4: Complex nested paths like purchaseLineItem.getMiscAttributes().get(SPECIAL_INSTRUCTIONS)
-        # Extract these as source fields
-        complex_source_pattern = rf'{re.escape(source_var)}\.get(\w+)\s*\(\)(?:\.get\([^)]+\))?'
-        complex_matches = re.finditer(complex_source_pattern, method_body)
-        
-        for complex_match in complex_matches:
-            base_field = complex_match.group(1)
-            base_field = base_field[0].lower() + base_field[1:] if base_field else base_field
-            
-            # Find where this is used in target assignments
-            # This is a simplified extraction - full implementation would need AST parsing
-            pass
-        
-        # Pattern 5: Direct constant assignments to target fields
-        # Like: note.setNoteType(NOTE_TYPE_CUSTOMER_COMMENT)
-        # We already handle this in Pattern 3, but let's also track direct assignments
-        constant_setter_pattern = r'(\w+)\.set(\w+)\s*\(([^)]+)\)'
-        constant_matches = re.finditer(constant_setter_pattern, method_body)
-        
-        for const_match in constant_matches:
-            var_name = const_match.group(1)
-            field_name = const_match.group(2)
-            value = const_match.group(3).strip()
-            
-            # If this variable is later assigned to target, track it
-            # Check if var_name is added to target
-            if var_name not in [source_var, 'this'] and len(value) < 100:
-                field_camel = field_name[0].lower() + field_name[1:] if field_name else field_name
-                # This will be linked to target in Pattern 3 above
-                pass
+        # Complex nested paths (source.getMiscAttributes().get(KEY)) and constant setters on
+        # local objects are covered by Pattern 3 when those objects end up on the target.
         
         return assignments
     
     def _extract_field_assignments(self, method_body: str, source_var: str, target_type: str) -> List[Dict]:
         """Extract field assignments from method body (original method for backward compatibility)"""
         assignments = []
+        var_res = _compile_for_var(source_var, None)
         
         # Pattern 1: target.setField(source.getField())
-        setter_pattern = r'(\w+)\.set(\w+)\s*\(\s*' + re.escape(source_var) + r'\.get(\w+)\s*\(\)\s*\)'
-        matches = re.finditer(setter_pattern, method_body)
+        matches = var_res.setter.finditer(method_body)
         
         for match in matches:
             target_var = match.group(1)
@@ -503,8 +579,8 @@ class JavaParser:
             source_field = match.group(3)
             
             # Convert to camelCase
-            target_field = target_field[0].lower() + target_field[1:] if target_field else target_field
-            source_field = source_field[0].lower() + source_field[1:] if source_field else source_field
+            target_field = _to_camel(target_field)
+            source_field = _to_camel(source_field)
             
             assignments.append({
                 'source_field': source_field,
@@ -512,8 +588,7 @@ class JavaParser:
             })
         
         # Pattern 2: target.field = source.field
-        direct_pattern = r'(\w+)\.(\w+)\s*=\s*' + re.escape(source_var) + r'\.(\w+)'
-        matches = re.finditer(direct_pattern, method_body)
+        matches = var_res.direct.finditer(method_body)
         
         for match in matches:
             target_var = match.group(1)
@@ -527,33 +602,33 @@ class JavaParser:
         
         return assignments
     
-    def _extract_classes(self, content: str) -> List[Dict]:
-        """Extract class definitions"""
+    def _extract_type_definitions(self, content: str) -> Tuple[List[Dict], List[Dict]]:
+        """Extract class and interface definitions"""
         classes = []
-        pattern = r'(?:public\s+)?(?:final\s+)?class\s+(\w+)(?:\s+extends\s+\w+)?(?:\s+implements\s+[^{]+)?\s*\{'
-        
-        matches = re.finditer(pattern, content)
-        for match in matches:
-            classes.append({
-                'name': match.group(1),
-                'position': match.start()
-            })
-        
-        return classes
-    
-    def _extract_interfaces(self, content: str) -> List[Dict]:
-        """Extract interface definitions"""
         interfaces = []
-        pattern = r'(?:public\s+)?interface\s+(\w+)(?:\s+extends\s+[^{]+)?\s*\{'
-        
-        matches = re.finditer(pattern, content)
-        for match in matches:
-            interfaces.append({
-                'name': match.group(1),
-                'position': match.start()
-            })
+        for match in self._re_type_def.finditer(content):
+            if match.lastgroup == 'class':
+                classes.append({
+                    'name': match.group('class_name'),
+                    'position': match.start()
+                })
+            else:
+                interfaces.append({
+                    'name': match.group('interface_name'),
+                    'position': match.start()
+                })
         
-        return interfaces
+        return classes, interfaces
+    
+    def parse_directory(self, path: str, recursive: bool = True, exclude_patterns: List[str] = None,
+                        workers: Optional[int] = None) -> List[Dict]:
+        """Find and parse all Java files under path, spreading the files over worker processes"""
+        files = self.find_java_files(path, recursive, exclude_patterns=exclude_patterns)
+        if not files:
+            return []
+        # Workers build their own parser; only the path and cache dir cross the process boundary
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_parse_one, files, repeat(self.cache_dir), chunksize=16))
     
     def find_java_files(self, path: str, recursive: bool = True, extensions: List[str] = None, 
                        exclude_patterns: List[str] = None) -> List[str]:
@@ -564,7 +639,6 @@ class JavaParser:
         if exclude_patterns is None:
             exclude_patterns = []
         
-        java_files = []
         path_obj = Path(path)
         
         if path_obj.is_file() and path_obj.suffix in extensions:
@@ -573,53 +647,268 @@ class JavaParser:
                 return [str(path_obj)]
             return []
         
-        if path_obj.is_dir():
-            if recursive:
-                for ext in extensions:
-                    all_files = path_obj.rglob(f'*{ext}')
-                    for file_path in all_files:
-                        # Early exclusion check for better performance
-                        if not self._should_exclude_file(str(file_path), exclude_patterns):
-                            java_files.append(file_path)
-            else:
-                for ext in extensions:
-                    all_files = path_obj.glob(f'*{ext}')
-                    for file_path in all_files:
-                        if not self._should_exclude_file(str(file_path), exclude_patterns):
-                            java_files.append(file_path)
+        if not path_obj.is_dir():
+            return []
         
-        return [str(f) for f in java_files]
+        # Directories whose whole subtree is excluded are not listed at all
+        prune = _compile_prune_patterns(tuple(exclude_patterns)) if exclude_patterns else None
+        if recursive:
+            candidates = self._walk_directory(str(path_obj), tuple(extensions), prune)
+        else:
+            candidates, _ = self._scan_directory(str(path_obj), tuple(extensions))
+        
+        if not exclude_patterns:
+            return sorted(candidates)
+        # One combined regex, looked up once for the whole walk rather than per file
+        excluded = _compile_exclude_patterns(tuple(exclude_patterns)).match
+        return sorted(f for f in candidates if excluded(f.replace('\\', '/')) is None)
+    
+    @staticmethod
+    def _scan_directory(directory: str, extensions: Tuple[str, ...],
+                        prune: Optional["re.Pattern"] = None) -> Tuple[List[str], List[str]]:
+        """List one directory, returning (matching files, subdirectories not pruned)"""
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if prune is None or not prune.match(entry.path.replace('\\', '/') + '/'):
+                                subdirs.append(entry.path)
+                        elif entry.name.endswith(extensions) and entry.is_file():
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files, subdirs
+    
+    def _walk_directory(self, root: str, extensions: Tuple[str, ...], prune: Optional["re.Pattern"] = None,
+                        max_workers: int = 8) -> List[str]:
+        """Walk a directory tree, listing directories in parallel to overlap filesystem latency"""
+        files = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(self._scan_directory, root, extensions, prune)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, subdirs = future.result()
+                    files.extend(found)
+                    for subdir in subdirs:
+                        pending.add(executor.submit(self._scan_directory, subdir, extensions, prune))
+        return files
     
     def _should_exclude_file(self, file_path: str, exclude_patterns: List[str]) -> bool:
         """Check if a file should be excluded based on patterns"""
-        from fnmatch import fnmatch
+        if not exclude_patterns:
+            return False
         
         # Normalize path separators
         normalized_path = file_path.replace('\\', '/')
-        
-        for pattern in exclude_patterns:
-            # Convert glob pattern to match against path
-            # Handle ** patterns
-            if '**' in pattern:
-                # Convert ** pattern to regex-like matching
-                pattern_parts = pattern.split('**')
-                if len(pattern_parts) == 2:
-                    # Pattern like "**/target/**"
-                    if pattern_parts[0] and not normalized_path.startswith(pattern_parts[0].lstrip('/')):
-                        continue
-                    if pattern_parts[1] and not normalized_path.endswith(pattern_parts[1].rstrip('/')):
-                        continue
-                    # Check if any part of the path matches
-                    if pattern_parts[0].lstrip('/') in normalized_path or pattern_parts[1].rstrip('/') in normalized_path:
-                        return True
-                else:
-                    # Simple ** pattern
-                    if fnmatch(normalized_path, pattern) or pattern.replace('**', '*') in normalized_path:
-                        return True
-            else:
-                # Simple pattern matching
-                if fnmatch(normalized_path, pattern) or pattern in normalized_path:
-                    return True
-        
-        return False
+        return _compile_exclude_patterns(tuple(exclude_patterns)).match(normalized_path) is not None
+
+
+@lru_cache(maxsize=32)
+def _compile_exclude_patterns(exclude_patterns: Tuple[str, ...]) -> "re.Pattern":
+    """Combine all exclusion globs into one regex so each path is matched once
+
+    Each glob is matched against the whole path ('*' also crosses '/', so "**/target/**"
+    excludes anything under a target directory). Plain patterns without '**' also match
+    as a literal substring of the path.
+    """
+    alternatives = []
+    for pattern in exclude_patterns:
+        alternatives.append(fnmatch.translate(pattern))
+        if '**' not in pattern:
+            alternatives.append('(?s:.*?)' + re.escape(pattern))
+    flags = re.IGNORECASE if os.name == 'nt' else 0
+    return re.compile('(?:' + '|'.join(alternatives) + ')', flags)
+
+
+@lru_cache(maxsize=32)
+def _compile_prune_patterns(exclude_patterns: Tuple[str, ...]) -> Optional["re.Pattern"]:
+    """Regex matching 'dir/' when every path below dir is excluded, or None
+
+    Only globs ending in '/**' or '/*' (e.g. "**/target/**") and plain substring patterns
+    qualify: if they match 'dir/' they also match 'dir/<anything>'.
+    """
+    alternatives = []
+    for pattern in exclude_patterns:
+        if pattern.endswith(('/**', '/*')):
+            alternatives.append(fnmatch.translate(pattern))
+        if '**' not in pattern:
+            alternatives.append('(?s:.*?)' + re.escape(pattern))
+    if not alternatives:
+        return None
+    flags = re.IGNORECASE if os.name == 'nt' else 0
+    return re.compile('(?:' + '|'.join(alternatives) + ')', flags)
+
+
+def _find_balanced_end(text: str, start: int, depth: int, open_ch: str, close_ch: str) -> int:
+    """Index just past the close_ch that brings depth back to zero, scanning from start, or -1"""
+    pos = start
+    while True:
+        next_close = text.find(close_ch, pos)
+        if next_close == -1:
+            return -1
+        next_open = text.find(open_ch, pos, next_close)
+        if next_open != -1:
+            depth += 1
+            pos = next_open + 1
+        else:
+            depth -= 1
+            pos = next_close + 1
+            if depth == 0:
+                return pos
+
+
+@lru_cache(maxsize=4096)
+def _to_camel(name: str) -> str:
+    """Lower-case the first letter of a getter/setter field name (field names repeat a lot)"""
+    return name[:1].lower() + name[1:]
+
+
+# Comments, plus the literals that may contain comment markers ("http://...", '/')
+_COMMENT_OR_LITERAL = re.compile(
+    r'(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))'
+    r'|"""(?:\\.|[^\\])*?"""'
+    r'|"(?:\\.|[^"\\\n])*"'
+    r"|'(?:\\.|[^'\\\n])*'",
+    re.DOTALL
+)
+
+
+def _blank(match: "re.Match") -> str:
+    """Replace a comment with spaces, keeping its newlines; leave literals as they are"""
+    text = match.group()
+    if match.lastgroup != 'comment':
+        return text
+    if '\n' not in text:
+        return ' ' * len(text)
+    return '\n'.join(' ' * len(line) for line in text.split('\n'))
+
+
+def _mask_comments(content: str) -> str:
+    """Blank out // and /* */ comments in one pass, preserving every offset and line break"""
+    if '//' not in content and '/*' not in content:
+        return content
+    return _COMMENT_OR_LITERAL.sub(_blank, content)
+
+
+class _BlockIndex:
+    """Lazily built map from each '{' in a file to the index just past its matching '}'
+
+    Built with one pass over the file's braces the first time it is needed, so every
+    mapper/method lookup afterwards is a dict hit instead of a scan over its body.
+    Large ASCII files scan per block with the numba kernel instead (see _brace_scan_buffer).
+    """
+    
+    _BRACES = re.compile(r'[{}]')
+    
+    def __init__(self, content: str):
+        self._content = content
+        self._ends: Optional[Dict[int, int]] = None
+        self._buf = None
+        self._use_buf = None
+    
+    def end_of(self, open_pos: int) -> int:
+        """End of the block whose '{' is at open_pos, or -1 if it is never closed"""
+        if self._use_buf is None:
+            self._buf = _brace_scan_buffer(self._content)
+            self._use_buf = self._buf is not None
+        if self._use_buf:
+            return _scan_block_end(self._buf, open_pos, 0)
+        if self._ends is None:
+            self._ends = self._build()
+        return self._ends.get(open_pos, -1)
+    
+    def _build(self) -> Dict[int, int]:
+        ends = {}
+        stack = []
+        for match in self._BRACES.finditer(self._content):
+            if match.group() == '{':
+                stack.append(match.start())
+            elif stack:
+                ends[stack.pop()] = match.end()
+        return ends
+
+
+def _scan_block_end(buf, start: int, depth: int) -> int:
+    """Brace-depth scan over the bytes of an ASCII file (same result as _BlockIndex lookups)"""
+    n = len(buf)
+    i = start
+    while i < n:
+        c = buf[i]
+        if c == 123:  # '{'
+            depth += 1
+        elif c == 125:  # '}'
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
+if NUMBA_AVAILABLE:
+    _scan_block_end = numba.njit(cache=True)(_scan_block_end)
+
+
+def _brace_scan_buffer(content: str):
+    """uint8 view of content for the numba scanner, or None to use str.find
+
+    Only for large ASCII files, where byte offsets and string offsets coincide.
+    """
+    if not NUMBA_AVAILABLE or len(content) < NUMBA_MIN_SIZE or not content.isascii():
+        return None
+    return np.frombuffer(content.encode('ascii'), dtype=np.uint8)
+
+
+_process_parsers: Dict[Optional[Path], JavaParser] = {}
+
+
+def _parse_one(file_path: str, cache_dir: Optional[Path] = None) -> Dict:
+    """Parse one file with a per-process parser (module-level so ProcessPoolExecutor can pickle it)"""
+    parser = _process_parsers.get(cache_dir)
+    if parser is None:
+        parser = _process_parsers[cache_dir] = JavaParser(cache_dir=cache_dir)
+    try:
+        return parser.parse_file(file_path)
+    except Exception as e:
+        return {
+            'file_path': file_path,
+            'mapstruct_mappings': [],
+            'pojo_mappings': [],
+            'classes': [],
+            'interfaces': [],
+            'error': str(e)
+        }
+
+
+class _VarPatterns(NamedTuple):
+    """Field assignment regexes bound to one mapping method's source/target variables"""
+    setter: "re.Pattern"
+    direct: "re.Pattern"
+    instanceof: "re.Pattern"
+    getter: "re.Pattern"
+    local_assignment: "re.Pattern"
+    target_setter: Optional["re.Pattern"]
+
+
+@lru_cache(maxsize=256)
+def _compile_for_var(source_var: str, target_var: Optional[str]) -> _VarPatterns:
+    """Compile the variable-specific patterns once; mapping methods mostly reuse the same names"""
+    source = re.escape(source_var)
+    return _VarPatterns(
+        setter=re.compile(r'(\w+)\.set(\w+)\s*\(\s*' + source + r'\.get(\w+)\s*\(\)\s*\)'),
+        direct=re.compile(r'(\w+)\.(\w+)\s*=\s*' + source + r'\.(\w+)'),
+        instanceof=re.compile(rf'{source}\.[^&]+instanceof\s+\w+\s+(\w+)', re.DOTALL),
+        getter=re.compile(rf'{source}\.get(\w+)\s*\(\)'),
+        local_assignment=re.compile(rf'(\w+)\s*=\s*{source}\.get(\w+)\s*\(\)'),
+        target_setter=re.compile(rf'{re.escape(target_var)}\.set(\w+)\s*\(\s*(\w+)\s*\)') if target_var else None,
+    )
+
 
+@lru_cache(maxsize=256)
+def _compile_setter_for_var(var: str) -> "re.Pattern":
+    """var.setXxx(value) for a local variable"""
+    return re.compile(rf'{re.escape(var)}\.set(\w+)\s*\(([^)]+)\)')
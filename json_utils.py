@@ -0,0 +1,34 @@
+"""
+JSON helpers - use orjson when it is installed, stdlib json otherwise
+"""
+import json
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def dumps_bytes(obj) -> bytes:
+    """Serialize obj to compact UTF-8 JSON bytes (ready to send as a request body)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from bytes or str (e.g. response.content)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_pretty(obj) -> str:
+    """Serialize obj to 2-space indented JSON text (for display)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=str)
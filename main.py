@@ -4,17 +4,41 @@ AI Team Member - Code Understanding SME
 Extracts source to destination field-level mappings from Java code
 """
 import argparse
+import os
 import sys
+import threading
 import yaml
+from collections import deque
 from pathlib import Path
-from typing import Optional, List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from tqdm import tqdm
 
 from java_parser import JavaParser
 from mapping_extractor import MappingExtractor
 from ollama_client import OllamaClient
+from embedding_cache import DiskEmbeddingCache
+from ingest_index import content_digest, read_text_with_digest
+from json_utils import dumps_pretty
+from result_sink import JsonlResultSink
 from vector_db import VectorDatabase, CHROMADB_AVAILABLE
+from text_chunking import split_code_chunks
+
+# libyaml bindings when PyYAML was built with them, pure-Python otherwise
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+
+def _progress_bar(iterable=None, total: Optional[int] = None, **kwargs) -> tqdm:
+    """tqdm throttled for runs over many fast files
+    
+    Redraws at most twice a second and every ~0.5% of the total, and is disabled when
+    stderr is not a terminal (CI logs, redirected output).
+    """
+    if total is None and iterable is not None and hasattr(iterable, '__len__'):
+        total = len(iterable)
+    return tqdm(iterable, total=total, mininterval=0.5, miniters=max(1, (total or 0) // 200),
+                smoothing=0, disable=None, **kwargs)
 
 
 class CodeUnderstandingSME:
@@ -22,17 +46,41 @@ class CodeUnderstandingSME:
     
     def __init__(self, config_path: str = "config.yaml"):
         self.config = self._load_config(config_path)
-        self.parser = JavaParser()
+        self.parser = JavaParser(cache_dir=self.config.get('mapping', {}).get('parse_cache_dir') or None)
         self.extractor = MappingExtractor(self.parser)
         self.ollama_client = None
         self.vector_db = None
+        # Shared by all files for multi-batch embedding (created on first use)
+        self._embed_pool = None
+        self._embed_pool_lock = threading.Lock()
+        # Set by start_result_stream(): directory results go to a JSONL file instead of a list
+        self.result_sink = None
         
         if self.config.get('embeddings', {}).get('enabled', True):
             max_concurrent = self.config.get('input', {}).get('max_concurrent_embedding_requests', 2)
+            embed_batch_size = self.config.get('input', {}).get('embedding_batch_size', 32)
+            disk_cache = None
+            cache_path = self.config['embeddings'].get('persistent_cache_path', '')
+            if cache_path:
+                try:
+                    disk_cache = DiskEmbeddingCache(
+                        cache_path,
+                        self.config['embeddings']['model'],
+                        vector_format=self.config['embeddings'].get('persistent_cache_format', 'float32'),
+                        max_entries=self.config['embeddings'].get('persistent_cache_max_entries', 0)
+                    )
+                except Exception as e:
+                    print(f"Warning: Could not open embedding cache at {cache_path}: {e}")
             self.ollama_client = OllamaClient(
                 base_url=self.config['embeddings']['base_url'],
                 model=self.config['embeddings']['model'],
-                max_concurrent_requests=max_concurrent
+                max_concurrent_requests=max_concurrent,
+                embed_batch_size=embed_batch_size,
+                embedding_cache_size=self.config['embeddings'].get('cache_size', 5000),
+                disk_cache=disk_cache,
+                keep_alive=self.config['embeddings'].get('keep_alive') or os.environ.get('OLLAMA_KEEP_ALIVE'),
+                connection_check_ttl=self.config['embeddings'].get('connection_check_ttl', 30),
+                serialize_on_cpu=self.config['embeddings'].get('serialize_on_cpu', True)
             )
         
         # Initialize vector database if enabled
@@ -43,7 +91,11 @@ class CodeUnderstandingSME:
                     self.vector_db = VectorDatabase(
                         persist_directory=self.config['vector_db']['persist_directory'],
                         collection_name=self.config['vector_db']['collection_name'],
-                        code_collection_name=code_collection_name
+                        code_collection_name=code_collection_name,
+                        bulk_batch_size=self.config.get('vector_db', {}).get('bulk_batch', 2000),
+                        bulk_flush_interval=self.config.get('vector_db', {}).get('bulk_flush_interval', 30),
+                        search_backend=self.config.get('vector_db', {}).get('search_backend', 'chroma'),
+                        project_shards=self._project_paths() if self.config['vector_db'].get('shard_by_project', False) else None
                     )
                     print(f"✓ Vector database initialized at {self.config['vector_db']['persist_directory']}")
                 except Exception as e:
@@ -52,11 +104,19 @@ class CodeUnderstandingSME:
                 print("Warning: chromadb not installed. Vector database features disabled.")
                 print("Install with: pip install chromadb")
     
+    def _project_paths(self) -> List[str]:
+        """Configured project paths (projects list, or the legacy codebase_path)"""
+        projects = self.config.get('input', {}).get('projects', [])
+        codebase_path = self.config.get('input', {}).get('codebase_path', '')
+        if not projects and codebase_path:
+            projects = [codebase_path]
+        return projects
+    
     def _load_config(self, config_path: str) -> dict:
         """Load configuration from YAML file"""
         try:
             with open(config_path, 'r') as f:
-                config = yaml.safe_load(f)
+                config = yaml.load(f, Loader=YAML_LOADER)
             return config
         except FileNotFoundError:
             print(f"Config file not found: {config_path}")
@@ -86,6 +146,7 @@ class CodeUnderstandingSME:
                 'embedding_batch_size': 50,
                 'parallel_workers': 4,
                 'embedding_parallel_workers': 4,
+                'read_ahead': 16,
                 'file_chunk_size': 1000,
                 'enable_checkpoint': True,
                 'checkpoint_interval': 500
@@ -108,25 +169,48 @@ class CodeUnderstandingSME:
             'output': {
                 'format': 'json',
                 'output_path': '',
+                'stream_results': True,
                 'include_code_snippets': True
             }
         }
     
-    def process_file(self, file_path: str, verbose: bool = False) -> dict:
-        """Process a single Java file - stores full code, extracts mappings on-demand"""
+    def process_file(self, file_path: str, verbose: bool = False, defer_store: bool = False,
+                     force: bool = False, loaded: Optional[Future] = None) -> dict:
+        """Process a single Java file - stores full code, extracts mappings on-demand
+        
+        With defer_store=True the code chunks are queued in the vector DB and written by
+        the caller's flush_code_records() (used for bulk directory ingestion).
+        Files already stored with the same content are skipped unless force=True.
+        loaded is a future of _load_file() started by _read_ahead(), so the read
+        overlaps the embedding of earlier files.
+        """
         if verbose:
             print(f"Processing file: {file_path}")
         
         try:
-            # Read file content
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                code_content = f.read()
+            ingest_index = self._ingest_index()
+            
+            stat, code_content, digest = loaded.result() if loaded is not None else self._load_file(file_path, force)
+            if code_content is None:
+                return self._unchanged_result(file_path, verbose)
+            
+            if ingest_index and not force and ingest_index.is_unchanged_content(file_path, digest):
+                # Touched but identical - refresh the stat fields so the cheap check hits next time
+                ingest_index.record(file_path, digest, stat.st_mtime, stat.st_size)
+                return self._unchanged_result(file_path, verbose)
             
             # Store full code file in vector DB (this is the main goal - mappings extracted on-demand)
             if self.vector_db and self.config.get('vector_db', {}).get('store_full_code', True):
                 if self.ollama_client and self.config.get('embeddings', {}).get('enabled'):
                     if self.ollama_client.check_connection():
-                        self._store_full_code_file(file_path, code_content, verbose=verbose)
+                        if ingest_index and (force or ingest_index.get(file_path)):
+                            # Content changed - drop the old chunks before storing the new ones
+                            self.vector_db.delete_code_file(file_path)
+                        # The vector DB records the file in the ingest index only once its
+                        # chunks are actually written (after the flush when deferred)
+                        ingest_record = (file_path, digest, stat.st_mtime, stat.st_size) if ingest_index else None
+                        self._store_full_code_file(file_path, code_content, verbose=verbose, defer=defer_store,
+                                                   ingest_record=ingest_record)
                     else:
                         if verbose:
                             print(f"  ⚠ Warning: Ollama not available. Code file not stored.")
@@ -153,15 +237,71 @@ class CodeUnderstandingSME:
                 traceback.print_exc()
             return {'error': str(e), 'file': file_path}
     
-    def process_directory(self, directory_path: str) -> list:
+    def _load_file(self, file_path: str,
+                   force: bool = False) -> Tuple[os.stat_result, Optional[str], Optional[bytes]]:
+        """Stat and read a file into (stat, content, digest); content is None when size and mtime
+        match the ingest index"""
+        ingest_index = self._ingest_index()
+        
+        # Unchanged size and mtime - skip without reading the file
+        stat = os.stat(file_path)
+        if ingest_index and not force and ingest_index.is_unchanged_stat(file_path, stat.st_mtime, stat.st_size):
+            return stat, None, None
+        
+        return (stat,) + read_text_with_digest(file_path)
+    
+    def _read_ahead(self, java_files: List[str], force: bool = False) -> Iterator[Tuple[str, Optional[Future]]]:
+        """Yield (file_path, future of _load_file) with the next files already being read
+        
+        Keeps input.read_ahead files in flight on a small reader pool, so disk reads overlap
+        the embedding requests instead of running between them.
+        """
+        depth = self.config.get('input', {}).get('read_ahead', 16)
+        if depth <= 0:
+            for file_path in java_files:
+                yield file_path, None
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(depth, 8), thread_name_prefix="read-ahead") as readers:
+            files = iter(java_files)
+            pending = deque()
+            for file_path in files:
+                pending.append((file_path, readers.submit(self._load_file, file_path, force)))
+                if len(pending) >= depth:
+                    break
+            while pending:
+                file_path, loaded = pending.popleft()
+                next_file = next(files, None)
+                if next_file is not None:
+                    pending.append((next_file, readers.submit(self._load_file, next_file, force)))
+                yield file_path, loaded
+    
+    def _ingest_index(self):
+        """Ingestion index of the vector DB, or None when unchanged files should not be skipped"""
+        if not self.vector_db or not self.config.get('vector_db', {}).get('skip_unchanged', True):
+            return None
+        return self.vector_db.ingest_index
+    
+    def _unchanged_result(self, file_path: str, verbose: bool = False) -> dict:
+        if verbose:
+            print(f"  ✓ Unchanged since last ingestion (skipped)")
+        return {
+            'file': file_path,
+            'status': 'unchanged',
+            'summary': {
+                'code_stored': True
+            }
+        }
+    
+    def process_directory(self, directory_path: str, force: bool = False) -> list:
         """Process all Java files in a directory with exclusions (optimized for large codebases)"""
+        return self._process_files(self._discover_files(directory_path), force)
+    
+    def _discover_files(self, directory_path: str) -> List[str]:
+        """Java files under a directory, after the configured exclusions"""
         recursive = self.config.get('input', {}).get('recursive', True)
         extensions = self.config.get('input', {}).get('file_extensions', ['.java'])
         exclude_patterns = self.config.get('input', {}).get('exclude_patterns', [])
-        parallel_workers = self.config.get('input', {}).get('parallel_workers', 4)
-        file_chunk_size = self.config.get('input', {}).get('file_chunk_size', 1000)
-        enable_checkpoint = self.config.get('input', {}).get('enable_checkpoint', True)
-        checkpoint_interval = self.config.get('input', {}).get('checkpoint_interval', 500)
         
         print(f"Discovering Java files in {directory_path}...")
         java_files = self.parser.find_java_files(
@@ -170,69 +310,94 @@ class CodeUnderstandingSME:
             extensions,
             exclude_patterns
         )
+        print(f"Found {len(java_files):,} Java file(s) (after exclusions)")
+        return java_files
+    
+    def _process_files(self, java_files: List[str], force: bool = False) -> list:
+        """Process a list of files sequentially, in parallel or in chunks depending on its size"""
+        parallel_workers = self.config.get('input', {}).get('parallel_workers', 4)
+        file_chunk_size = self.config.get('input', {}).get('file_chunk_size', 1000)
+        enable_checkpoint = self.config.get('input', {}).get('enable_checkpoint', True)
+        checkpoint_interval = self.config.get('input', {}).get('checkpoint_interval', 500)
         
         total_files = len(java_files)
-        print(f"Found {total_files:,} Java file(s) (after exclusions)")
-        
         if total_files == 0:
-            return []
+            return self._new_results()
         
-        # For very large codebases (30k+ files), process in chunks
-        if total_files > 10000:
-            print(f"Large codebase detected. Processing in chunks of {file_chunk_size:,} files...")
-            return self._process_files_chunked(
-                java_files, 
-                parallel_workers, 
-                file_chunk_size,
-                enable_checkpoint,
-                checkpoint_interval
-            )
-        # Use parallel processing for medium codebases
-        elif total_files > 100 and parallel_workers > 1:
-            return self._process_files_parallel(java_files, parallel_workers)
-        else:
-            # Sequential processing for smaller codebases
-            results = []
-            verbose = self.config.get('input', {}).get('verbose', False)
-            for file_path in tqdm(java_files, desc="Processing files", unit="file"):
-                result = self.process_file(file_path, verbose=verbose)
-                results.append(result)
-            return results
+        try:
+            # For very large codebases (30k+ files), process in chunks
+            if total_files > 10000:
+                print(f"Large codebase detected. Processing in chunks of {file_chunk_size:,} files...")
+                return self._process_files_chunked(
+                    java_files, 
+                    parallel_workers, 
+                    file_chunk_size,
+                    enable_checkpoint,
+                    checkpoint_interval,
+                    force
+                )
+            # Use parallel processing for medium codebases
+            elif total_files > 100 and parallel_workers > 1:
+                return self._process_files_parallel(java_files, parallel_workers, force)
+            else:
+                # Sequential processing for smaller codebases
+                results = self._new_results()
+                verbose = self.config.get('input', {}).get('verbose', False)
+                for file_path, loaded in _progress_bar(self._read_ahead(java_files, force), total=total_files,
+                                                      desc="Processing files", unit="file"):
+                    result = self.process_file(file_path, verbose=verbose, defer_store=True, force=force, loaded=loaded)
+                    results.append(result)
+                return results
+        finally:
+            # Write whatever is still buffered from the bulk ingestion
+            if self.vector_db:
+                self.vector_db.flush_code_records()
     
-    def _process_files_parallel(self, java_files: List[str], max_workers: int) -> list:
+    def _process_files_parallel(self, java_files: List[str], max_workers: int, force: bool = False,
+                                results: Optional[list] = None) -> list:
         """Process files in parallel for better performance"""
-        results = []
+        if results is None:
+            results = self._new_results()
         
         # Limit max_workers to prevent too many concurrent file operations
         # Each file may spawn multiple embedding requests, so we need to balance
         effective_workers = min(max_workers, 4)  # Cap at 4 to prevent overwhelming system
         
-        with ThreadPoolExecutor(max_workers=effective_workers) as executor:
-            # Submit all tasks
-            future_to_file = {
-                executor.submit(self.process_file, file_path): file_path 
-                for file_path in java_files
-            }
-            
-            # Process completed tasks with progress bar
-            for future in tqdm(as_completed(future_to_file), total=len(java_files), desc="Processing files", unit="file"):
+        progress = _progress_bar(total=len(java_files), desc="Processing files", unit="file")
+        future_to_file = {}
+        
+        def collect(done):
+            for future in done:
+                file_path = future_to_file.pop(future)
                 try:
                     result = future.result()
                     results.append(result)
                 except Exception as e:
-                    file_path = future_to_file[future]
                     print(f"Error processing {file_path}: {e}")
                     results.append({'error': str(e), 'file': file_path})
+                progress.update(1)
+        
+        with ThreadPoolExecutor(max_workers=effective_workers) as executor:
+            # Files are read ahead in the background; only a couple of tasks per worker are
+            # queued at a time so pending file contents stay bounded
+            for file_path, loaded in self._read_ahead(java_files, force):
+                if len(future_to_file) >= effective_workers * 2:
+                    done, _ = wait(future_to_file, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future_to_file[executor.submit(self.process_file, file_path, False, True, force, loaded)] = file_path
+            
+            collect(wait(future_to_file)[0])
+        progress.close()
         
         return results
     
     def _process_files_chunked(self, java_files: List[str], max_workers: int, 
                                chunk_size: int, enable_checkpoint: bool, 
-                               checkpoint_interval: int) -> list:
+                               checkpoint_interval: int, force: bool = False) -> list:
         """Process files in chunks for very large codebases (30k+ files)"""
         total_files = len(java_files)
         total_chunks = (total_files + chunk_size - 1) // chunk_size
-        results = []
+        results = self._new_results()
         processed_count = 0
         
         print(f"Processing {total_files:,} files in {total_chunks} chunks of ~{chunk_size:,} files each")
@@ -246,15 +411,16 @@ class CodeUnderstandingSME:
             
             # Process chunk in parallel
             if len(chunk_files) > 100 and max_workers > 1:
-                chunk_results = self._process_files_parallel(chunk_files, max_workers)
+                self._process_files_parallel(chunk_files, max_workers, force, results)
             else:
-                chunk_results = []
-                for file_path in tqdm(chunk_files, desc=f"Chunk {chunk_idx + 1}", unit="file", leave=False):
-                    result = self.process_file(file_path, verbose=False)
-                    chunk_results.append(result)
+                for file_path, loaded in _progress_bar(self._read_ahead(chunk_files, force), total=len(chunk_files),
+                                                      desc=f"Chunk {chunk_idx + 1}", unit="file", leave=False):
+                    result = self.process_file(file_path, verbose=False, defer_store=True, force=force, loaded=loaded)
+                    results.append(result)
             
-            results.extend(chunk_results)
-            processed_count += len(chunk_results)
+            if self.vector_db:
+                self.vector_db.flush_code_records()
+            processed_count += len(chunk_files)
             
             # Progress update
             progress_pct = (processed_count / total_files) * 100
@@ -267,14 +433,13 @@ class CodeUnderstandingSME:
         
         return results
     
-    def process_configured_codebase(self) -> list:
-        """Process the codebase(s) configured in config.yaml (supports multiple projects)"""
-        projects = self.config.get('input', {}).get('projects', [])
-        codebase_path = self.config.get('input', {}).get('codebase_path', '')
+    def process_configured_codebase(self, force: bool = False) -> list:
+        """Process the codebase(s) configured in config.yaml (supports multiple projects)
         
+        Files whose content is unchanged since the last run are skipped unless force=True.
+        """
         # Use projects list if available, otherwise fall back to codebase_path
-        if not projects and codebase_path:
-            projects = [codebase_path]
+        projects = self._project_paths()
         
         if not projects:
             print("No projects or codebase_path configured in config.yaml")
@@ -285,82 +450,83 @@ class CodeUnderstandingSME:
             print(f"Warning: More than 10 projects specified. Processing first 10.")
             projects = projects[:10]
         
-        all_results = []
-        
-        # Process projects in parallel if multiple projects
-        if len(projects) > 1:
-            # Limit to 2 projects in parallel to avoid overwhelming Ollama
-            # Each project processes files in parallel, so we don't want too many projects at once
-            parallel_workers = min(len(projects), 2)
+        # Collect the files of all projects first and process them as one work list, so
+        # workers are not left idle while a small project waits on a large one
+        all_files = []
+        seen = set()
+        for i, project_path in enumerate(projects, 1):
+            project_path = project_path.strip()
+            if not project_path:
+                continue
             
-            def process_project(project_info):
-                i, project_path = project_info
-                project_path = project_path.strip()
-                if not project_path:
-                    return []
-                
-                project_path_obj = Path(project_path)
-                
-                if not project_path_obj.exists():
-                    print(f"Warning: Project path does not exist: {project_path}")
-                    return []
-                
-                print(f"\n[{i}/{len(projects)}] Processing project: {project_path}")
-                
-                if project_path_obj.is_file():
-                    result = self.process_file(str(project_path_obj))
-                    return [result]
-                elif project_path_obj.is_dir():
-                    results = self.process_directory(str(project_path_obj))
-                    return results
-                else:
-                    print(f"Error: Invalid project path: {project_path}")
-                    return []
+            project_path_obj = Path(project_path)
             
-            # Process projects in parallel (limited to 2 at a time)
-            with ThreadPoolExecutor(max_workers=parallel_workers) as executor:
-                project_tasks = [(i+1, proj) for i, proj in enumerate(projects)]
-                project_results = list(executor.map(process_project, project_tasks))
-                
-                # Flatten results
-                for results in project_results:
-                    all_results.extend(results)
-        else:
-            # Single project - process sequentially (simpler)
-            for i, project_path in enumerate(projects, 1):
-                project_path = project_path.strip()
-                if not project_path:
-                    continue
-                
-                project_path_obj = Path(project_path)
-                
-                if not project_path_obj.exists():
-                    print(f"Warning: Project path does not exist: {project_path}")
-                    continue
-                
-                print(f"\n[{i}/{len(projects)}] Processing project: {project_path}")
-                
-                if project_path_obj.is_file():
-                    result = self.process_file(str(project_path_obj))
-                    all_results.append(result)
-                elif project_path_obj.is_dir():
-                    results = self.process_directory(str(project_path_obj))
-                    all_results.extend(results)
-                else:
-                    print(f"Error: Invalid project path: {project_path}")
+            if not project_path_obj.exists():
+                print(f"Warning: Project path does not exist: {project_path}")
+                continue
+            
+            print(f"\n[{i}/{len(projects)}] Discovering project: {project_path}")
+            
+            if project_path_obj.is_file():
+                project_files = [str(project_path_obj)]
+            elif project_path_obj.is_dir():
+                project_files = self._discover_files(str(project_path_obj))
+            else:
+                print(f"Error: Invalid project path: {project_path}")
+                continue
+            
+            # Nested or repeated projects would otherwise process the same file twice
+            for file_path in project_files:
+                if file_path not in seen:
+                    seen.add(file_path)
+                    all_files.append(file_path)
+        
+        if len(projects) > 1:
+            print(f"\nProcessing {len(all_files):,} file(s) from {len(projects)} project(s)")
+        return self._process_files(all_files, force)
+    
+    def start_result_stream(self, output_path: Optional[str] = None) -> bool:
+        """Stream directory results to <output>.jsonl instead of collecting them in memory
         
-        return all_results
+        Only applies to JSON output written to a file, and can be turned off with
+        output.stream_results: false.
+        """
+        output_config = self.config.get('output', {})
+        output_file = output_path or output_config.get('output_path', '')
+        if (not output_file or output_config.get('format', 'json') != 'json'
+                or not output_config.get('stream_results', True)):
+            return False
+        self.result_sink = JsonlResultSink(output_file + '.jsonl')
+        return True
+    
+    def close_result_stream(self):
+        """Flush and close the JSONL stream started by start_result_stream(), if still open"""
+        if self.result_sink is not None:
+            self.result_sink.close()
+            self.result_sink = None
+    
+    def _new_results(self) -> list:
+        """Container for per-file results - the JSONL sink when streaming, a list otherwise"""
+        return self.result_sink if self.result_sink is not None else []
     
-    def process_content(self, content: str, file_path: str = "inline") -> dict:
+    def process_content(self, content: str, file_path: str = "inline", force: bool = False) -> dict:
         """Process Java code content directly"""
         print(f"Processing inline code content")
         
         try:
+            ingest_index = self._ingest_index()
+            digest = content_digest(content)
+            if ingest_index and not force and ingest_index.is_unchanged_content(file_path, digest):
+                return self._unchanged_result(file_path)
+            
             # Store full code file in vector DB (mappings extracted on-demand)
             if self.vector_db and self.config.get('vector_db', {}).get('store_full_code', True):
                 if self.ollama_client and self.config.get('embeddings', {}).get('enabled'):
                     if self.ollama_client.check_connection():
-                        self._store_full_code_file(file_path, content, verbose=False)
+                        if ingest_index and (force or ingest_index.get(file_path)):
+                            self.vector_db.delete_code_file(file_path)
+                        self._store_full_code_file(file_path, content, verbose=False,
+                                                   ingest_record=(file_path, digest, None, None) if ingest_index else None)
                     else:
                         print(f"Warning: Ollama not available. Run 'ollama pull {self.ollama_client.model}' to install the model.")
             
@@ -380,7 +546,19 @@ class CodeUnderstandingSME:
         output_format = self.config.get('output', {}).get('format', 'json')
         output_file = output_path or self.config.get('output', {}).get('output_path', '')
         
-        if isinstance(results, list):
+        if isinstance(results, JsonlResultSink):
+            # Streamed run - the per-file results are already on disk
+            results.close()
+            self.result_sink = None
+            formatted = dumps_pretty({
+                'files_processed': results.files_processed,
+                'files_stored': results.files_stored,
+                'results_file': results.path,
+                'summary': {
+                    'code_files_stored': results.files_stored
+                }
+            })
+        elif isinstance(results, list):
             # Multiple files processed
             stored_count = sum(1 for r in results if r.get('summary', {}).get('code_stored', False))
             combined = {
@@ -392,26 +570,22 @@ class CodeUnderstandingSME:
                 }
             }
             if output_format == 'json':
-                import json
-                formatted = json.dumps(combined, indent=2)
+                formatted = dumps_pretty(combined)
             elif output_format == 'yaml':
-                import yaml
-                formatted = yaml.dump(combined, default_flow_style=False)
+                formatted = yaml.dump(combined, Dumper=YAML_DUMPER, default_flow_style=False)
             else:
                 formatted = self.format_results(results)
         else:
             # Single result
             if output_format == 'json':
-                import json
-                formatted = json.dumps(results, indent=2)
+                formatted = dumps_pretty(results)
             elif output_format == 'yaml':
-                import yaml
-                formatted = yaml.dump(results, default_flow_style=False)
+                formatted = yaml.dump(results, Dumper=YAML_DUMPER, default_flow_style=False)
             else:
                 formatted = f"File: {results.get('file', 'N/A')}, Status: {results.get('status', 'N/A')}"
         
         if output_file:
-            with open(output_file, 'w') as f:
+            with open(output_file, 'w', encoding='utf-8') as f:
                 f.write(formatted)
             print(f"Results written to: {output_file}")
         else:
@@ -431,10 +605,28 @@ class CodeUnderstandingSME:
         
         return "\n".join(lines)
     
-    def _store_full_code_file(self, file_path: str, code_content: str, verbose: bool = False):
-        """Store full code file in vector database"""
+    def _embedding_pool(self) -> Optional[ThreadPoolExecutor]:
+        """Thread pool shared by all files for parallel embedding batches (None if disabled)"""
+        embedding_workers = min(
+            self.config.get('input', {}).get('embedding_parallel_workers', 3),
+            4  # Cap at 4 for reasonable throughput
+        )
+        if embedding_workers <= 1:
+            return None
+        with self._embed_pool_lock:
+            if self._embed_pool is None:
+                self._embed_pool = ThreadPoolExecutor(max_workers=embedding_workers, thread_name_prefix="embed")
+            return self._embed_pool
+    
+    def _store_full_code_file(self, file_path: str, code_content: str, verbose: bool = False,
+                              defer: bool = False, ingest_record: Optional[Tuple] = None) -> bool:
+        """Store full code file in vector database, returns True if every chunk was embedded
+        
+        ingest_record (path, sha256, mtime, size) is passed on to the vector DB, which writes it to
+        the ingest index once the records are stored - only when every chunk was embedded.
+        """
         if not self.vector_db or not self.ollama_client:
-            return
+            return False
         
         try:
             max_chunk_size = self.config.get('vector_db', {}).get('max_code_chunk_size', 2000)
@@ -442,68 +634,57 @@ class CodeUnderstandingSME:
             # Use smaller chunks for embeddings to avoid EOF errors
             # Jina embeddings model has issues with large chunks, so use 2000 chars max
             embedding_chunk_size = min(max_chunk_size, 2000)  # Very small chunks to avoid EOF errors
+            chunk_overlap = self.config.get('vector_db', {}).get('code_chunk_overlap', 0)
             
             # For very large files, always chunk to avoid embedding errors
             if len(code_content) <= embedding_chunk_size:
                 # Single embedding for entire file
                 embedding = self.ollama_client.get_embeddings(code_content)
                 if embedding:
-                    self.vector_db.store_code_file(file_path, code_content, embedding)
+                    self.vector_db.store_code_file(file_path, code_content, embedding, defer=defer,
+                                                   ingest_record=ingest_record)
+                    return True
                 else:
                     if verbose:
                         print(f"  ⚠ Failed to generate embedding for {Path(file_path).name} (skipping)")
             else:
-                # Split into chunks and embed each
-                chunks = []
-                embeddings = []
-                chunk_indices = []
-                
-                total_chunks = (len(code_content) + embedding_chunk_size - 1) // embedding_chunk_size
-                
-                # Prepare all chunks first
-                chunk_data = []
-                for i in range(0, len(code_content), embedding_chunk_size):
-                    chunk = code_content[i:i + embedding_chunk_size]
-                    chunk_num = i // embedding_chunk_size + 1
-                    chunk_data.append((chunk_num - 1, chunk, chunk_num, total_chunks))
+                # Split at line ends (not mid-identifier) and embed with batched /api/embed requests
+                chunks = split_code_chunks(code_content, embedding_chunk_size, chunk_overlap)
+                total_chunks = len(chunks)
+                batch_size = self.ollama_client.embed_batch_size
+                batches = [list(range(i, min(i + batch_size, total_chunks))) for i in range(0, total_chunks, batch_size)]
                 
-                # Generate embeddings in parallel for better performance
-                # Balance throughput with stability
-                embedding_workers = min(
-                    self.config.get('input', {}).get('embedding_parallel_workers', 3),
-                    4  # Cap at 4 for reasonable throughput
-                )
-                
-                # Slightly reduce for very large files (but not too much)
-                if len(chunk_data) > 20:
-                    embedding_workers = max(2, embedding_workers - 1)  # Keep at least 2 workers
+                def embed_batch(indices):
+                    return self.ollama_client.get_embeddings_batch([chunks[i] for i in indices])
                 
-                def embed_chunk(chunk_info):
-                    chunk_idx, chunk, chunk_num, total = chunk_info
-                    emb = self.ollama_client.get_embeddings(chunk)
-                    return (chunk_idx, emb, chunk_num, total)
-                
-                # Use ThreadPoolExecutor for parallel embedding generation
-                # Limited parallelism to prevent overwhelming Ollama
-                # The semaphore in OllamaClient will further limit concurrent requests
-                with ThreadPoolExecutor(max_workers=embedding_workers) as executor:
-                    embedding_results = list(executor.map(embed_chunk, chunk_data))
+                # Very large files span several batches; send those in parallel on the shared pool
+                # The semaphore in OllamaClient still limits concurrent requests
+                embed_pool = self._embedding_pool() if len(batches) > 1 else None
+                if embed_pool:
+                    batch_results = list(embed_pool.map(embed_batch, batches))
+                else:
+                    batch_results = [embed_batch(indices) for indices in batches]
                 
-                # Process results and store successful embeddings
-                for chunk_idx, emb, chunk_num, total in embedding_results:
-                    if emb:
-                        embeddings.append(emb)
-                        chunk_indices.append(chunk_idx)
-                    else:
-                        # Skip failed chunks but continue processing
-                        if verbose:
-                            print(f"  ⚠ Failed to generate embedding for chunk {chunk_num}/{total} of {Path(file_path).name} (skipping chunk)")
+                # Keep only successfully embedded chunks
+                embeddings = []
+                chunk_indices = []
+                for indices, batch_embeddings in zip(batches, batch_results):
+                    for chunk_idx, emb in zip(indices, batch_embeddings):
+                        if emb:
+                            embeddings.append(emb)
+                            chunk_indices.append(chunk_idx)
+                        elif verbose:
+                            print(f"  ⚠ Failed to generate embedding for chunk {chunk_idx + 1}/{total_chunks} of {Path(file_path).name} (skipping chunk)")
                 
                 if embeddings:
                     # Store only successfully embedded chunks
-                    self.vector_db.store_code_file_chunked(file_path, code_content, embeddings, embedding_chunk_size, chunk_indices)
-                    if verbose and len(embeddings) < len(chunks):
-                        print(f"  ✓ Stored {len(embeddings)}/{len(chunks)} chunks for {Path(file_path).name}")
+                    complete = len(embeddings) == total_chunks
+                    self.vector_db.store_code_file_chunked(file_path, code_content, embeddings, embedding_chunk_size,
+                                                           chunk_indices, defer=defer, chunks=chunks,
+                                                           ingest_record=ingest_record if complete else None)
+                    if verbose and len(embeddings) < total_chunks:
+                        print(f"  ✓ Stored {len(embeddings)}/{total_chunks} chunks for {Path(file_path).name}")
+                    return complete
                 else:
                     if verbose:
                         print(f"  ⚠ No embeddings generated for {Path(file_path).name} (all chunks failed)")
@@ -512,9 +693,10 @@ class CodeUnderstandingSME:
             print(f"  ⚠ Could not store full code file {file_path}: {e}")
             import traceback
             traceback.print_exc()
+        return False
     
-    def search_similar_code(self, query_text: str, n_results: int = 5) -> list:
-        """Search for similar code files using vector database"""
+    def search_similar_code(self, query_text: str, n_results: int = 5, diversity: bool = False) -> list:
+        """Search for similar code files using vector database (diversity=True reranks with MMR)"""
         if not self.vector_db:
             print("Vector database is not enabled")
             return []
@@ -531,7 +713,10 @@ class CodeUnderstandingSME:
                 return []
             
             # Search in code collection
-            results = self.vector_db.search_code(query_embedding, n_results)
+            results = self.vector_db.search_code(
+                query_embedding, n_results, diversity=diversity,
+                mmr_lambda=self.config.get('vector_db', {}).get('mmr_lambda', 0.5)
+            )
             return results
         except Exception as e:
             print(f"Error searching similar code: {e}")
@@ -582,6 +767,11 @@ def main():
         '--search',
         help='Search for similar code files (requires vector DB)'
     )
+    parser.add_argument(
+        '--diverse',
+        action='store_true',
+        help='Rerank --search results for diversity (maximal marginal relevance)'
+    )
     parser.add_argument(
         '--db-stats',
         action='store_true',
@@ -596,6 +786,17 @@ def main():
         action='store_true',
         help='Enable verbose output during processing'
     )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-ingest files even if their content is unchanged since the last run'
+    )
+    parser.add_argument(
+        '--fit-pca',
+        type=int,
+        metavar='DIMS',
+        help='Fit a PCA projection on stored embeddings and re-index the vector DB with DIMS dimensions'
+    )
     parser.add_argument(
         '--clear-db',
         action='store_true',
@@ -628,8 +829,21 @@ def main():
     # Show vector DB stats if requested
     if args.db_stats:
         stats = sme.get_vector_db_stats()
-        import json
-        print(json.dumps(stats, indent=2))
+        print(dumps_pretty(stats))
+        return
+    
+    # Fit and apply a PCA projection if requested
+    if args.fit_pca:
+        if sme.vector_db:
+            print(f"Fitting PCA projection to {args.fit_pca} dimensions...")
+            summary = sme.vector_db.fit_projection(n_components=args.fit_pca)
+            if summary.get('applied'):
+                print(f"✓ Re-indexed with {summary['output_dim']}-dim vectors "
+                      f"(from {summary['input_dim']}, recall@10 {summary['recall_at_10']:.3f})")
+            else:
+                print(f"⚠ Projection not applied: {summary.get('reason')}")
+        else:
+            print("Vector database is not enabled")
         return
     
     # Clear vector database if requested
@@ -650,16 +864,15 @@ def main():
     if args.test_file:
         print(f"Testing file processing: {args.test_file}")
         print("="*80)
-        result = sme.process_file(args.test_file, verbose=True)
+        result = sme.process_file(args.test_file, verbose=True, force=args.force)
         print("\n" + "="*80)
         print("RESULT:")
-        import json
-        print(json.dumps(result, indent=2))
+        print(dumps_pretty(result))
         return
     
     # Search for similar mappings if requested
     if args.search:
-        results = sme.search_similar_code(args.search, n_results=5)
+        results = sme.search_similar_code(args.search, n_results=5, diversity=args.diverse)
         if results:
             print(f"\nFound {len(results)} similar code file(s) for: '{args.search}'\n")
             for i, result in enumerate(results, 1):
@@ -674,9 +887,19 @@ def main():
             print("No similar code files found")
         return
     
+    try:
+        _process_input(sme, args)
+    finally:
+        # A streamed run must flush its .jsonl even when it exits early or fails
+        sme.close_result_stream()
+
+
+def _process_input(sme: CodeUnderstandingSME, args: argparse.Namespace):
+    """Process the codebase, directory, file or stdin named on the command line and output the results"""
     # Process configured codebase if requested
     if args.process_codebase:
-        results = sme.process_configured_codebase()
+        sme.start_result_stream(args.output)
+        results = sme.process_configured_codebase(force=args.force)
         if not results:
             sys.exit(1)
         sme.output_results(results, args.output)
@@ -688,7 +911,8 @@ def main():
         codebase_path = sme.config.get('input', {}).get('codebase_path', '')
         if codebase_path:
             print(f"Using configured codebase path: {codebase_path}")
-            results = sme.process_configured_codebase()
+            sme.start_result_stream(args.output)
+            results = sme.process_configured_codebase(force=args.force)
             if not results:
                 sys.exit(1)
         else:
@@ -700,13 +924,14 @@ def main():
     elif args.input == '-':
         # Read from stdin
         content = sys.stdin.read()
-        results = sme.process_content(content)
+        results = sme.process_content(content, force=args.force)
     else:
         input_path = Path(args.input)
         if input_path.is_file():
-            results = sme.process_file(str(input_path))
+            results = sme.process_file(str(input_path), force=args.force)
         elif input_path.is_dir():
-            results = sme.process_directory(str(input_path))
+            sme.start_result_stream(args.output)
+            results = sme.process_directory(str(input_path), force=args.force)
         else:
             print(f"Error: Path not found: {args.input}")
             sys.exit(1)
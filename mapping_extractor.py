@@ -1,8 +1,12 @@
 """
 Mapping Extractor - Extracts source to destination field-level mappings
 """
-from typing import List, Dict, Optional
+from typing import Dict
+
+import yaml
+
 from java_parser import JavaParser
+from json_utils import dumps_pretty
 
 
 class MappingExtractor:
@@ -14,127 +18,76 @@ class MappingExtractor:
     def extract_mappings(self, file_path: str) -> Dict:
         """Extract all mappings from a Java file"""
         parsed_data = self.parser.parse_file(file_path)
-        
-        result = {
-            'file': file_path,
-            'mappings': [],
-            'summary': {
-                'total_mappings': 0,
-                'mapstruct_mappings': 0,
-                'pojo_mappings': 0
-            }
-        }
-        
-        # Process MapStruct mappings
-        for mapstruct_mapping in parsed_data['mapstruct_mappings']:
-            mapping_entry = {
-                'type': 'mapstruct',
-                'interface': mapstruct_mapping.get('interface'),
-                'method': mapstruct_mapping.get('method'),
-                'source_type': mapstruct_mapping.get('source_type'),
-                'target_type': mapstruct_mapping.get('return_type'),
-                'field_mappings': []
-            }
-            
-            if mapstruct_mapping.get('source_field') and mapstruct_mapping.get('target_field'):
-                mapping_entry['field_mappings'].append({
-                    'source': mapstruct_mapping['source_field'],
-                    'target': mapstruct_mapping['target_field'],
-                    'expression': mapstruct_mapping.get('expression'),
-                    'ignore': mapstruct_mapping.get('ignore', False)
-                })
-            elif mapstruct_mapping.get('implicit'):
-                # For implicit mappings, we'd need to analyze the types
-                # This is a placeholder - would need type analysis
-                mapping_entry['implicit'] = True
-            
-            if mapping_entry['field_mappings'] or mapping_entry.get('implicit'):
-                result['mappings'].append(mapping_entry)
-                result['summary']['mapstruct_mappings'] += 1
-        
-        # Process POJO mappings
-        for pojo_mapping in parsed_data['pojo_mappings']:
-            if pojo_mapping.get('mappings'):
-                mapping_entry = {
-                    'type': 'pojo',
-                    'source_type': pojo_mapping.get('source_type'),
-                    'target_type': pojo_mapping.get('return_type'),
-                    'field_mappings': pojo_mapping['mappings']
-                }
-                
-                result['mappings'].append(mapping_entry)
-                result['summary']['pojo_mappings'] += 1
-        
-        result['summary']['total_mappings'] = len(result['mappings'])
-        
-        return result
+        return self._build_result(parsed_data, file_path)
     
     def extract_mappings_from_content(self, content: str, file_path: str = "") -> Dict:
         """Extract mappings from Java code content string"""
         parsed_data = self.parser.parse_content(content, file_path)
-        
-        result = {
-            'file': file_path or 'inline',
-            'mappings': [],
-            'summary': {
-                'total_mappings': 0,
-                'mapstruct_mappings': 0,
-                'pojo_mappings': 0
-            }
-        }
+        return self._build_result(parsed_data, file_path or 'inline')
+    
+    def _build_result(self, parsed_data: Dict, file_label: str) -> Dict:
+        """Structure the parser output as mapping entries plus summary counts"""
+        mappings = []
+        mapstruct_count = pojo_count = 0
         
         # Process MapStruct mappings
         for mapstruct_mapping in parsed_data['mapstruct_mappings']:
+            if mapstruct_mapping.source_field and mapstruct_mapping.target_field:
+                field_mappings = [{
+                    'source': mapstruct_mapping.source_field,
+                    'target': mapstruct_mapping.target_field,
+                    'expression': mapstruct_mapping.expression,
+                    'ignore': mapstruct_mapping.ignore
+                }]
+            elif mapstruct_mapping.implicit:
+                # For implicit mappings, we'd need to analyze the types
+                # This is a placeholder - would need type analysis
+                field_mappings = []
+            else:
+                continue
+            
             mapping_entry = {
                 'type': 'mapstruct',
-                'interface': mapstruct_mapping.get('interface'),
-                'method': mapstruct_mapping.get('method'),
-                'source_type': mapstruct_mapping.get('source_type'),
-                'target_type': mapstruct_mapping.get('return_type'),
-                'field_mappings': []
+                'interface': mapstruct_mapping.interface,
+                'method': mapstruct_mapping.method,
+                'source_type': mapstruct_mapping.source_type,
+                'target_type': mapstruct_mapping.return_type,
+                'field_mappings': field_mappings
             }
-            
-            if mapstruct_mapping.get('source_field') and mapstruct_mapping.get('target_field'):
-                mapping_entry['field_mappings'].append({
-                    'source': mapstruct_mapping['source_field'],
-                    'target': mapstruct_mapping['target_field'],
-                    'expression': mapstruct_mapping.get('expression'),
-                    'ignore': mapstruct_mapping.get('ignore', False)
-                })
-            elif mapstruct_mapping.get('implicit'):
+            if not field_mappings:
                 mapping_entry['implicit'] = True
-            
-            if mapping_entry['field_mappings'] or mapping_entry.get('implicit'):
-                result['mappings'].append(mapping_entry)
-                result['summary']['mapstruct_mappings'] += 1
+            mappings.append(mapping_entry)
+            mapstruct_count += 1
         
         # Process POJO mappings
         for pojo_mapping in parsed_data['pojo_mappings']:
-            if pojo_mapping.get('mappings'):
-                mapping_entry = {
+            if pojo_mapping.mappings:
+                mappings.append({
                     'type': 'pojo',
-                    'source_type': pojo_mapping.get('source_type'),
-                    'target_type': pojo_mapping.get('return_type'),
-                    'field_mappings': pojo_mapping['mappings']
-                }
-                
-                result['mappings'].append(mapping_entry)
-                result['summary']['pojo_mappings'] += 1
-        
-        result['summary']['total_mappings'] = len(result['mappings'])
+                    'source_type': pojo_mapping.source_type,
+                    'target_type': pojo_mapping.return_type,
+                    'field_mappings': pojo_mapping.mappings
+                })
+                pojo_count += 1
         
-        return result
+        return {
+            'file': file_label,
+            'mappings': mappings,
+            'summary': {
+                'total_mappings': len(mappings),
+                'mapstruct_mappings': mapstruct_count,
+                'pojo_mappings': pojo_count
+            }
+        }
     
     def format_mappings(self, mappings_data: Dict, format: str = 'json') -> str:
         """Format mappings in the specified output format"""
         if format == 'text':
             return self._format_text(mappings_data)
         elif format == 'yaml':
-            import yaml
             return yaml.dump(mappings_data, default_flow_style=False, sort_keys=False)
         else:  # json
-            import json
-            return json.dumps(mappings_data, indent=2)
+            return dumps_pretty(mappings_data)
     
     def _format_text(self, mappings_data: Dict) -> str:
         """Format mappings as human-readable text"""
@@ -172,3 +125,16 @@ class MappingExtractor:
         
         return "\n".join(lines)
 
+
+_process_extractor = None
+
+
+def extract_file_mappings(file_path: str) -> Dict:
+    """Extract mappings from one file with a per-process extractor
+
+    Module-level so it can be used with ProcessPoolExecutor.
+    """
+    global _process_extractor
+    if _process_extractor is None:
+        _process_extractor = MappingExtractor(JavaParser())
+    return _process_extractor.extract_mappings(file_path)
@@ -2,11 +2,180 @@
 On-demand mapping extraction from retrieved code
 Can use parser or LLM to extract mappings from code chunks
 """
-from typing import List, Dict, Optional
-from java_parser import JavaParser
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from java_parser import JavaParser, MAPSTRUCT_KEYWORDS, POJO_KEYWORDS
+from json_utils import loads
 from mapping_extractor import MappingExtractor
 
 
+# Distinct code chunks whose parse results are memoized per extractor
+PARSE_CACHE_SIZE = 2048
+
+# Fewer distinct unparsed chunks than this are parsed in-process (pool start-up costs more)
+PARALLEL_MIN_CHUNKS = 16
+
+# Text the parser can report a mapping from: a MapStruct @Mapper, or a method whose name
+# starts like a POJO mapping method (the same name prefixes JavaParser's POJO patterns use).
+# Plain substrings such as 'to' or 'map' occur in almost any Java text.
+MAPPING_CANDIDATE_RE = re.compile(
+    '|'.join(re.escape(keyword) for keyword in MAPSTRUCT_KEYWORDS)
+    + r'|\s(?:' + '|'.join(POJO_KEYWORDS) + r')\w*\s*\('
+)
+
+# Field mapping attributes kept by normalization only when set
+OPTIONAL_FIELD_KEYS = ('expression', 'ignore', 'target_path')
+
+# Code beyond this many characters is left out of the LLM prompt
+LLM_MAX_CODE_CHARS = 8000
+
+LLM_PROMPT_HEAD = """Analyze this Java code and extract all field-level mappings between source and destination objects.
+
+Code:
+```java
+"""
+
+LLM_PROMPT_TAIL = """
+```
+
+Extract:
+1. MapStruct mappings (interfaces with @Mapper annotation)
+2. POJO mappings (methods like mapXxx, convert, transform)
+3. Field-level mappings (source field -> target field)
+4. Any transformations or expressions
+
+Return a JSON structure with:
+- mapping_type: "mapstruct" or "pojo"
+- source_type: source class name
+- target_type: target class name
+- method_name: method name (if applicable)
+- field_mappings: [{"source_field": "...", "target_field": "...", "transformation": "..."}]
+
+JSON:"""
+
+# Opening markdown fence LLMs often wrap JSON answers in
+JSON_FENCE = '```json'
+
+
+def _response_fragments(response) -> Iterator[str]:
+    """Text fragments of a streamed Ollama /api/generate response"""
+    for line in response.iter_lines():
+        if line:
+            data = loads(line)
+            yield data.get('response', '')
+            if data.get('done'):
+                break
+
+
+def _read_json_value(fragments: Iterable[str]) -> Optional[str]:
+    """Collect streamed text up to the end of its top-level JSON object or array
+
+    A leading markdown fence (```json) is skipped. Returns None as soon as the text
+    cannot start a value, or if the stream ends first. Anything generated after the
+    value closes, such as the closing fence, is not waited for.
+    """
+    parts = []
+    prefix = ''
+    depth = 0
+    in_string = escaped = False
+    for fragment in fragments:
+        start = 0
+        for i, ch in enumerate(fragment):
+            if depth == 0:
+                if ch == '[' or ch == '{':
+                    depth = 1
+                    start = i
+                elif not ch.isspace():
+                    prefix += ch
+                    if not JSON_FENCE.startswith(prefix.lower()):
+                        return None
+            elif in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '[' or ch == '{':
+                depth += 1
+            elif ch == ']' or ch == '}':
+                depth -= 1
+                if depth == 0:
+                    parts.append(fragment[start:i + 1])
+                    return ''.join(parts)
+        if depth:
+            parts.append(fragment[start:])
+    return None
+
+
+def _parse_with(extractor: MappingExtractor, code_content: str, file_path: str = None) -> Dict:
+    """Run the parser and normalize the field mapping format"""
+    # Every mapping the parser reports starts from one of these; skip text without them
+    if not MAPPING_CANDIDATE_RE.search(code_content):
+        return {
+            'file': file_path or 'inline',
+            'mappings': [],
+            'summary': {
+                'total_mappings': 0,
+                'mapstruct_mappings': 0,
+                'pojo_mappings': 0
+            }
+        }
+    try:
+        # Use the extractor's method that works with content strings
+        result = extractor.extract_mappings_from_content(code_content, file_path or '')
+        
+        # Normalize field_mappings format for consistency
+        # Handle both formats: source/target and source_field/target_field
+        for mapping in result.get('mappings', ()):
+            field_mappings = mapping.get('field_mappings')
+            if not field_mappings:
+                continue
+            mapping['field_mappings'] = [
+                {
+                    'source_field': fm.get('source_field') or fm.get('source', ''),
+                    'target_field': fm.get('target_field') or fm.get('target', ''),
+                    **{key: fm[key] for key in OPTIONAL_FIELD_KEYS if fm.get(key)},
+                }
+                for fm in field_mappings
+            ]
+        
+        return result
+    except Exception as e:
+        return {
+            'file': file_path or 'unknown',
+            'mappings': [],
+            'error': str(e),
+            'summary': {
+                'total_mappings': 0,
+                'mapstruct_mappings': 0,
+                'pojo_mappings': 0
+            }
+        }
+
+
+_process_extractor = None
+
+
+def _parse_chunk(code_content: str, file_path: str = None) -> Dict:
+    """Parse one chunk with a per-process extractor (module-level so ProcessPoolExecutor can pickle it)"""
+    global _process_extractor
+    if _process_extractor is None:
+        _process_extractor = MappingExtractor(JavaParser())
+    return _parse_with(_process_extractor, code_content, file_path)
+
+
+def _content_key(code_content: str) -> bytes:
+    return hashlib.blake2b(code_content.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
 class OnDemandMappingExtractor:
     """Extract mappings from retrieved code on-demand"""
     
@@ -15,6 +184,9 @@ class OnDemandMappingExtractor:
         self.extractor = MappingExtractor(self.parser)
         self.ollama_client = ollama_client
         self.use_llm = use_llm and ollama_client is not None
+        # Parser results keyed by content hash - retrievals repeat the same chunks across queries
+        self._parse_cache: "OrderedDict[bytes, Dict]" = OrderedDict()
+        self._parse_cache_lock = threading.Lock()
     
     def extract_from_code(self, code_content: str, file_path: str = None, 
                          use_llm: Optional[bool] = None) -> Dict:
@@ -37,96 +209,88 @@ class OnDemandMappingExtractor:
     
     def _extract_with_parser(self, code_content: str, file_path: str = None) -> Dict:
         """Extract mappings using the Java parser (fast, rule-based)"""
-        try:
-            # Use the extractor's method that works with content strings
-            result = self.extractor.extract_mappings_from_content(code_content, file_path or '')
-            
-            # Normalize field_mappings format for consistency
-            for mapping in result.get('mappings', []):
-                if mapping.get('field_mappings'):
-                    normalized_fields = []
-                    for fm in mapping['field_mappings']:
-                        # Handle both formats: source/target and source_field/target_field
-                        normalized = {
-                            'source_field': fm.get('source_field') or fm.get('source', ''),
-                            'target_field': fm.get('target_field') or fm.get('target', ''),
-                        }
-                        if fm.get('expression'):
-                            normalized['expression'] = fm['expression']
-                        if fm.get('ignore'):
-                            normalized['ignore'] = fm['ignore']
-                        if fm.get('target_path'):
-                            normalized['target_path'] = fm['target_path']
-                        normalized_fields.append(normalized)
-                    mapping['field_mappings'] = normalized_fields
-            
-            return result
-        except Exception as e:
-            return {
-                'file': file_path or 'unknown',
-                'mappings': [],
-                'error': str(e),
-                'summary': {
-                    'total_mappings': 0,
-                    'mapstruct_mappings': 0,
-                    'pojo_mappings': 0
-                }
-            }
+        key = _content_key(code_content)
+        with self._parse_cache_lock:
+            cached = self._parse_cache.get(key)
+            if cached is not None:
+                self._parse_cache.move_to_end(key)
+        if cached is not None:
+            # Only the file name differs between identical chunks
+            return dict(cached, file=file_path or 'inline', mappings=list(cached['mappings']))
+        
+        result = _parse_with(self.extractor, code_content, file_path)
+        if 'error' not in result:
+            self._remember(key, result)
+            result = dict(result, mappings=list(result['mappings']))
+        return result
+    
+    def _remember(self, key: bytes, result: Dict):
+        with self._parse_cache_lock:
+            self._parse_cache[key] = result
+            if len(self._parse_cache) > PARSE_CACHE_SIZE:
+                self._parse_cache.popitem(last=False)
+    
+    def _parse_uncached_in_parallel(self, chunks: List[Tuple[str, str]]):
+        """Parse the distinct chunks missing from the memo in worker processes"""
+        pending = {}
+        with self._parse_cache_lock:
+            for code, file_path in chunks:
+                key = _content_key(code)
+                if key not in self._parse_cache and key not in pending:
+                    pending[key] = (code, file_path)
+                    if len(pending) == PARSE_CACHE_SIZE:
+                        break
+        workers = min(os.cpu_count() or 1, len(pending))
+        if len(pending) < PARALLEL_MIN_CHUNKS or workers < 2:
+            return
+        codes, file_paths = zip(*pending.values())
+        # Parsing is pure-Python regex work that holds the GIL, so threads would not help
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_parse_chunk, codes, file_paths,
+                                   chunksize=max(1, len(codes) // (workers * 4)))
+            for key, result in zip(pending, results):
+                if 'error' not in result:
+                    self._remember(key, result)
     
     def _extract_with_llm(self, code_content: str, file_path: str = None) -> Dict:
         """Extract mappings using LLM (more accurate, slower)"""
         if not self.ollama_client:
             return self._extract_with_parser(code_content, file_path)
         
-        prompt = f"""Analyze this Java code and extract all field-level mappings between source and destination objects.
-
-Code:
-```java
-{code_content[:8000]}  # Limit to avoid token limits
-```
-
-Extract:
-1. MapStruct mappings (interfaces with @Mapper annotation)
-2. POJO mappings (methods like mapXxx, convert, transform)
-3. Field-level mappings (source field -> target field)
-4. Any transformations or expressions
-
-Return a JSON structure with:
-- mapping_type: "mapstruct" or "pojo"
-- source_type: source class name
-- target_type: target class name
-- method_name: method name (if applicable)
-- field_mappings: [{{"source_field": "...", "target_field": "...", "transformation": "..."}}]
-
-JSON:"""
+        # Limit to avoid token limits
+        prompt = ''.join((LLM_PROMPT_HEAD, code_content[:LLM_MAX_CODE_CHARS], LLM_PROMPT_TAIL))
         
         try:
-            response = self.ollama_client.generate_with_llm(prompt)
-            # Parse JSON response and return structured mappings
-            # This is a simplified version - you might want to add more robust parsing
-            import json
+            response = self.ollama_client.generate_with_llm(prompt, stream=True)
+            if not response:
+                return self._extract_with_parser(code_content, file_path)
             try:
-                mappings = json.loads(response)
-                return {
-                    'file': file_path or 'unknown',
-                    'mappings': mappings if isinstance(mappings, list) else [mappings],
-                    'summary': {
-                        'total_mappings': len(mappings) if isinstance(mappings, list) else 1,
-                        'mapstruct_mappings': len([m for m in (mappings if isinstance(mappings, list) else [mappings]) if m.get('mapping_type') == 'mapstruct']),
-                        'pojo_mappings': len([m for m in (mappings if isinstance(mappings, list) else [mappings]) if m.get('mapping_type') == 'pojo'])
-                    }
-                }
-            except json.JSONDecodeError:
+                # Stops reading as soon as the output closes its JSON value or cannot be one
+                text = _read_json_value(_response_fragments(response))
+            finally:
+                response.close()
+            if text is None:
                 # Fallback to parser if LLM response is invalid
                 return self._extract_with_parser(code_content, file_path)
+            mappings = loads(text)
+            return {
+                'file': file_path or 'unknown',
+                'mappings': mappings if isinstance(mappings, list) else [mappings],
+                'summary': {
+                    'total_mappings': len(mappings) if isinstance(mappings, list) else 1,
+                    'mapstruct_mappings': len([m for m in (mappings if isinstance(mappings, list) else [mappings]) if m.get('mapping_type') == 'mapstruct']),
+                    'pojo_mappings': len([m for m in (mappings if isinstance(mappings, list) else [mappings]) if m.get('mapping_type') == 'pojo'])
+                }
+            }
         except Exception as e:
-            # Fallback to parser on error
+            # Fallback to parser on error (including JSON that does not parse)
             return self._extract_with_parser(code_content, file_path)
     
     def extract_from_retrievals(self, code_retrievals: List[Dict], 
                                 use_llm: Optional[bool] = None) -> List[Dict]:
         """Extract mappings from multiple retrieved code chunks"""
         all_mappings = []
+        chunks = []
         
         for retrieval in code_retrievals:
             code = retrieval.get('code', '') or retrieval.get('document', '')
@@ -134,9 +298,16 @@ JSON:"""
             file_path = metadata.get('file_path', 'unknown')
             
             if code:
-                extracted = self.extract_from_code(code, file_path, use_llm)
-                if extracted.get('mappings'):
-                    all_mappings.extend(extracted['mappings'])
+                chunks.append((code, file_path))
+        
+        if not ((use_llm if use_llm is not None else self.use_llm) and self.ollama_client):
+            # Warm the memo in parallel; the loop below then only copies cached results
+            self._parse_uncached_in_parallel(chunks)
+        
+        for code, file_path in chunks:
+            extracted = self.extract_from_code(code, file_path, use_llm)
+            if extracted.get('mappings'):
+                all_mappings.extend(extracted['mappings'])
         
         return all_mappings
 
@@ -2,136 +2,335 @@
 Ollama Client for Jina Embeddings
 """
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import math
 import time
 import threading
-from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Tuple
+
+from embedding_cache import EmbeddingLRUCache, DiskEmbeddingCache, make_cache_key
+from json_utils import dumps_bytes, loads, JSON_HEADERS
+from text_chunking import split_code_chunks
+
+# Longest text sent to the embedding model in one input (longer chunks hit EOF errors)
+MAX_EMBEDDING_CHARS = 2000
+# Longer texts passed to get_embeddings are embedded as overlapping windows of this size
+EMBEDDING_WINDOW_CHARS = 1800
+EMBEDDING_WINDOW_OVERLAP = 200
+# Seconds to wait for an embedding response; the first request may have to load the model
+EMBEDDING_TIMEOUT = 60
 
 
 class OllamaClient:
     """Client for interacting with Ollama API for embeddings"""
     
     def __init__(self, base_url: str = "http://localhost:11434", model: str = "nomic-embed-text",
-                 max_concurrent_requests: int = 2):
+                 max_concurrent_requests: int = 2, embed_batch_size: int = 32,
+                 session: Optional[requests.Session] = None, embedding_cache_size: int = 5000,
+                 disk_cache: Optional[DiskEmbeddingCache] = None, keep_alive: Optional[str] = None,
+                 connection_check_ttl: float = 30.0, serialize_on_cpu: bool = True):
         self.base_url = base_url.rstrip('/')
         self.model = model
-        self.embeddings_endpoint = f"{self.base_url}/api/embeddings"
+        # Persistent HTTP session: keep-alive connections are reused across embedding,
+        # generation and tag requests instead of opening a new TCP connection per call
+        self.session = session or self._create_session(max_concurrent_requests)
+        # /api/embed accepts a list of inputs, so N texts cost one HTTP round-trip
+        self.embed_endpoint = f"{self.base_url}/api/embed"
         self.generate_endpoint = f"{self.base_url}/api/generate"
+        # Number of texts sent per /api/embed request
+        self.embed_batch_size = max(1, embed_batch_size)
         # Semaphore to limit concurrent requests to Ollama (prevents overwhelming it)
         self._request_semaphore = threading.Semaphore(max_concurrent_requests)
+        # Concurrent requests to a model running on CPU fight over the same cores and are
+        # much slower than serial ones; after the first embedding /api/ps tells whether the
+        # model sits in VRAM, and on CPU the limit drops to one request at a time
+        self.max_concurrent_requests = max_concurrent_requests
+        self.serialize_on_cpu = serialize_on_cpu
+        self._device_checked = not serialize_on_cpu or max_concurrent_requests <= 1
+        self._device_lock = threading.Lock()
+        # Recently computed embeddings, keyed by (model, text), so repeated questions skip Ollama
+        self._embedding_cache = EmbeddingLRUCache(embedding_cache_size)
+        # Optional persistent cache behind the in-memory one (survives restarts)
+        self._disk_cache = disk_cache
+        # How long Ollama keeps models loaded after a request (e.g. "24h"); None uses the
+        # server default (OLLAMA_KEEP_ALIVE, 5m unless set)
+        self.keep_alive = keep_alive or None
+        # A successful check_connection() is reused for this many seconds, so per-file
+        # processing does not probe /api/tags for every file; failures are always re-checked
+        self.connection_check_ttl = connection_check_ttl
+        self._connection_ok_at: Optional[float] = None
+        # Same reuse for check_llm_model(), per model name (the Streamlit UI checks on every rerun)
+        self._llm_model_ok_at: Dict[str, float] = {}
+    
+    def _with_keep_alive(self, payload: Dict) -> Dict:
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        return payload
     
-    def check_connection(self) -> bool:
+    @staticmethod
+    def _create_session(max_concurrent_requests: int) -> requests.Session:
+        """Create a pooled keep-alive session sized for concurrent embedding workers"""
+        session = requests.Session()
+        # Enough pooled connections for the embedding workers plus a streaming LLM call
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, max_concurrent_requests * 2))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def check_connection(self, use_cache: bool = True) -> bool:
         """Check if Ollama is running and model is available"""
+        ok_at = self._connection_ok_at
+        if use_cache and ok_at is not None and time.monotonic() - ok_at < self.connection_check_ttl:
+            return True
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
             if response.status_code == 200:
-                models = response.json().get('models', [])
-                model_names = [m.get('name', '') for m in models]
-                return any(self.model in name for name in model_names)
+                model_names = {m.get('name', '') for m in response.json().get('models', ())}
+                # Exact name first; a substring match also accepts e.g. "model" for "model:latest"
+                available = self.model in model_names or any(self.model in name for name in model_names)
+                self._connection_ok_at = time.monotonic() if available else None
+                return available
+            self._connection_ok_at = None
             return False
         except Exception as e:
             print(f"Error checking Ollama connection: {e}")
+            self._connection_ok_at = None
             return False
     
-    def get_embeddings(self, text: str, max_retries: int = 3) -> Optional[List[float]]:
-        """Get embeddings for a text string with retry logic and size limits"""
-        if not text or not text.strip():
-            return None
-        
-        # Limit text size to prevent EOF errors (Jina embeddings have issues with large chunks)
+    def _truncate_for_embedding(self, text: str) -> str:
+        """Limit text size to prevent EOF errors (Jina embeddings have issues with large chunks)"""
         # Use smaller limit: ~2000 characters to be safe
-        max_text_length = 2000
+        max_text_length = MAX_EMBEDDING_CHARS
         if len(text) > max_text_length:
             # Truncate and add indicator
             text = text[:max_text_length] + "\n[... truncated for embedding ...]"
+        return text
+    
+    def get_embeddings(self, text: str, max_retries: int = 3) -> Optional[List[float]]:
+        """Get embeddings for a text string, served from the cache when already computed
+        
+        Texts longer than MAX_EMBEDDING_CHARS are embedded window by window (see
+        _embed_windows) instead of being truncated.
+        """
+        if not text or not text.strip():
+            return None
+        
+        cache_key = make_cache_key(self.model, text)
+        embedding = self._get_cached(cache_key)
+        if embedding is None:
+            if len(text) > MAX_EMBEDDING_CHARS:
+                embedding = self._embed_windows(text)
+            else:
+                embedding = self._fetch_embedding(text, max_retries)
+            if embedding:
+                self._embedding_cache.put(cache_key, embedding)
+                if self._disk_cache:
+                    self._disk_cache.put(cache_key, embedding)
+        return embedding
+    
+    def _embed_windows(self, text: str) -> Optional[List[float]]:
+        """Embed overlapping line-aligned windows of a long text, mean-pooled and L2-normalized"""
+        windows = split_code_chunks(text, EMBEDDING_WINDOW_CHARS, EMBEDDING_WINDOW_OVERLAP)
+        vectors = [v for v in self.get_embeddings_batch(windows) if v]
+        if not vectors:
+            return None
+        pooled = [sum(column) / len(vectors) for column in zip(*vectors)]
+        norm = math.sqrt(sum(x * x for x in pooled))
+        return [x / norm for x in pooled] if norm > 0 else pooled
+    
+    def _get_cached(self, cache_key: bytes) -> Optional[List[float]]:
+        """Look up an embedding in memory, then on disk (promoting disk hits to memory)"""
+        embedding = self._embedding_cache.get(cache_key)
+        if embedding is None and self._disk_cache:
+            embedding = self._disk_cache.get(cache_key)
+            if embedding is not None:
+                self._embedding_cache.put(cache_key, embedding)
+        return embedding
+    
+    def _fetch_embedding(self, text: str, max_retries: int = 3) -> Optional[List[float]]:
+        """Request an embedding from Ollama with retry logic and size limits"""
+        text = self._truncate_for_embedding(text)
         
         for attempt in range(max_retries):
-            # Use semaphore to limit concurrent requests (prevents overwhelming Ollama)
-            with self._request_semaphore:
-                try:
-                    payload = {
-                        "model": self.model,
-                        "prompt": text
-                    }
-                    
-                    # Use shorter timeout to fail fast
-                    timeout = 10
-                    
-                    response = requests.post(
-                        self.embeddings_endpoint,
-                        json=payload,
-                        timeout=timeout
+            try:
+                payload = self._with_keep_alive({
+                    "model": self.model,
+                    "input": [text]
+                })
+                
+                # Semaphore limits concurrent requests (prevents overwhelming Ollama); it is
+                # held only for the request itself, not for the backoff sleeps below
+                with self._request_semaphore:
+                    response = self.session.post(
+                        self.embed_endpoint,
+                        data=dumps_bytes(payload),
+                        headers=JSON_HEADERS,
+                        timeout=EMBEDDING_TIMEOUT
                     )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        embedding = result.get('embedding')
-                        if embedding:
-                            return embedding
+                
+                if response.status_code == 200:
+                    self._check_device()
+                    result = loads(response.content)
+                    embeddings = result.get('embeddings')
+                    embedding = embeddings[0] if embeddings else None
+                    if embedding:
+                        return embedding
+                    else:
+                        if attempt < max_retries - 1:
+                            time.sleep(0.5)
+                            continue
+                        return None
+                else:
+                    error_msg = response.text
+                    # Check if Ollama crashed or is overwhelmed
+                    if "llama runner process no longer running" in error_msg or "process" in error_msg.lower():
+                        if attempt < max_retries - 1:
+                            # Wait longer before retry (Ollama may need to restart)
+                            wait_time = 1.5 * (attempt + 1)  # Exponential backoff: 1.5s, 3s, 4.5s
+                            time.sleep(wait_time)
+                            continue
                         else:
-                            if attempt < max_retries - 1:
-                                time.sleep(0.5)
-                                continue
+                            # Don't print on final attempt to reduce noise
                             return None
-                    else:
-                        error_msg = response.text
-                        # Check if Ollama crashed or is overwhelmed
-                        if "llama runner process no longer running" in error_msg or "process" in error_msg.lower():
-                            if attempt < max_retries - 1:
-                                # Wait longer before retry (Ollama may need to restart)
-                                wait_time = 1.5 * (attempt + 1)  # Exponential backoff: 1.5s, 3s, 4.5s
-                                time.sleep(wait_time)
-                                continue
-                            else:
-                                # Don't print on final attempt to reduce noise
-                                return None
-                        # Check if it's a model-specific error
-                        elif "embedding" in error_msg.lower() and "EOF" in error_msg:
-                            if attempt < max_retries - 1:
-                                # Try with even smaller text on retry
-                                if len(text) > 1000:
-                                    text = text[:1000] + "\n[... truncated ...]"
-                                time.sleep(0.5)
-                                continue
-                            else:
-                                return None
+                    # Check if it's a model-specific error
+                    elif "embedding" in error_msg.lower() and "EOF" in error_msg:
+                        if attempt < max_retries - 1:
+                            # Try with even smaller text on retry
+                            if len(text) > 1000:
+                                text = text[:1000] + "\n[... truncated ...]"
+                            time.sleep(0.5)
+                            continue
                         else:
-                            if attempt < max_retries - 1:
-                                time.sleep(1.0)
-                                continue
-                            else:
-                                return None
-                            
-                except requests.exceptions.Timeout:
-                    if attempt < max_retries - 1:
-                        time.sleep(1.0)
-                        continue
-                    else:
-                        return None
-                except requests.exceptions.ConnectionError as e:
-                    if attempt < max_retries - 1:
-                        # Wait longer for connection errors (Ollama may be restarting)
-                        time.sleep(2.0 * (attempt + 1))
-                        continue
-                    else:
-                        return None
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        time.sleep(0.5)
-                        continue
+                            return None
                     else:
-                        return None
-        
+                        if attempt < max_retries - 1:
+                            time.sleep(1.0)
+                            continue
+                        else:
+                            return None
+                        
+            except requests.exceptions.Timeout:
+                if attempt < max_retries - 1:
+                    time.sleep(1.0)
+                    continue
+                else:
+                    return None
+            except requests.exceptions.ConnectionError as e:
+                if attempt < max_retries - 1:
+                    # Wait longer for connection errors (Ollama may be restarting)
+                    time.sleep(2.0 * (attempt + 1))
+                    continue
+                else:
+                    return None
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    time.sleep(0.5)
+                    continue
+                else:
+                    return None
+    
         return None
     
-    def get_embeddings_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
-        """Get embeddings for multiple texts"""
-        embeddings = []
-        for text in texts:
-            emb = self.get_embeddings(text)
-            embeddings.append(emb)
+    def get_embeddings_batch(self, texts: List[str], batch_size: Optional[int] = None) -> List[Optional[List[float]]]:
+        """Get embeddings for multiple texts, one /api/embed request per batch
+        
+        Results are returned in input order. Empty texts get None. Identical texts are
+        embedded once. If a batch request fails, it is split up (see _embed_texts). Texts
+        longer than MAX_EMBEDDING_CHARS are embedded window by window like in get_embeddings.
+        """
+        batch_size = batch_size or self.embed_batch_size
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        
+        # Serve cached texts directly; only the misses go to Ollama, each distinct text once
+        pending: Dict[bytes, Tuple[str, List[int]]] = {}
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            cache_key = make_cache_key(self.model, text)
+            if cache_key in pending:
+                pending[cache_key][1].append(i)
+                continue
+            embeddings[i] = self._get_cached(cache_key)
+            if embeddings[i] is None:
+                pending[cache_key] = (text, [i])
+        
+        # Similar-length texts share a batch, so the server pads short inputs less;
+        # results still land at their input index
+        misses = sorted(pending.items(), key=lambda item: len(item[1][0]), reverse=True)
+        # Texts too long for one model input get the same windowed vector as in get_embeddings,
+        # so a text's cached embedding does not depend on which path computed it first
+        long_misses = [item for item in misses if len(item[1][0]) > MAX_EMBEDDING_CHARS]
+        if long_misses:
+            misses = misses[len(long_misses):]
+        batches = [misses[start:start + batch_size] for start in range(0, len(misses), batch_size)]
+        
+        def embed(batch):
+            return self._embed_texts([text for _, (text, _) in batch])
+        
+        # Several batches are sent concurrently (up to max_concurrent_requests), so the
+        # server works on one while the next is in transit
+        if len(batches) > 1 and self.max_concurrent_requests > 1:
+            with ThreadPoolExecutor(max_workers=min(len(batches), self.max_concurrent_requests)) as executor:
+                batch_results = list(executor.map(embed, batches))
+        else:
+            batch_results = [embed(batch) for batch in batches]
+        if long_misses:
+            batches.append(long_misses)
+            batch_results.append([self._embed_windows(text) for _, (text, _) in long_misses])
+        
+        for batch, batch_embeddings in zip(batches, batch_results):
+            computed = []
+            for (cache_key, (_, indices)), emb in zip(batch, batch_embeddings):
+                for i in indices:
+                    embeddings[i] = emb
+                if emb:
+                    self._embedding_cache.put(cache_key, emb)
+                    computed.append((cache_key, emb))
+            if self._disk_cache:
+                self._disk_cache.put_many(computed)
+        
         return embeddings
     
+    def _embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed texts in one request, splitting the batch in halves when Ollama rejects it
+        
+        One bad input (e.g. an EOF error on a single chunk) then costs a few extra batch
+        requests instead of one request per text. If Ollama cannot be reached at all the
+        texts go straight to the per-text retry path.
+        """
+        if len(texts) == 1:
+            return [self._fetch_embedding(texts[0])]
+        try:
+            embeddings = self._embed_batch([self._truncate_for_embedding(text) for text in texts])
+        except requests.exceptions.RequestException:
+            return [self._fetch_embedding(text) for text in texts]
+        if embeddings is not None:
+            return embeddings
+        mid = len(texts) // 2
+        return self._embed_texts(texts[:mid]) + self._embed_texts(texts[mid:])
+    
+    def _embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embed a list of texts in a single request; None if Ollama answers with an error
+        
+        Connection errors and timeouts are raised to the caller.
+        """
+        with self._request_semaphore:
+            response = self.session.post(
+                self.embed_endpoint,
+                data=dumps_bytes(self._with_keep_alive({"model": self.model, "input": texts})),
+                headers=JSON_HEADERS,
+                timeout=EMBEDDING_TIMEOUT
+            )
+        if response.status_code == 200:
+            self._check_device()
+            # Embedding responses are mostly floats, which orjson parses far faster than json
+            embeddings = loads(response.content).get('embeddings')
+            if embeddings and len(embeddings) == len(texts):
+                return embeddings
+        return None
+    
     def generate_embedding_description(self, code_snippet: str, mapping_info: Dict) -> Optional[str]:
         """Use Ollama to generate a description of the mapping using embeddings context"""
         try:
@@ -152,14 +351,15 @@ Provide a concise description of what this mapping does."""
                 "stream": False
             }
             
-            response = requests.post(
+            response = self.session.post(
                 self.generate_endpoint,
-                json=payload,
+                data=dumps_bytes(payload),
+                headers=JSON_HEADERS,
                 timeout=60
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = loads(response.content)
                 return result.get('response', '')
             else:
                 return None
@@ -171,15 +371,18 @@ Provide a concise description of what this mapping does."""
         """Enhance mappings with embedding-based understanding"""
         enhanced_mappings = []
         
+        # Create a context string from each mapping
+        contexts = []
         for mapping in mappings:
-            # Create a context string from the mapping
             context = f"Mapping from {mapping.get('source_type')} to {mapping.get('target_type')}"
             if mapping.get('field_mappings'):
                 context += f" with {len(mapping['field_mappings'])} field mappings"
-            
-            # Get embedding for the mapping context
-            embedding = self.get_embeddings(context)
-            
+            contexts.append(context)
+        
+        # Embed all mapping contexts in batched requests
+        embeddings = self.get_embeddings_batch(contexts)
+        
+        for mapping, context, embedding in zip(mappings, contexts, embeddings):
             enhanced_mapping = mapping.copy()
             if embedding:
                 enhanced_mapping['embedding_context'] = context
@@ -209,18 +412,19 @@ Provide a concise description of what this mapping does."""
                           stream: bool = False, system: Optional[str] = None) -> Optional[str]:
         """Generate text using an LLM model (e.g., Qwen2.5-Coder)"""
         try:
-            payload = {
+            payload = self._with_keep_alive({
                 "model": model,
                 "prompt": prompt,
                 "stream": stream
-            }
+            })
             
             if system:
                 payload["system"] = system
             
-            response = requests.post(
+            response = self.session.post(
                 self.generate_endpoint,
-                json=payload,
+                data=dumps_bytes(payload),
+                headers=JSON_HEADERS,
                 timeout=120,
                 stream=stream
             )
@@ -230,7 +434,7 @@ Provide a concise description of what this mapping does."""
                     # For streaming, return the response object
                     return response
                 else:
-                    result = response.json()
+                    result = loads(response.content)
                     return result.get('response', '')
             else:
                 print(f"Error generating with LLM: {response.status_code} - {response.text}")
@@ -239,14 +443,75 @@ Provide a concise description of what this mapping does."""
             print(f"Exception generating with LLM: {e}")
             return None
     
+    def preload_model(self, model: Optional[str] = None, embedding: bool = True) -> bool:
+        """Load a model into Ollama's memory without generating anything
+        
+        An empty /api/embed input or a prompt-less /api/generate request only loads the
+        model, so the first real question does not pay the model load time.
+        """
+        model = model or self.model
+        if embedding:
+            url, payload = self.embed_endpoint, {"model": model, "input": []}
+        else:
+            url, payload = self.generate_endpoint, {"model": model}
+        try:
+            response = self.session.post(url, json=self._with_keep_alive(payload), timeout=300)
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error preloading model {model}: {e}")
+            return False
+    
+    def _check_device(self):
+        """Once the model is loaded, serialize requests if Ollama runs it on CPU"""
+        if self._device_checked:
+            return
+        with self._device_lock:
+            if self._device_checked:
+                return
+            self._device_checked = True
+            if self.model_on_cpu():
+                # Requests already in flight finish on the old semaphore
+                self._request_semaphore = threading.Semaphore(1)
+                print(f"⚠ Embedding model '{self.model}' runs on CPU - sending one request at a time")
+    
+    def model_on_cpu(self, model: Optional[str] = None) -> Optional[bool]:
+        """True if a loaded model has no part in VRAM, None if it is not loaded or unknown"""
+        model = model or self.model
+        try:
+            response = self.session.get(f"{self.base_url}/api/ps", timeout=5)
+            if response.status_code == 200:
+                for m in response.json().get('models', []):
+                    if model in m.get('name', '') and 'size_vram' in m:
+                        return m['size_vram'] == 0
+        except Exception:
+            pass
+        return None
+    
+    def loaded_models(self) -> List[str]:
+        """Names of the models currently loaded in Ollama's memory"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/ps", timeout=5)
+            if response.status_code == 200:
+                return [m.get('name', '') for m in response.json().get('models', [])]
+        except Exception:
+            pass
+        return []
+    
     def check_llm_model(self, model: str = "qwen2.5-coder:7b") -> bool:
         """Check if an LLM model is available"""
+        ok_at = self._llm_model_ok_at.get(model)
+        if ok_at is not None and time.monotonic() - ok_at < self.connection_check_ttl:
+            return True
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
             if response.status_code == 200:
-                models = response.json().get('models', [])
-                model_names = [m.get('name', '') for m in models]
-                return any(model in name or name in model for name in model_names)
+                model_names = {m.get('name', '') for m in response.json().get('models', ())}
+                available = model in model_names or any(model in name or name in model for name in model_names)
+                if available:
+                    self._llm_model_ok_at[model] = time.monotonic()
+                else:
+                    self._llm_model_ok_at.pop(model, None)
+                return available
             return False
         except Exception as e:
             print(f"Error checking LLM model: {e}")
@@ -2,31 +2,112 @@
 RAG (Retrieval-Augmented Generation) Service
 Combines vector database retrieval with LLM generation
 """
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
-import json
+from json_utils import loads
+from semantic_cache import SemanticCache
+
+
+RAG_SYSTEM_PROMPT = """You are an expert Java code understanding assistant specializing in MapStruct and POJO mappings. 
+Your task is to analyze the provided FULL SOURCE CODE and answer questions with clear reasoning.
+
+Guidelines:
+1. Analyze the FULL CODE provided - you have the complete source code, not just summaries
+2. Provide clear, detailed explanations based on the actual code
+3. Reference specific lines, methods, and classes from the code
+4. Explain the mapping logic and field transformations in detail
+5. Identify where and how fields are used throughout the codebase
+6. Be specific about source-to-destination mappings
+7. If the code shows multiple related files, explain how they work together
+8. If information is not available in the context, say so clearly"""
+
+_PROMPT_HEAD = "Based on the following FULL SOURCE CODE, answer this question: "
+
+_PROMPT_TAIL = """
+
+Please provide:
+1. A detailed explanation based on the actual code provided
+2. Specific references to classes, methods, and fields in the code
+3. How the mapping logic works in the context of the full codebase
+4. Where and how the fields are used throughout the code
+5. Any important patterns or relationships you notice in the code
+
+Answer:"""
+
+# Rough token size of source code, used for the prompt budget
+CHARS_PER_TOKEN = 4
+
+TRUNCATED_MARKER = "\n[... truncated to fit the context budget ...]"
+
+NO_CONTEXT = "No relevant code or mappings found."
+
+NO_RELEVANT_CONTEXT_ANSWER = "I don't have relevant code or mappings in the index for this question."
+
+
+def _similarity(distance: Optional[float]) -> float:
+    """Similarity shown for a retrieval (a distance of 0 is a perfect match, not 0%)"""
+    return 1 - distance if distance is not None else 0
+
+
+def _unique_mappings(mappings: List[Dict]) -> List[Dict]:
+    """Drop mappings that would render identically in the context (overlapping retrieved chunks)"""
+    seen = set()
+    unique = []
+    for mapping in mappings:
+        key = (
+            mapping.get('type'), mapping.get('source_type'), mapping.get('target_type'),
+            mapping.get('method') or None,
+            tuple((fm.get('source_field'), fm.get('target_field')) for fm in mapping.get('field_mappings') or ())
+        )
+        if key not in seen:
+            seen.add(key)
+            unique.append(mapping)
+    return unique
 
 
 class RAGService:
     """Service for RAG-based code understanding"""
     
     def __init__(self, ollama_client, vector_db, llm_model: str = "qwen2.5-coder:7b", 
-                 extract_mappings_on_demand: bool = True):
+                 extract_mappings_on_demand: bool = True, semantic_cache_threshold: float = 0.92,
+                 semantic_cache_size: int = 256, semantic_cache_ttl: float = 3600.0,
+                 max_context_tokens: int = 8000, min_retrieval_similarity: float = 0.0):
         self.ollama_client = ollama_client
         self.vector_db = vector_db
         self.llm_model = llm_model
         self.extract_mappings_on_demand = extract_mappings_on_demand
+        self._has_code_collection = hasattr(vector_db, 'code_collection')
+        # Questions whose best retrieval is less similar than this get a canned answer
+        # instead of an LLM call (0 = always ask the LLM)
+        self.min_retrieval_similarity = min_retrieval_similarity
+        # Retrieved code put into the prompt is capped at about this many tokens (0 = no cap);
+        # prompt prefill time grows with every token
+        self.max_context_tokens = max_context_tokens
+        # Near-duplicate questions reuse the earlier answer (threshold 0 disables the cache)
+        self.semantic_cache = None
+        if semantic_cache_threshold > 0 and semantic_cache_size > 0:
+            self.semantic_cache = SemanticCache(semantic_cache_threshold, semantic_cache_size,
+                                                semantic_cache_ttl)
         
         # Lazy import to avoid circular dependencies
         self._mapping_extractor = None
+        self._mapping_extractor_lock = threading.Lock()
+        if extract_mappings_on_demand:
+            # Import and build the extractor in the background so the first question does not wait
+            threading.Thread(target=self._get_mapping_extractor, daemon=True).start()
     
     def _get_mapping_extractor(self):
         """Get or create the on-demand mapping extractor"""
         if self._mapping_extractor is None:
-            from mapping_extractor_on_demand import OnDemandMappingExtractor
-            self._mapping_extractor = OnDemandMappingExtractor(
-                ollama_client=self.ollama_client,
-                use_llm=False  # Use parser by default (faster)
-            )
+            with self._mapping_extractor_lock:
+                if self._mapping_extractor is None:
+                    from mapping_extractor_on_demand import OnDemandMappingExtractor
+                    self._mapping_extractor = OnDemandMappingExtractor(
+                        ollama_client=self.ollama_client,
+                        use_llm=False  # Use parser by default (faster)
+                    )
         return self._mapping_extractor
     
     def build_context_from_retrievals(self, retrievals: List[Dict], code_retrievals: List[Dict] = None,
@@ -38,102 +119,99 @@ class RAGService:
             code_retrievals: Retrieved code chunks
             extract_mappings: Whether to extract mappings from code on-demand (defaults to self.extract_mappings_on_demand)
         """
+        if not retrievals and not code_retrievals:
+            return NO_CONTEXT
         context_parts = []
+        # Parts are joined once at the end; large bodies (code, details) are their own parts so
+        # they are copied only by that join, not first into an f-string
+        add = context_parts.append
         extract_mappings = extract_mappings if extract_mappings is not None else self.extract_mappings_on_demand
         
         # Add full code files first (most important for LLM understanding)
         extracted_mappings = []
         if code_retrievals:
-            context_parts.append("=== Relevant Code Files (Full Source Code) ===\n")
+            add("=== Relevant Code Files (Full Source Code) ===\n")
+            code_budget = self.max_context_tokens * CHARS_PER_TOKEN if self.max_context_tokens > 0 else None
             for i, retrieval in enumerate(code_retrievals, 1):
                 metadata = retrieval.get('metadata', {})
                 code = retrieval.get('code', '') or retrieval.get('document', '')
-                distance = retrieval.get('distance', 0)
-                similarity = 1 - distance if distance else 0
-                
-                context_parts.append(f"\n--- Code File {i} (Similarity: {similarity:.2%}) ---")
-                context_parts.append(f"File: {metadata.get('file_path', 'N/A')}")
-                if metadata.get('chunk_index') is not None:
-                    context_parts.append(f"Chunk: {metadata.get('chunk_index') + 1}/{metadata.get('total_chunks', '?')}")
-                context_parts.append(f"\nFull Code:\n{code}")
-                context_parts.append("")
+                if code_budget is not None:
+                    # Retrievals come best-first, so the budget cuts the least similar code
+                    if code_budget <= 0:
+                        break
+                    if len(code) > code_budget:
+                        cut = code.rfind('\n', 0, code_budget)
+                        code = code[:cut if cut > 0 else code_budget] + TRUNCATED_MARKER
+                        code_budget = 0
+                    else:
+                        code_budget -= len(code)
+                similarity = _similarity(retrieval.get('distance'))
                 
-                # Extract mappings on-demand if requested
-                if extract_mappings and code:
-                    extractor = self._get_mapping_extractor()
-                    mappings = extractor.extract_from_code(code, metadata.get('file_path'))
-                    if mappings.get('mappings'):
-                        extracted_mappings.extend(mappings['mappings'])
+                get = metadata.get
+                chunk_index = get('chunk_index')
+                # Header lines go in as one part (the final join puts the same newlines between them)
+                header = f"\n--- Code File {i} (Similarity: {similarity:.2%}) ---\nFile: {get('file_path', 'N/A')}"
+                if chunk_index is not None:
+                    header = f"{header}\nChunk: {chunk_index + 1}/{get('total_chunks', '?')}"
+                add(header)
+                add("\nFull Code:")
+                add(code)
+                add("")
+            
+            # Extract mappings on-demand if requested (memoized per chunk content, so chunks
+            # that recur across questions are parsed once)
+            if extract_mappings:
+                extracted_mappings = _unique_mappings(
+                    self._get_mapping_extractor().extract_from_retrievals(code_retrievals))
         
         # Add extracted mappings (on-demand)
         if extracted_mappings:
-            context_parts.append("=== Extracted Mappings (On-Demand) ===\n")
+            add("=== Extracted Mappings (On-Demand) ===\n")
             for i, mapping in enumerate(extracted_mappings, 1):
-                context_parts.append(f"\n--- Mapping {i} ---")
-                context_parts.append(f"Type: {mapping.get('type', 'N/A')}")
-                context_parts.append(f"Source: {mapping.get('source_type', 'N/A')} -> Target: {mapping.get('target_type', 'N/A')}")
-                if mapping.get('method'):
-                    context_parts.append(f"Method: {mapping.get('method')}")
-                if mapping.get('field_mappings'):
-                    context_parts.append("Field Mappings:")
-                    for fm in mapping['field_mappings']:
-                        context_parts.append(f"  {fm.get('source_field')} -> {fm.get('target_field')}")
-                context_parts.append("")
+                get = mapping.get
+                method = get('method')
+                add(f"\n--- Mapping {i} ---\nType: {get('type', 'N/A')}\n"
+                    f"Source: {get('source_type', 'N/A')} -> Target: {get('target_type', 'N/A')}")
+                if method:
+                    add(f"Method: {method}")
+                field_mappings = get('field_mappings')
+                if field_mappings:
+                    add("Field Mappings:")
+                    add("\n".join([f"  {fm.get('source_field')} -> {fm.get('target_field')}" for fm in field_mappings]))
+                add("")
         
         # Add pre-extracted mapping summaries (if available)
         if retrievals:
-            context_parts.append("=== Pre-Extracted Mappings (Summary) ===\n")
+            add("=== Pre-Extracted Mappings (Summary) ===\n")
             for i, retrieval in enumerate(retrievals, 1):
                 metadata = retrieval.get('metadata', {})
                 document = retrieval.get('document', '')
-                distance = retrieval.get('distance', 0)
-                similarity = 1 - distance if distance else 0
+                similarity = _similarity(retrieval.get('distance'))
                 
-                context_parts.append(f"\n--- Mapping {i} (Similarity: {similarity:.2%}) ---")
-                context_parts.append(f"File: {metadata.get('file_path', 'N/A')}")
-                context_parts.append(f"Type: {metadata.get('mapping_type', 'N/A')}")
-                context_parts.append(f"Source: {metadata.get('source_type', 'N/A')} -> Target: {metadata.get('target_type', 'N/A')}")
-                if metadata.get('interface'):
-                    context_parts.append(f"Interface: {metadata.get('interface')}")
-                if metadata.get('method'):
-                    context_parts.append(f"Method: {metadata.get('method')}")
-                context_parts.append(f"\nDetails:\n{document}")
-                context_parts.append("")
+                get = metadata.get
+                interface = get('interface')
+                method = get('method')
+                add(f"\n--- Mapping {i} (Similarity: {similarity:.2%}) ---\nFile: {get('file_path', 'N/A')}\n"
+                    f"Type: {get('mapping_type', 'N/A')}\n"
+                    f"Source: {get('source_type', 'N/A')} -> Target: {get('target_type', 'N/A')}")
+                if interface:
+                    add(f"Interface: {interface}")
+                if method:
+                    add(f"Method: {method}")
+                add("\nDetails:")
+                add(document)
+                add("")
         
         if not context_parts:
-            return "No relevant code or mappings found."
+            return NO_CONTEXT
         
         return "\n".join(context_parts)
     
     def create_rag_prompt(self, question: str, context: str) -> str:
         """Create a RAG prompt for the LLM with full code context"""
-        system_prompt = """You are an expert Java code understanding assistant specializing in MapStruct and POJO mappings. 
-Your task is to analyze the provided FULL SOURCE CODE and answer questions with clear reasoning.
-
-Guidelines:
-1. Analyze the FULL CODE provided - you have the complete source code, not just summaries
-2. Provide clear, detailed explanations based on the actual code
-3. Reference specific lines, methods, and classes from the code
-4. Explain the mapping logic and field transformations in detail
-5. Identify where and how fields are used throughout the codebase
-6. Be specific about source-to-destination mappings
-7. If the code shows multiple related files, explain how they work together
-8. If information is not available in the context, say so clearly"""
-        
-        prompt = f"""Based on the following FULL SOURCE CODE, answer this question: {question}
-
-{context}
-
-Please provide:
-1. A detailed explanation based on the actual code provided
-2. Specific references to classes, methods, and fields in the code
-3. How the mapping logic works in the context of the full codebase
-4. Where and how the fields are used throughout the code
-5. Any important patterns or relationships you notice in the code
-
-Answer:"""
-        
-        return prompt, system_prompt
+        # Only the question and context vary; the fixed parts are module constants. One join
+        # copies the (large) context once, where chained + would copy it for every operand
+        return "".join((_PROMPT_HEAD, question, "\n\n", context, _PROMPT_TAIL)), RAG_SYSTEM_PROMPT
     
     def answer_question(self, question: str, n_retrievals: int = 5, use_full_code: bool = True) -> Dict:
         """Answer a question using RAG with full code context"""
@@ -153,21 +231,22 @@ Answer:"""
                 result['error'] = "Could not generate embedding for question"
                 return result
             
-            # Step 2: Retrieve similar mappings from vector DB
-            mapping_retrievals = self.vector_db.search_similar(
-                question_embedding, 
-                n_results=n_retrievals
-            )
+            # Scope taken before retrieval: an answer built from data that changes meanwhile
+            # is cached under the old data_version
+            cache_scope = self._cache_scope(n_retrievals, use_full_code)
+            cached = self._cached_answer(question, question_embedding, cache_scope)
+            if cached is not None:
+                result.update(cached)
+                return result
+            
+            # Steps 2-3: Retrieve similar mappings and (if enabled) full code files
+            mapping_retrievals, code_retrievals = self._retrieve(question_embedding, n_retrievals, use_full_code)
             result['retrievals'] = mapping_retrievals
+            result['code_retrievals'] = code_retrievals
             
-            # Step 3: Retrieve full code files if enabled
-            code_retrievals = []
-            if use_full_code and hasattr(self.vector_db, 'code_collection'):
-                code_retrievals = self.vector_db.search_code(
-                    question_embedding,
-                    n_results=n_retrievals
-                )
-                result['code_retrievals'] = code_retrievals
+            if self._below_similarity_floor(mapping_retrievals, code_retrievals):
+                result['answer'] = NO_RELEVANT_CONTEXT_ANSWER
+                return result
             
             # Step 4: Build context from both mappings and full code
             context = self.build_context_from_retrievals(mapping_retrievals, code_retrievals)
@@ -185,6 +264,8 @@ Answer:"""
             
             if answer:
                 result['answer'] = answer
+                self._cache_answer(question, question_embedding, cache_scope,
+                                   mapping_retrievals, code_retrievals, context, answer)
             else:
                 result['error'] = "Could not generate answer from LLM"
             
@@ -193,28 +274,105 @@ Answer:"""
         
         return result
     
-    def answer_question_streaming(self, question: str, n_retrievals: int = 5, use_full_code: bool = True):
-        """Answer a question using RAG with streaming response"""
+    def _retrieve(self, question_embedding: List[float], n_retrievals: int, use_full_code: bool,
+                  mapping_retrievals: Optional[List[Dict]] = None):
+        """Mapping and code retrievals for a question, with the two searches run concurrently"""
+        search_code = use_full_code and self._has_code_collection
+        if mapping_retrievals is not None or not search_code:
+            if mapping_retrievals is None:
+                mapping_retrievals = self.vector_db.search_similar(question_embedding, n_results=n_retrievals)
+            code_retrievals = []
+            if search_code:
+                code_retrievals = self.vector_db.search_code(question_embedding, n_results=n_retrievals)
+            return mapping_retrievals, code_retrievals
+        
+        # Both searches take the same query; apply the PCA projection (if any) only once
+        question_embedding = self.vector_db.project_query(question_embedding)
+        # Independent queries against different collections; Chroma releases the GIL while searching
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            mappings_future = executor.submit(self.vector_db.search_similar, question_embedding,
+                                              n_results=n_retrievals)
+            code_future = executor.submit(self.vector_db.search_code, question_embedding,
+                                          n_results=n_retrievals)
+            return mappings_future.result(), code_future.result()
+    
+    def _below_similarity_floor(self, mapping_retrievals: List[Dict], code_retrievals: List[Dict]) -> bool:
+        """True when no retrieval reaches min_retrieval_similarity (so the LLM would lack context)"""
+        if self.min_retrieval_similarity <= 0:
+            return False
+        distances = [r.get('distance') for r in mapping_retrievals + code_retrievals]
+        distances = [d for d in distances if d is not None]
+        if not distances:
+            # Nothing retrieved, or no distances to judge: ask the LLM as before
+            return False
+        return _similarity(min(distances)) < self.min_retrieval_similarity
+    
+    def _cache_scope(self, n_retrievals: int, use_full_code: bool) -> tuple:
+        """Semantic cache scope for a question
+        
+        Includes the vector DB's data_version, persisted next to the collections, so answers
+        cached before they changed (ingestion by any process, upload, clear) are no longer
+        returned.
+        """
+        return (self.llm_model, n_retrievals, use_full_code, getattr(self.vector_db, 'data_version', 0))
+    
+    @staticmethod
+    def _question_key(question: str) -> str:
+        """Question words, lowercased: cached answers are only reused for the same wording
+        
+        Embeddings of questions about different entities ("How is Order mapped?" vs
+        "How is Invoice mapped?") can be close enough to clear the similarity threshold.
+        """
+        return ' '.join(re.findall(r'\w+', question.lower()))
+    
+    def _cached_answer(self, question: str, question_embedding: List[float], scope: tuple) -> Optional[Dict]:
+        if self.semantic_cache is None:
+            return None
+        return self.semantic_cache.get(question_embedding, scope, self._question_key(question))
+    
+    def _cache_answer(self, question: str, question_embedding: List[float], scope: tuple,
+                      mapping_retrievals: List[Dict], code_retrievals: List[Dict], context: str,
+                      answer: str):
+        if self.semantic_cache is None or not answer:
+            return
+        self.semantic_cache.put(question_embedding, {
+            'retrievals': mapping_retrievals,
+            'code_retrievals': code_retrievals,
+            'context': context,
+            'answer': answer
+        }, scope, self._question_key(question))
+    
+    def answer_question_streaming(self, question: str, n_retrievals: int = 5, use_full_code: bool = True,
+                                  precomputed_embedding: Optional[List[float]] = None,
+                                  precomputed_retrievals: Optional[List[Dict]] = None):
+        """Answer a question using RAG with streaming response
+        
+        Callers that already embedded the question and searched the mappings (e.g. to
+        display them) can pass precomputed_embedding/precomputed_retrievals to skip
+        repeating that work.
+        """
         try:
             # Step 1: Get embedding for the question
-            question_embedding = self.ollama_client.get_embeddings(question)
+            question_embedding = precomputed_embedding or self.ollama_client.get_embeddings(question)
             if not question_embedding:
                 yield {"error": "Could not generate embedding for question"}
                 return
             
-            # Step 2: Retrieve similar mappings from vector DB
-            mapping_retrievals = self.vector_db.search_similar(
-                question_embedding, 
-                n_results=n_retrievals
-            )
+            # Scope taken before retrieval: an answer built from data that changes meanwhile
+            # is cached under the old data_version
+            cache_scope = self._cache_scope(n_retrievals, use_full_code)
+            cached = self._cached_answer(question, question_embedding, cache_scope)
+            if cached is not None:
+                yield {"chunk": cached['answer'], "done": True}
+                return
             
-            # Step 3: Retrieve full code files if enabled
-            code_retrievals = []
-            if use_full_code and hasattr(self.vector_db, 'code_collection'):
-                code_retrievals = self.vector_db.search_code(
-                    question_embedding,
-                    n_results=n_retrievals
-                )
+            # Steps 2-3: Retrieve similar mappings and (if enabled) full code files
+            mapping_retrievals, code_retrievals = self._retrieve(question_embedding, n_retrievals, use_full_code,
+                                                                 precomputed_retrievals)
+            
+            if self._below_similarity_floor(mapping_retrievals, code_retrievals):
+                yield {"chunk": NO_RELEVANT_CONTEXT_ANSWER, "done": True}
+                return
             
             # Step 4: Build context from both mappings and full code
             context = self.build_context_from_retrievals(mapping_retrievals, code_retrievals)
@@ -231,23 +389,39 @@ Answer:"""
             )
             
             if response:
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            if 'response' in data:
-                                yield {"chunk": data['response'], "done": data.get('done', False)}
-                            elif 'message' in data and 'content' in data['message']:
-                                # Alternative format
-                                yield {"chunk": data['message']['content'], "done": data.get('done', False)}
-                        except json.JSONDecodeError:
-                            # Try to decode as text if JSON fails
+                answer_parts = []
+                try:
+                    for line in response.iter_lines():
+                        if line:
                             try:
-                                decoded = line.decode('utf-8')
-                                if decoded.strip():
-                                    yield {"chunk": decoded, "done": False}
-                            except:
-                                continue
+                                data = loads(line)
+                                if 'response' in data:
+                                    chunk = data['response']
+                                elif 'message' in data and 'content' in data['message']:
+                                    # Alternative format
+                                    chunk = data['message']['content']
+                                else:
+                                    continue
+                                done = data.get('done', False)
+                                answer_parts.append(chunk)
+                                if done:
+                                    # Cache before yielding: consumers usually stop at the done chunk
+                                    self._cache_answer(question, question_embedding, cache_scope,
+                                                       mapping_retrievals, code_retrievals, context,
+                                                       ''.join(answer_parts))
+                                yield {"chunk": chunk, "done": done}
+                            except ValueError:
+                                # Try to decode as text if JSON fails
+                                try:
+                                    decoded = line.decode('utf-8')
+                                    if decoded.strip():
+                                        answer_parts.append(decoded)
+                                        yield {"chunk": decoded, "done": False}
+                                except:
+                                    continue
+                finally:
+                    # Release the pooled connection even if the consumer stops early
+                    response.close()
             else:
                 yield {"error": "Could not generate answer from LLM"}
                 
@@ -0,0 +1,87 @@
+"""
+Search result reranking - maximal marginal relevance (MMR) for diverse code hits
+"""
+from typing import List
+
+import numpy as np
+
+try:
+    import numba
+    from numba import prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+# Candidate pools at least this large use the numba kernel when available
+NUMBA_MIN_CANDIDATES = 64
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _mmr_order(sim_qc: np.ndarray, sim_cc: np.ndarray, lambda_mult: float, k: int) -> np.ndarray:
+    """Greedy MMR over precomputed similarities (loop form, compiled with numba when available)"""
+    n = sim_qc.shape[0]
+    selected = np.empty(k, dtype=np.int64)
+    chosen = np.zeros(n, dtype=np.bool_)
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = np.zeros(n, dtype=np.float32)
+    for step in range(k):
+        best = -1
+        best_score = -np.inf
+        for i in range(n):
+            if chosen[i]:
+                continue
+            score = lambda_mult * sim_qc[i] - (1.0 - lambda_mult) * redundancy[i]
+            if score > best_score:
+                best_score = score
+                best = i
+        selected[step] = best
+        chosen[best] = True
+        for i in prange(n):
+            if step == 0 or sim_cc[best, i] > redundancy[i]:
+                redundancy[i] = sim_cc[best, i]
+    return selected
+
+
+if NUMBA_AVAILABLE:
+    _mmr_order = numba.njit(cache=True, parallel=True)(_mmr_order)
+
+
+def _mmr_order_numpy(sim_qc: np.ndarray, sim_cc: np.ndarray, lambda_mult: float, k: int) -> np.ndarray:
+    """Same selection as _mmr_order, vectorized per step"""
+    n = sim_qc.shape[0]
+    selected = np.empty(k, dtype=np.int64)
+    chosen = np.zeros(n, dtype=bool)
+    redundancy = np.zeros(n, dtype=np.float32)
+    for step in range(k):
+        scores = lambda_mult * sim_qc - (1.0 - lambda_mult) * redundancy
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        selected[step] = best
+        chosen[best] = True
+        redundancy = sim_cc[best] if step == 0 else np.maximum(redundancy, sim_cc[best])
+    return selected
+
+
+def mmr_select(query_embedding: List[float], candidate_embeddings: List[List[float]], k: int,
+               lambda_mult: float = 0.5) -> List[int]:
+    """Indices of k candidates balancing similarity to the query against similarity to each other
+
+    lambda_mult=1 ranks purely by relevance, 0 purely by diversity. Uses cosine similarity.
+    """
+    k = min(k, len(candidate_embeddings))
+    if k <= 0:
+        return []
+    candidates = _normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    sim_qc = candidates @ query
+    sim_cc = candidates @ candidates.T
+    if NUMBA_AVAILABLE and len(candidates) >= NUMBA_MIN_CANDIDATES:
+        order = _mmr_order(sim_qc, sim_cc, np.float32(lambda_mult), k)
+    else:
+        order = _mmr_order_numpy(sim_qc, sim_cc, lambda_mult, k)
+    return order.tolist()
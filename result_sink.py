@@ -0,0 +1,72 @@
+"""
+Result sink - stream per-file processing results to a JSONL file instead of keeping them in memory
+"""
+import queue
+import threading
+from typing import Iterable, Optional
+
+from json_utils import dumps_bytes
+
+
+class JsonlResultSink:
+    """Write-behind JSONL writer with the list interface used by the processing loops
+
+    Results are serialized on a background thread, one line per file, and only running
+    counts stay in memory - so a 100k-file run does not hold 100k result dicts.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        self.path = path
+        self.files_processed = 0
+        self.files_stored = 0
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None  # first write failure on the writer thread
+        self._file = open(path, 'wb')
+        self._writer = threading.Thread(target=self._drain, name="result-sink", daemon=True)
+        self._writer.start()
+
+    def append(self, result: dict):
+        """Queue one result for writing (raises if an earlier result could not be written)"""
+        self._raise_write_error()
+        with self._lock:
+            self.files_processed += 1
+            if result.get('summary', {}).get('code_stored', False):
+                self.files_stored += 1
+        self._queue.put(result)
+
+    def extend(self, results: Iterable[dict]):
+        # Nested calls that already wrote into this sink hand it back as their result
+        if results is self:
+            return
+        for result in results:
+            self.append(result)
+
+    def __len__(self) -> int:
+        return self.files_processed
+
+    def _drain(self):
+        while True:
+            result = self._queue.get()
+            if result is None:
+                break
+            if self._error is not None:
+                # Keep consuming so append() never blocks on a full queue
+                continue
+            try:
+                self._file.write(dumps_bytes(result) + b'\n')
+            except Exception as e:
+                self._error = e
+
+    def _raise_write_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Could not write results to {self.path}: {self._error}") from self._error
+
+    def close(self):
+        """Flush the pending results and close the file"""
+        if self._file.closed:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+        self._raise_write_error()
@@ -0,0 +1,100 @@
+"""
+Semantic answer cache - reuse RAG answers for questions whose embeddings nearly match
+"""
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """Recent answers looked up by cosine similarity of the question embedding
+
+    Embeddings are stored L2-normalized in one preallocated float32 matrix, so a lookup
+    is a single matrix-vector product. Only entries stored under the same scope (model,
+    retrieval settings) and, when given, the same key (e.g. the normalized question) can match. Past max_entries the least recently used entry is
+    replaced, and entries older than ttl seconds are ignored.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 256, ttl: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._records: List[Dict] = []
+        self._keys: List[Hashable] = []
+        # Scopes are interned to small ints so matching them is a vectorized comparison
+        self._scope_ids: Dict[Hashable, int] = {}
+        self._row_scopes = np.full(max_entries, -1, dtype=np.int32)
+        self._stored_at = np.zeros(max_entries, dtype=np.float64)
+        self._used_at = np.zeros(max_entries, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, embedding: List[float], scope: Hashable = None, key: Hashable = None) -> Optional[Dict]:
+        """Record stored for the most similar earlier question, if it clears the threshold"""
+        query = self._normalize(embedding)
+        with self._lock:
+            count = len(self._records)
+            if query is None or count == 0 or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            # One BLAS matrix-vector product scores every cached question
+            scores = self._matrix[:count] @ query
+            scores[(self._row_scopes[:count] != scope_id) | (now - self._stored_at[:count] > self.ttl)] = -np.inf
+            if key is not None:
+                scores[np.fromiter((k != key for k in self._keys), dtype=bool, count=count)] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._used_at[best] = now
+            self.hits += 1
+            return self._records[best]
+
+    def put(self, embedding: List[float], record: Dict, scope: Hashable = None, key: Hashable = None):
+        """Remember record as the answer for this question embedding"""
+        vector = self._normalize(embedding)
+        if vector is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # First entry (or the embedding model changed): size the matrix for it
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._records = []
+                self._keys = []
+            if len(self._records) < self.max_entries:
+                row = len(self._records)
+                self._records.append(record)
+                self._keys.append(key)
+            else:
+                row = int(np.argmin(self._used_at))
+                self._records[row] = record
+                self._keys[row] = key
+            self._row_scopes[row] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            now = time.monotonic()
+            self._matrix[row] = vector
+            self._stored_at[row] = now
+            self._used_at[row] = now
+
+    def clear(self):
+        """Drop every cached answer (e.g. after the indexed code changed)"""
+        with self._lock:
+            self._records = []
+            self._keys = []
+
+    def __len__(self) -> int:
+        return len(self._records)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests that the ingest index only records files whose chunks actually reached the vector DB
+"""
+import pytest
+
+pytest.importorskip("chromadb")
+
+from ingest_index import read_text_with_digest
+from vector_db import VectorDatabase
+
+
+class FailingCollection:
+    """Code collection whose add() fails, as on a full disk or a locked database"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    def add(self, **kwargs):
+        raise RuntimeError("database is locked")
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def _ingest_record(path):
+    stat = path.stat()
+    content, digest = read_text_with_digest(str(path))
+    return content, (str(path), digest, stat.st_mtime, stat.st_size)
+
+
+def test_failed_flush_is_not_recorded(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    source = tmp_path / "UserMapper.java"
+    source.write_text("public interface UserMapper {\n    UserDTO toDTO(User user);\n}\n")
+    content, record = _ingest_record(source)
+    file_path, digest, mtime, size = record
+
+    stored_collection = db.code_collection
+    db.code_collection = FailingCollection(stored_collection)
+    db.store_code_file(file_path, content, [0.1, 0.2, 0.3], defer=True, ingest_record=record)
+    assert db.ingest_index.get(file_path) is None  # queued, not stored yet
+    assert db.flush_code_records() == 0
+
+    # The next run must not treat the file as already ingested
+    assert db.ingest_index.get(file_path) is None
+    assert not db.ingest_index.is_unchanged_stat(file_path, mtime, size)
+    assert not db.ingest_index.is_unchanged_content(file_path, digest)
+
+    db.code_collection = stored_collection
+    db.store_code_file(file_path, content, [0.1, 0.2, 0.3], defer=True, ingest_record=record)
+    assert db.flush_code_records() == 1
+    assert db.ingest_index.is_unchanged_stat(file_path, mtime, size)
+    assert db.ingest_index.is_unchanged_content(file_path, digest)
+
+
+def test_failed_chunked_store_is_not_recorded(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    source = tmp_path / "OrderMapper.java"
+    source.write_text("class OrderMapper {\n" + "    int field;\n" * 40 + "}\n")
+    content, record = _ingest_record(source)
+    file_path = record[0]
+
+    stored_collection = db.code_collection
+    db.code_collection = FailingCollection(stored_collection)
+    assert db.store_code_file_chunked(file_path, content, [[0.1, 0.2], [0.3, 0.4]], chunk_size=300,
+                                      ingest_record=record) == []
+    assert db.ingest_index.get(file_path) is None
+
+    db.code_collection = stored_collection
+    assert db.store_code_file_chunked(file_path, content, [[0.1, 0.2], [0.3, 0.4]], chunk_size=300,
+                                      ingest_record=record)
+    assert db.ingest_index.get(file_path) is not None
+
+
+def test_flush_with_repeated_ids_stores_and_records(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    first = tmp_path / "A.java"
+    second = tmp_path / "B.java"
+    first.write_text("class A {}\n")
+    second.write_text("class B {}\n")
+    first_content, first_record = _ingest_record(first)
+    second_content, second_record = _ingest_record(second)
+
+    # The same file queued twice in one bulk batch, next to another file
+    db.store_code_file(first_record[0], first_content, [0.1, 0.2, 0.3], defer=True, ingest_record=first_record)
+    db.store_code_file(second_record[0], second_content, [0.3, 0.2, 0.1], defer=True, ingest_record=second_record)
+    db.store_code_file(first_record[0], first_content, [0.1, 0.2, 0.4], defer=True, ingest_record=first_record)
+    assert db.flush_code_records() == 2
+
+    assert db.code_collection.count() == 2
+    assert db.ingest_index.get(first_record[0]) is not None
+    assert db.ingest_index.get(second_record[0]) is not None
+
+
+def test_deleted_code_file_is_ingested_again(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    source = tmp_path / "UserMapper.java"
+    source.write_text("public interface UserMapper {}\n")
+    content, record = _ingest_record(source)
+    file_path, digest, mtime, size = record
+    db.store_code_file(file_path, content, [0.1, 0.2, 0.3], ingest_record=record)
+    assert db.ingest_index.is_unchanged_stat(file_path, mtime, size)
+
+    # A forced re-ingest drops the old chunks; if re-embedding then fails, nothing is recorded
+    db.delete_code_file(file_path)
+    assert not db.ingest_index.is_unchanged_stat(file_path, mtime, size)
+    assert not db.ingest_index.is_unchanged_content(file_path, digest)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests that cached RAG answers are dropped once the vector database contents change
+"""
+import pytest
+
+pytest.importorskip("chromadb")
+
+from rag_service import RAGService
+from vector_db import VectorDatabase
+
+
+class StubOllamaClient:
+    """Fixed question embedding; each LLM call returns a new numbered answer"""
+
+    def __init__(self):
+        self.llm_calls = 0
+
+    def get_embeddings(self, text):
+        return [0.6, 0.8, 0.0]
+
+    def generate_with_llm(self, prompt, model=None, system=None, stream=False):
+        self.llm_calls += 1
+        return f"answer {self.llm_calls}"
+
+
+def test_reingest_invalidates_cached_answer(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    ollama = StubOllamaClient()
+    rag = RAGService(ollama, db, extract_mappings_on_demand=False)
+    db.store_code_file("/src/UserMapper.java", "class UserMapper {}", [0.6, 0.8, 0.0])
+
+    first = rag.answer_question("How is User mapped?")
+    assert first['answer'] == "answer 1"
+    assert rag.answer_question("How is User mapped?")['answer'] == "answer 1"
+    assert ollama.llm_calls == 1
+
+    # Re-ingest the file with new content
+    db.delete_code_file("/src/UserMapper.java")
+    db.store_code_file("/src/UserMapper.java", "class UserMapper { UserDTO toDTO(User u); }", [0.6, 0.8, 0.0])
+
+    second = rag.answer_question("How is User mapped?")
+    assert second['answer'] == "answer 2"
+    assert "UserDTO toDTO" in second['context']
+    assert ollama.llm_calls == 2
+
+
+def test_clear_invalidates_cached_answer(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    ollama = StubOllamaClient()
+    rag = RAGService(ollama, db, extract_mappings_on_demand=False)
+    db.store_code_file("/src/UserMapper.java", "class UserMapper {}", [0.6, 0.8, 0.0])
+
+    rag.answer_question("How is User mapped?")
+    db.clear()
+    rag.answer_question("How is User mapped?")
+    assert ollama.llm_calls == 2
+
+
+def test_write_from_another_process_invalidates_cached_answer(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    ollama = StubOllamaClient()
+    rag = RAGService(ollama, db, extract_mappings_on_demand=False)
+    db.store_code_file("/src/UserMapper.java", "class UserMapper {}", [0.6, 0.8, 0.0])
+    rag.answer_question("How is User mapped?")
+
+    # A CLI ingest opens its own VectorDatabase on the same directory
+    other = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    other.store_code_file("/src/OrderMapper.java", "class OrderMapper {}", [0.6, 0.8, 0.0])
+
+    rag.answer_question("How is User mapped?")
+    assert ollama.llm_calls == 2
+
+
+def test_different_question_with_same_embedding_is_not_served_from_cache(tmp_path):
+    db = VectorDatabase(persist_directory=str(tmp_path / "db"))
+    ollama = StubOllamaClient()
+    rag = RAGService(ollama, db, extract_mappings_on_demand=False)
+    db.store_code_file("/src/OrderMapper.java", "class OrderMapper {}", [0.6, 0.8, 0.0])
+
+    assert rag.answer_question("How is Order mapped?")['answer'] == "answer 1"
+    assert rag.answer_question("how is order mapped")['answer'] == "answer 1"
+    assert rag.answer_question("How is Invoice mapped?")['answer'] == "answer 2"
+    assert ollama.llm_calls == 2
@@ -0,0 +1,34 @@
+"""
+Text chunking - split code into embedding-sized pieces at line boundaries
+"""
+from typing import Iterator, List, Tuple
+
+
+def code_chunk_spans(code_content: str, chunk_size: int = 2000, overlap: int = 0) -> Iterator[Tuple[int, int]]:
+    """(start, end) offsets of the chunks split_code_chunks() would return, without copying text"""
+    start = 0
+    length = len(code_content)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            cut = code_content.rfind('\n', start, end)
+            if cut > start:
+                end = cut + 1
+        yield start, end
+        if end >= length:
+            break
+        next_start = end
+        if overlap > 0:
+            back = code_content.rfind('\n', max(start + 1, end - overlap), end - 1)
+            if back > start:
+                next_start = back + 1
+        start = next_start
+
+
+def split_code_chunks(code_content: str, chunk_size: int = 2000, overlap: int = 0) -> List[str]:
+    """Split code into chunks of at most chunk_size characters, cutting at line ends
+    
+    A line longer than chunk_size is cut mid-line. With overlap > 0 each chunk repeats
+    the whole lines from the last `overlap` characters of the previous one.
+    """
+    return [code_content[start:end] for start, end in code_chunk_spans(code_content, chunk_size, overlap)]
@@ -3,25 +3,92 @@ Vector Database for storing and querying code mapping embeddings
 """
 import json
 import hashlib
+import importlib.util
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
-try:
-    import chromadb
-    from chromadb.config import Settings
-    CHROMADB_AVAILABLE = True
-except ImportError:
-    CHROMADB_AVAILABLE = False
+from ingest_index import IngestIndex
+from text_chunking import code_chunk_spans
+from faiss_index import FaissCodeIndex, FAISS_AVAILABLE
+
+# chromadb takes a few hundred ms to import, so it is only located here and imported by the
+# first VectorDatabase(); importing this module stays cheap for tools that never open the store
+CHROMADB_AVAILABLE = importlib.util.find_spec('chromadb') is not None
+if not CHROMADB_AVAILABLE:
     print("Warning: chromadb not installed. Vector database features will be disabled.")
+chromadb = None
+np = None
+# Set by _load_chromadb(): Chroma 0.6+ takes numpy embeddings as-is, older releases only plain lists
+CHROMA_ACCEPTS_ARRAYS = False
+_client_settings = None
+_chromadb_lock = threading.Lock()
+
+
+def _load_chromadb():
+    """Import chromadb (once) and build the client settings shared by every VectorDatabase"""
+    global chromadb, np, CHROMA_ACCEPTS_ARRAYS, _client_settings
+    with _chromadb_lock:
+        if chromadb is not None:
+            return
+        import chromadb as chromadb_module
+        from chromadb.config import Settings
+        import numpy
+        np = numpy
+        CHROMA_ACCEPTS_ARRAYS = tuple(int(part) for part in re.findall(r'\d+', chromadb_module.__version__)[:2]) >= (0, 6)
+        _client_settings = Settings(anonymized_telemetry=False)
+        chromadb = chromadb_module
+
+# Same output as json.dumps(value, sort_keys=True), without building an encoder per call
+_json_encode = json.JSONEncoder(sort_keys=True).encode
+
+
+def _embedding_matrix(embeddings):
+    """Embeddings in the form handed to Chroma: one contiguous float32 matrix when it accepts arrays
+    
+    Chroma converts list embeddings to numpy itself, walking every float as a Python object;
+    a float32 matrix built here (a no-op for one that already is) skips that second pass.
+    """
+    if not CHROMA_ACCEPTS_ARRAYS:
+        return embeddings
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def _query_rows(results: Dict, document_key: str, with_embeddings: bool = False) -> List[Dict]:
+    """Result dicts for the first query of a collection.query() response"""
+    ids = results['ids'][0] if results['ids'] else []
+    if not ids:
+        return []
+    # Hoisted out of the row loop; a response without distances reports None for each row
+    distances = results['distances'][0] if 'distances' in results else repeat(None)
+    rows = zip(ids, results['documents'][0], results['metadatas'][0], distances)
+    if with_embeddings:
+        return [
+            {'id': record_id, document_key: document, 'metadata': metadata, 'distance': distance,
+             'embedding': embedding}
+            for (record_id, document, metadata, distance), embedding in zip(rows, results['embeddings'][0])
+        ]
+    return [
+        {'id': record_id, document_key: document, 'metadata': metadata, 'distance': distance}
+        for record_id, document, metadata, distance in rows
+    ]
 
 
 class VectorDatabase:
     """Vector database for storing and querying code mapping embeddings"""
     
     def __init__(self, persist_directory: str = "./chroma_db", collection_name: str = "code_mappings", 
-                 code_collection_name: str = "code_files"):
+                 code_collection_name: str = "code_files", bulk_batch_size: int = 2000,
+                 project_shards: Optional[List[str]] = None, bulk_flush_interval: float = 30.0,
+                 search_backend: str = "chroma"):
         if not CHROMADB_AVAILABLE:
             raise ImportError("chromadb is not installed. Install it with: pip install chromadb")
+        _load_chromadb()
         
         self.persist_directory = Path(persist_directory)
         self.persist_directory.mkdir(parents=True, exist_ok=True)
@@ -29,7 +96,7 @@ class VectorDatabase:
         # Initialize ChromaDB client
         self.client = chromadb.PersistentClient(
             path=str(self.persist_directory),
-            settings=Settings(anonymized_telemetry=False)
+            settings=_client_settings
         )
         
         # Get or create collection for mappings
@@ -43,25 +110,144 @@ class VectorDatabase:
             name=code_collection_name,
             metadata={"description": "Full code file embeddings"}
         )
+        
+        # Optional per-project shards of the code collection: files under a project root
+        # go to that project's collection, anything else to code_collection. Longest
+        # roots first so nested projects win.
+        self.code_shards: List[Tuple[str, object]] = []
+        for project in sorted({str(Path(p.strip())) for p in (project_shards or []) if p.strip()},
+                              key=len, reverse=True):
+            shard = self.client.get_or_create_collection(
+                name=self._shard_name(code_collection_name, project),
+                metadata={"description": f"Full code file embeddings for {project}"}
+            )
+            self.code_shards.append((project, shard))
+        
+        self._warm_lock = threading.Lock()
+        self._warmed = False
+        
+        # Code records queued with defer=True are written in large add() calls,
+        # which is much cheaper in Chroma than one add() per chunk
+        self.bulk_batch_size = max(1, bulk_batch_size)
+        self._pending_code: Dict[str, Dict[str, list]] = {}  # collection name -> records
+        self._pending_lock = threading.Lock()
+        # Also flush once the oldest queued record has waited this many seconds, so a slow
+        # run does not hold chunks (and their ingest index entries) back for long
+        self.bulk_flush_interval = bulk_flush_interval
+        self._pending_since: Optional[float] = None
+        
+        # Content hashes of stored files, used to skip re-embedding unchanged files
+        self.ingest_index = IngestIndex(str(self.persist_directory / "ingest_index.sqlite3"))
+        
+        # search_backend="faiss": unfiltered code searches run on an exact in-memory FAISS
+        # index built from the stored vectors; Chroma still persists and serves documents
+        self._faiss_index = None
+        if search_backend == "faiss":
+            if FAISS_AVAILABLE:
+                self._faiss_index = FaissCodeIndex()
+            else:
+                print("Warning: faiss not installed. Falling back to Chroma search. Install it with: pip install faiss-cpu")
+        
+        # Optional PCA projection fitted with fit_projection(); all stored and query
+        # embeddings go through it so the index works on the smaller vectors
+        self.projection_path = self.persist_directory / "pca_projection.npz"
+        self.projector = None
+        if self.projection_path.exists():
+            try:
+                from embedding_projection import PCAProjector
+                self.projector = PCAProjector.load(str(self.projection_path))
+            except Exception as e:
+                print(f"Warning: Could not load embedding projection {self.projection_path}: {e}")
+    
+    @staticmethod
+    def _shard_name(base_name: str, project: str) -> str:
+        """Chroma-safe collection name for a project shard (3-63 chars of [A-Za-z0-9_-])"""
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', Path(project).name).strip('_-')[:30] or 'project'
+        digest = hashlib.md5(project.encode()).hexdigest()[:8]
+        return f"{base_name[:20]}_{slug}_{digest}"
+    
+    @property
+    def code_collections(self) -> list:
+        """The main code collection followed by any project shards"""
+        return [self.code_collection] + [shard for _, shard in self.code_shards]
+    
+    def _code_collection_for(self, file_path: str):
+        """Pick the collection (project shard or main) that stores a file"""
+        for project, shard in self.code_shards:
+            if file_path == project or file_path.startswith(project.rstrip('/\\') + os.sep):
+                return shard
+        return self.code_collection
+    
+    def warm_up(self):
+        """Load the HNSW indexes from disk ahead of the first real query
+        
+        Chroma loads a persisted index lazily on the first query, which can take seconds
+        for large collections. Querying with one stored embedding triggers that load, so
+        callers can run this in the background while the question is being embedded.
+        """
+        with self._warm_lock:
+            if self._warmed:
+                return
+            for collection in self.code_collections + [self.collection]:
+                try:
+                    sample = collection.peek(limit=1)
+                    embeddings = sample.get('embeddings')
+                    if embeddings is not None and len(embeddings) > 0:
+                        collection.query(query_embeddings=_embedding_matrix([embeddings[0]]), n_results=1)
+                except Exception:
+                    # Warm-up is best effort; the real query will load the index anyway
+                    pass
+            self._warmed = True
+    
+    def _project(self, embeddings: List[List[float]]) -> List[List[float]]:
+        """Apply the PCA projection (if one was fitted) to a batch of embeddings"""
+        if self.projector is None:
+            return embeddings
+        return self.projector.transform(embeddings)
     
-    def _generate_id(self, mapping: Dict, file_path: str) -> str:
-        """Generate a unique ID for a mapping"""
+    def _add_batch_size(self) -> int:
+        """Records per collection.add() call: bulk_batch_size, capped at Chroma's own limit"""
+        # Chroma rejects add() calls above its own max batch size
+        batch_size = self.bulk_batch_size
+        try:
+            batch_size = min(batch_size, self.client.get_max_batch_size())
+        except Exception:
+            pass
+        return batch_size
+    
+    def project_query(self, query_embedding: List[float]) -> List[float]:
+        """Query embedding in the stored vector space
+        
+        Searches accept the result as-is (the projection passes already projected vectors
+        through), so a query used for several searches only needs projecting once.
+        """
+        return self._project([query_embedding])[0]
+    
+    def _generate_id(self, mapping: Dict, file_path: str, file_json: Optional[str] = None) -> str:
+        """Generate a unique ID for a mapping
+        
+        The ID is the MD5 of json.dumps({...}, sort_keys=True) over the mapping details; the
+        string is assembled directly in that key order so no dict is built and sorted per
+        mapping. file_json (the JSON-encoded file_path) can be passed in once per batch.
+        """
+        get = mapping.get
         # Create a hash from mapping details including field mappings for uniqueness
-        field_mappings = mapping.get('field_mappings', [])
+        field_mappings = get('field_mappings', [])
         # Create a unique string from field mappings
-        fields_str = json.dumps(field_mappings, sort_keys=True) if field_mappings else ''
-        
-        mapping_str = json.dumps({
-            'file': file_path,
-            'type': mapping.get('type'),
-            'source_type': mapping.get('source_type'),
-            'target_type': mapping.get('target_type'),
-            'method': mapping.get('method', ''),
-            'interface': mapping.get('interface', ''),
-            'source_field': mapping.get('source_field', ''),
-            'target_field': mapping.get('target_field', ''),
-            'fields': fields_str,
-        }, sort_keys=True)
+        fields_str = _json_encode(field_mappings) if field_mappings else ''
+        
+        mapping_str = ''.join((
+            '{"fields": ', _json_encode(fields_str),
+            ', "file": ', file_json if file_json is not None else _json_encode(file_path),
+            ', "interface": ', _json_encode(get('interface', '')),
+            ', "method": ', _json_encode(get('method', '')),
+            ', "source_field": ', _json_encode(get('source_field', '')),
+            ', "source_type": ', _json_encode(get('source_type')),
+            ', "target_field": ', _json_encode(get('target_field', '')),
+            ', "target_type": ', _json_encode(get('target_type')),
+            ', "type": ', _json_encode(get('type')),
+            '}'
+        ))
         return hashlib.md5(mapping_str.encode()).hexdigest()
     
     def _create_document(self, mapping: Dict, file_path: str, code_snippet: str = "") -> str:
@@ -96,6 +282,7 @@ class VectorDatabase:
         """Store a mapping with its embedding in the vector database"""
         mapping_id = self._generate_id(mapping, file_path)
         document = self._create_document(mapping, file_path, code_snippet)
+        embedding = self._project([embedding])[0]
         
         # Prepare metadata
         db_metadata = {
@@ -113,110 +300,77 @@ class VectorDatabase:
         # Store in ChromaDB
         self.collection.add(
             ids=[mapping_id],
-            embeddings=[embedding],
+            embeddings=_embedding_matrix([embedding]),
             documents=[document],
             metadatas=[db_metadata]
         )
+        self._collections_changed(code=False)
         
         return mapping_id
     
     def store_mappings_batch(self, mappings: List[Dict], file_path: str, 
                             embeddings: List[List[float]], code_snippet: str = "") -> List[str]:
         """Store multiple mappings in batch"""
+        embeddings = self._project(embeddings)
+        mappings = mappings[:len(embeddings)]
         ids = []
-        documents = []
-        metadatas = []
         
-        # Track IDs to avoid duplicates within the batch
-        seen_ids = set()
+        # Track IDs to avoid duplicates within the batch (occurrences seen per generated ID)
+        seen_ids: Dict[str, int] = {}
+        file_json = _json_encode(file_path)
         
-        for mapping, embedding in zip(mappings, embeddings):
-            mapping_id = self._generate_id(mapping, file_path)
-            
-            # If duplicate ID, add a counter to make it unique
-            original_id = mapping_id
-            counter = 0
-            while mapping_id in seen_ids:
-                counter += 1
-                mapping_id = f"{original_id}_{counter}"
-            
-            seen_ids.add(mapping_id)
-            
-            document = self._create_document(mapping, file_path, code_snippet)
-            
-            metadata = {
-                'file_path': file_path,
-                'mapping_type': mapping.get('type', 'unknown'),
-                'source_type': mapping.get('source_type', ''),
-                'target_type': mapping.get('target_type', ''),
-                'interface': mapping.get('interface', ''),
-                'method': mapping.get('method', ''),
-            }
+        for mapping in mappings:
+            mapping_id = self._generate_id(mapping, file_path, file_json)
             
+            # If duplicate ID, add a counter to make it unique (hex digests never contain '_',
+            # so the suffixed IDs cannot collide with another mapping's ID)
+            occurrences = seen_ids.get(mapping_id, 0)
+            seen_ids[mapping_id] = occurrences + 1
+            if occurrences:
+                mapping_id = f"{mapping_id}_{occurrences}"
             ids.append(mapping_id)
-            documents.append(document)
-            metadatas.append(metadata)
         
-        # Check for existing IDs and remove duplicates
-        if ids:
+        if not ids:
+            return ids
+        
+        # One lookup for IDs already stored, then one add() for the rest. The lookup only needs
+        # the IDs, so it runs in Chroma while the documents and metadata are built here.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            lookup = executor.submit(self.collection.get, ids=ids, include=[])
+            documents = [self._create_document(mapping, file_path, code_snippet) for mapping in mappings]
+            metadatas = [
+                {
+                    'file_path': file_path,
+                    'mapping_type': mapping.get('type', 'unknown'),
+                    'source_type': mapping.get('source_type', ''),
+                    'target_type': mapping.get('target_type', ''),
+                    'interface': mapping.get('interface', ''),
+                    'method': mapping.get('method', ''),
+                }
+                for mapping in mappings
+            ]
+            existing_ids = set(lookup.result().get('ids', []))
+        new_rows = [row for row in zip(ids, embeddings, documents, metadatas) if row[0] not in existing_ids]
+        if not new_rows:
+            print(f"  ℹ All {len(ids)} mappings already exist in database")
+            return ids
+        
+        new_ids, new_embeddings, new_documents, new_metadatas = map(list, zip(*new_rows))
+        batch_size = self._add_batch_size()
+        for start in range(0, len(new_ids), batch_size):
+            end = start + batch_size
             try:
-                existing = self.collection.get(ids=ids)
-                existing_ids = set(existing.get('ids', []))
-                # Filter out existing IDs
-                filtered_data = []
-                for i, mapping_id in enumerate(ids):
-                    if mapping_id not in existing_ids:
-                        filtered_data.append((mapping_id, documents[i], metadatas[i], embeddings[i]))
-                
-                if filtered_data:
-                    filtered_ids, filtered_docs, filtered_metas, filtered_embs = zip(*filtered_data)
-                    # Store in batch
-                    self.collection.add(
-                        ids=list(filtered_ids),
-                        embeddings=list(filtered_embs),
-                        documents=list(filtered_docs),
-                        metadatas=list(filtered_metas)
-                    )
-                else:
-                    print(f"  ℹ All {len(ids)} mappings already exist in database")
+                self.collection.add(
+                    ids=new_ids[start:end],
+                    embeddings=_embedding_matrix(new_embeddings[start:end]),
+                    documents=new_documents[start:end],
+                    metadatas=new_metadatas[start:end]
+                )
             except Exception as e:
-                # If get fails (maybe collection is empty), try direct add
-                try:
-                    self.collection.add(
-                        ids=ids,
-                        embeddings=embeddings,
-                        documents=documents,
-                        metadatas=metadatas
-                    )
-                except Exception as e2:
-                    # If still getting duplicates, try adding one by one
-                    if "duplicate" in str(e2).lower() or "unique" in str(e2).lower():
-                        print(f"  ⚠ Batch insert failed due to duplicates, inserting individually...")
-                        stored = 0
-                        for i, (mapping_id, doc, meta, emb) in enumerate(zip(ids, documents, metadatas, embeddings)):
-                            try:
-                                # Check if exists first
-                                try:
-                                    existing = self.collection.get(ids=[mapping_id])
-                                    if existing.get('ids'):
-                                        continue  # Skip if exists
-                                except:
-                                    pass  # If get fails, try to add
-                                
-                                self.collection.add(
-                                    ids=[mapping_id],
-                                    embeddings=[emb],
-                                    documents=[doc],
-                                    metadatas=[meta]
-                                )
-                                stored += 1
-                            except Exception as e3:
-                                if "duplicate" not in str(e3).lower():
-                                    print(f"  ✗ Failed to store mapping {i+1}: {e3}")
-                        if stored > 0:
-                            print(f"  ✓ Stored {stored} new mapping(s) (skipped duplicates)")
-                    else:
-                        raise
+                # Another writer stored some of them since the lookup; anything else is a real error
+                if "duplicate" not in str(e).lower() and "unique" not in str(e).lower():
+                    raise
+        self._collections_changed(code=False)
         
         return ids
     
@@ -224,7 +378,7 @@ class VectorDatabase:
                      filter_metadata: Optional[Dict] = None) -> List[Dict]:
         """Search for similar mappings using embedding similarity"""
         query_kwargs = {
-            'query_embeddings': [query_embedding],
+            'query_embeddings': _embedding_matrix(self._project([query_embedding])),
             'n_results': n_results
         }
         
@@ -233,18 +387,7 @@ class VectorDatabase:
         
         results = self.collection.query(**query_kwargs)
         
-        # Format results
-        similar_mappings = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                similar_mappings.append({
-                    'id': results['ids'][0][i],
-                    'document': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                })
-        
-        return similar_mappings
+        return _query_rows(results, 'document')
     
     def search_by_text(self, query_text: str, n_results: int = 5, 
                       filter_metadata: Optional[Dict] = None) -> List[Dict]:
@@ -261,60 +404,69 @@ class VectorDatabase:
         
         results = self.collection.query(**query_kwargs)
         
-        # Format results
-        similar_mappings = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                similar_mappings.append({
-                    'id': results['ids'][0][i],
-                    'document': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                })
-        
-        return similar_mappings
+        return _query_rows(results, 'document')
     
     def get_all_mappings(self, limit: Optional[int] = None) -> List[Dict]:
         """Get all stored mappings"""
         results = self.collection.get(limit=limit)
         
-        mappings = []
-        if results['ids']:
-            for i in range(len(results['ids'])):
-                mappings.append({
-                    'id': results['ids'][i],
-                    'document': results['documents'][i],
-                    'metadata': results['metadatas'][i]
-                })
-        
-        return mappings
+        if not results['ids']:
+            return []
+        return [
+            {'id': record_id, 'document': document, 'metadata': metadata}
+            for record_id, document, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        ]
     
     def delete_mapping(self, mapping_id: str):
         """Delete a mapping by ID"""
         self.collection.delete(ids=[mapping_id])
+        self._collections_changed(code=False)
     
     def delete_by_file(self, file_path: str):
         """Delete all mappings from a specific file"""
-        # Get all mappings from this file
-        results = self.collection.get(
-            where={'file_path': file_path}
-        )
+        # delete() filters by metadata itself, so no get() round trip to collect the IDs first
+        self.collection.delete(where={'file_path': file_path})
+        self._collections_changed(code=False)
+    
+    def delete_code_file(self, file_path: str):
+        """Delete all stored chunks of a code file (and its ingest index entry)"""
+        # Forgotten first: if the re-embed that usually follows fails or is partial, the next
+        # run must not skip the file as unchanged
+        self.ingest_index.remove(file_path)
+        collection = self._code_collection_for(file_path)
+        collection.delete(where={'file_path': file_path})
+        self._collections_changed()
+    
+    @property
+    def data_version(self) -> int:
+        """Counter incremented on every write or delete, by this or any other process
         
-        if results['ids']:
-            self.collection.delete(ids=results['ids'])
+        Callers caching search results (the RAG answer cache) compare it to tell that what
+        they cached was based on older contents.
+        """
+        return self.ingest_index.data_version()
+    
+    def _collections_changed(self, code: bool = True):
+        """Bump data_version after a write; code changes also mark the FAISS index stale"""
+        self.ingest_index.bump_data_version()
+        if code and self._faiss_index is not None:
+            self._faiss_index.invalidate()
     
     def get_stats(self) -> Dict:
         """Get statistics about the vector database"""
-        code_count = self.code_collection.count()
+        code_count = sum(collection.count() for collection in self.code_collections)
         mapping_count = self.collection.count()  # Legacy - may have old mappings
         
-        return {
+        stats = {
             'total_code_files': code_count,
             'total_code_chunks': code_count,  # Alias for clarity
             'legacy_mappings': mapping_count,  # Old mappings if any
             'code_collection': self.code_collection.name,
             'mapping_collection': self.collection.name
         }
+        if self.code_shards:
+            stats['code_shards'] = {project: shard.count() for project, shard in self.code_shards}
+        return stats
     
     def clear(self, clear_code_files: bool = True):
         """Clear all mappings and optionally code files from the database"""
@@ -323,42 +475,214 @@ class VectorDatabase:
             name=self.collection.name,
             metadata={"description": "Code mapping embeddings"}
         )
+        self._collections_changed(code=False)
         
         if clear_code_files:
+            self.ingest_index.clear()
             self.client.delete_collection(name=self.code_collection.name)
             self.code_collection = self.client.get_or_create_collection(
                 name=self.code_collection.name,
                 metadata={"description": "Full code file embeddings"}
             )
+            for i, (project, shard) in enumerate(self.code_shards):
+                self.client.delete_collection(name=shard.name)
+                self.code_shards[i] = (project, self.client.get_or_create_collection(
+                    name=shard.name,
+                    metadata=shard.metadata
+                ))
+            self._collections_changed()
+    
+    def _iter_collection(self, collection, page_size: int = 1000):
+        """Yield (ids, embeddings, documents, metadatas) pages of a collection"""
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset,
+                                  include=['embeddings', 'documents', 'metadatas'])
+            if not page['ids']:
+                return
+            yield page['ids'], page['embeddings'], page['documents'], page['metadatas']
+            offset += len(page['ids'])
+    
+    def fit_projection(self, n_components: int = 256, sample_size: int = 20000,
+                       min_recall: float = 0.9) -> Dict:
+        """Fit a PCA projection on stored code embeddings and re-index both collections with it
+        
+        The projection is only applied when recall@10 of exact neighbours on a held-out
+        sample is at least min_recall. Returns a summary dict.
+        """
+        import numpy as np
+        from embedding_projection import PCAProjector, recall_at_k
+        
+        if self.projector is not None:
+            return {'applied': False, 'reason': f'Projection already applied ({self.projector.output_dim} dims)'}
+        
+        self.flush_code_records()
+        sample = []
+        for collection in self.code_collections:
+            for _, embeddings, _, _ in self._iter_collection(collection):
+                sample.extend(embeddings)
+                if len(sample) >= sample_size:
+                    break
+        if len(sample) < max(n_components * 4, 1000):
+            return {'applied': False, 'reason': f'Not enough stored vectors to fit ({len(sample)})'}
+        
+        vectors = np.asarray(sample[:sample_size], dtype=np.float32)
+        # Hold out the first vectors as queries so they are not part of the fit
+        n_queries = min(200, len(vectors) // 10)
+        projector = PCAProjector.fit(vectors[n_queries:], n_components)
+        recall, _ = recall_at_k(vectors, projector, n_queries=n_queries, k=10)
+        summary = {
+            'applied': False,
+            'input_dim': projector.input_dim,
+            'output_dim': projector.output_dim,
+            'recall_at_10': round(recall, 4),
+        }
+        if recall < min_recall:
+            summary['reason'] = f'recall@10 {recall:.3f} below {min_recall}'
+            return summary
+        
+        # Copy each collection into a projected one, then swap names
+        def reindex(collection):
+            name = collection.name
+            tmp = self.client.get_or_create_collection(name=f"{name}_pca_tmp", metadata=collection.metadata)
+            for ids, embeddings, documents, metadatas in self._iter_collection(collection):
+                tmp.add(ids=ids, embeddings=_embedding_matrix(projector.transform([list(e) for e in embeddings])),
+                        documents=documents, metadatas=metadatas)
+            self.client.delete_collection(name=name)
+            tmp.modify(name=name)
+            return self.client.get_collection(name=name)
+        
+        self.collection = reindex(self.collection)
+        self.code_collection = reindex(self.code_collection)
+        self.code_shards = [(project, reindex(shard)) for project, shard in self.code_shards]
+        
+        projector.save(str(self.projection_path))
+        self.projector = projector
+        self._warmed = False
+        self._collections_changed()
+        summary['applied'] = True
+        return summary
+    
+    def _record_ingested(self, ingest_record: Optional[Tuple]):
+        """Write (path, sha256, mtime, size) to the ingest index for a file whose records are stored"""
+        if ingest_record:
+            self.ingest_index.record(*ingest_record)
+    
+    def _queue_code_records(self, collection, ids: List[str], embeddings: List[List[float]],
+                            documents: List[str], metadatas: List[Dict],
+                            ingest_record: Optional[Tuple] = None):
+        """Buffer code records, flushing once a full bulk batch has accumulated or aged out
+        
+        ingest_record is written to the ingest index by the flush that stores these records.
+        """
+        with self._pending_lock:
+            pending = self._pending_code.setdefault(
+                collection.name, {'ids': [], 'embeddings': [], 'documents': [], 'metadatas': [], 'ingest': []}
+            )
+            pending['ids'].extend(ids)
+            pending['embeddings'].extend(embeddings)
+            pending['documents'].extend(documents)
+            pending['metadatas'].extend(metadatas)
+            if ingest_record:
+                pending['ingest'].append((ingest_record, ids))
+            now = time.monotonic()
+            if self._pending_since is None:
+                self._pending_since = now
+            should_flush = (len(pending['ids']) >= self.bulk_batch_size
+                            or now - self._pending_since >= self.bulk_flush_interval)
+        if should_flush:
+            self.flush_code_records()
+    
+    def flush_code_records(self) -> int:
+        """Write all buffered code records to their collections, returns the number written
+        
+        Files are only recorded in the ingest index once all of their records were added,
+        so a failed flush leaves them to be ingested again on the next run.
+        """
+        with self._pending_lock:
+            pending_by_name = self._pending_code
+            self._pending_code = {}
+            self._pending_since = None
+        
+        if not pending_by_name:
+            return 0
+        
+        batch_size = self._add_batch_size()
+        collections = {collection.name: collection for collection in self.code_collections}
+        written = 0
+        for name, pending in pending_by_name.items():
+            collection = collections.get(name, self.code_collection)
+            # Chroma rejects a whole add() whose IDs repeat; a file queued twice keeps its newest records
+            last_index = {record_id: i for i, record_id in enumerate(pending['ids'])}
+            if len(last_index) < len(pending['ids']):
+                keep = sorted(last_index.values())
+                for key in ('ids', 'embeddings', 'documents', 'metadatas'):
+                    pending[key] = [pending[key][i] for i in keep]
+            failed_ids = set()
+            for start in range(0, len(pending['ids']), batch_size):
+                end = start + batch_size
+                try:
+                    collection.add(
+                        ids=pending['ids'][start:end],
+                        embeddings=_embedding_matrix(pending['embeddings'][start:end]),
+                        documents=pending['documents'][start:end],
+                        metadatas=pending['metadatas'][start:end]
+                    )
+                    written += len(pending['ids'][start:end])
+                except Exception as e:
+                    print(f"  ⚠ Failed to store {len(pending['ids'][start:end])} code chunk(s): {e}")
+                    failed_ids.update(pending['ids'][start:end])
+            for ingest_record, ids in pending['ingest']:
+                if failed_ids.isdisjoint(ids):
+                    self._record_ingested(ingest_record)
+        if written:
+            self._collections_changed()
+        return written
     
     def store_code_file(self, file_path: str, code_content: str, embedding: List[float], 
-                       metadata: Optional[Dict] = None) -> str:
-        """Store a full code file with its embedding"""
+                       metadata: Optional[Dict] = None, defer: bool = False,
+                       ingest_record: Optional[Tuple] = None) -> str:
+        """Store a full code file with its embedding (defer=True queues it for flush_code_records)
+        
+        ingest_record (path, sha256, mtime, size) goes to the ingest index once the file is stored.
+        """
         # Generate ID from file path
         file_id = hashlib.md5(file_path.encode()).hexdigest()
         
         # Prepare metadata
+        path = Path(file_path)
         db_metadata = {
             'file_path': file_path,
-            'file_name': Path(file_path).name,
-            'file_type': Path(file_path).suffix,
+            'file_name': path.name,
+            'file_type': path.suffix,
         }
         
         if metadata:
             db_metadata.update(metadata)
         
+        embedding = self._project([embedding])[0]
+        collection = self._code_collection_for(file_path)
+        if defer:
+            self._queue_code_records(collection, [file_id], [embedding], [code_content], [db_metadata],
+                                     ingest_record)
+            return file_id
+        
         # Store in ChromaDB
-        self.code_collection.add(
+        collection.add(
             ids=[file_id],
-            embeddings=[embedding],
+            embeddings=_embedding_matrix([embedding]),
             documents=[code_content],
             metadatas=[db_metadata]
         )
+        self._collections_changed()
+        self._record_ingested(ingest_record)
         
         return file_id
     
     def store_code_file_chunked(self, file_path: str, code_content: str, embeddings: List[List[float]],
-                                chunk_size: int = 2000, chunk_indices: Optional[List[int]] = None) -> List[str]:
+                                chunk_size: int = 2000, chunk_indices: Optional[List[int]] = None,
+                                defer: bool = False, chunks: Optional[List[str]] = None,
+                                ingest_record: Optional[Tuple] = None) -> List[str]:
         """Store a large code file in chunks
         
         Args:
@@ -368,90 +692,188 @@ class VectorDatabase:
             chunk_size: Size of each chunk in characters
             chunk_indices: Optional list of chunk indices that correspond to embeddings
                           If None, assumes embeddings are in order starting from chunk 0
+            defer: Queue the chunks for a later bulk flush_code_records() instead of writing now
+            chunks: The chunk texts that were embedded; split with split_code_chunks() if None
+            ingest_record: (path, sha256, mtime, size) written to the ingest index once the
+                          chunks are stored
         """
         if not embeddings:
             return []
-        
-        # Split into chunks
-        chunks = []
+        embeddings = self._project(embeddings)
+        
+        # Split into chunks; without given texts only the offsets are computed, so just the
+        # chunks that have embeddings get copied out of code_content below
+        if chunks is None:
+            spans = list(code_chunk_spans(code_content, chunk_size))
+            total_chunks = len(spans)
+            chunk_text = lambda idx: code_content[spans[idx][0]:spans[idx][1]]
+        else:
+            total_chunks = len(chunks)
+            chunk_text = chunks.__getitem__
         chunk_embeddings = []
         chunk_ids = []
         
-        total_chunks = (len(code_content) + chunk_size - 1) // chunk_size
-        
-        for i in range(0, len(code_content), chunk_size):
-            chunk = code_content[i:i + chunk_size]
-            chunks.append(chunk)
-        
         # Map embeddings to chunks
         if chunk_indices:
             # Use provided indices to map embeddings to chunks
             for idx, emb in zip(chunk_indices, embeddings):
-                if 0 <= idx < len(chunks):
+                if 0 <= idx < total_chunks:
                     chunk_embeddings.append((idx, emb))
         else:
             # Assume embeddings are in order
             for i, emb in enumerate(embeddings):
-                if i < len(chunks):
+                if i < total_chunks:
                     chunk_embeddings.append((i, emb))
         
-        # Store only chunks that have embeddings
-        stored_ids = []
+        # Store only chunks that have embeddings, in a single add() call
+        # Everything derived from the path is computed once per file, not once per chunk
+        file_hash = hashlib.md5(file_path.encode()).hexdigest()
+        path = Path(file_path)
+        file_name = path.name
+        file_metadata = {
+            'file_path': file_path,
+            'file_name': file_name,
+            'file_type': path.suffix,
+        }
+        ids, chunk_embs, documents, metadatas = [], [], [], []
         for chunk_idx, emb in chunk_embeddings:
-            chunk = chunks[chunk_idx]
-            chunk_id = f"{hashlib.md5(file_path.encode()).hexdigest()}_chunk_{chunk_idx}"
-            metadata = {
-                'file_path': file_path,
-                'file_name': Path(file_path).name,
-                'file_type': Path(file_path).suffix,
-                'chunk_index': chunk_idx,
-                'total_chunks': total_chunks
-            }
-            
+            ids.append(f"{file_hash}_chunk_{chunk_idx}")
+            chunk_embs.append(emb)
+            documents.append(chunk_text(chunk_idx))
+            metadatas.append(dict(file_metadata, chunk_index=chunk_idx, total_chunks=total_chunks))
+        
+        collection = self._code_collection_for(file_path)
+        if defer:
+            self._queue_code_records(collection, ids, chunk_embs, documents, metadatas, ingest_record)
+            return ids
+        
+        # One lookup for chunks already stored (a re-indexed file), then add only the rest; a
+        # single duplicate no longer makes the whole add() fail and drop the new chunks with it
+        try:
+            existing_ids = set(collection.get(ids=ids, include=[]).get('ids', []))
+        except Exception as e:
+            print(f"  ⚠ Failed to store chunks of {file_name}: {e}")
+            return []
+        new_rows = [row for row in zip(ids, chunk_embs, documents, metadatas) if row[0] not in existing_ids]
+        if not new_rows:
+            self._record_ingested(ingest_record)
+            return ids
+        
+        new_ids, new_embs, new_documents, new_metadatas = map(list, zip(*new_rows))
+        batch_size = self._add_batch_size()
+        for start in range(0, len(new_ids), batch_size):
+            end = start + batch_size
             try:
-                self.code_collection.add(
-                    ids=[chunk_id],
-                    embeddings=[emb],
-                    documents=[chunk],
-                    metadatas=[metadata]
+                collection.add(
+                    ids=new_ids[start:end],
+                    embeddings=_embedding_matrix(new_embs[start:end]),
+                    documents=new_documents[start:end],
+                    metadatas=new_metadatas[start:end]
                 )
-                stored_ids.append(chunk_id)
             except Exception as e:
-                # Skip duplicate or other errors
-                if "duplicate" not in str(e).lower():
-                    print(f"  ⚠ Failed to store chunk {chunk_idx + 1}: {e}")
+                # Another writer stored some of them since the lookup; report anything else
+                if "duplicate" not in str(e).lower() and "unique" not in str(e).lower():
+                    print(f"  ⚠ Failed to store chunks of {file_name}: {e}")
+                    return []
+        self._collections_changed()
+        self._record_ingested(ingest_record)
         
-        return stored_ids
+        return ids
     
     def search_code(self, query_embedding: List[float], n_results: int = 5,
-                   filter_metadata: Optional[Dict] = None) -> List[Dict]:
-        """Search for similar code files using embedding similarity"""
+                   filter_metadata: Optional[Dict] = None, diversity: bool = False,
+                   mmr_lambda: float = 0.5) -> List[Dict]:
+        """Search for similar code files using embedding similarity
+        
+        With diversity=True a 4x larger candidate pool is reranked with maximal marginal
+        relevance, so near-duplicate chunks do not crowd out other files.
+        """
+        # Projected once here; the search backends and MMR all take the projected query
+        query = self.project_query(query_embedding)
+        if not diversity:
+            return self._search_code(query, n_results, filter_metadata)
+        
+        from reranking import mmr_select
+        candidates = self._search_code(query, max(n_results * 4, 20), filter_metadata, with_embeddings=True)
+        if not candidates:
+            return []
+        order = mmr_select(query, [candidate.pop('embedding') for candidate in candidates], n_results, mmr_lambda)
+        return [candidates[i] for i in order]
+    
+    def _search_code(self, query: List[float], n_results: int,
+                     filter_metadata: Optional[Dict] = None, with_embeddings: bool = False) -> List[Dict]:
+        """search_code() for an already projected query"""
+        if self._faiss_index is not None and not filter_metadata:
+            return self._search_code_faiss(query, n_results, with_embeddings)
+        
         query_kwargs = {
-            'query_embeddings': [query_embedding],
+            'query_embeddings': _embedding_matrix([query]),
             'n_results': n_results
         }
+        if with_embeddings:
+            query_kwargs['include'] = ['documents', 'metadatas', 'distances', 'embeddings']
         
         if filter_metadata:
             query_kwargs['where'] = filter_metadata
         
-        results = self.code_collection.query(**query_kwargs)
+        collections = self.code_collections
+        if len(collections) == 1:
+            results_list = [collections[0].query(**query_kwargs)]
+        else:
+            # Query all shards in parallel, skipping empty ones
+            collections = [c for c in collections if c.count() > 0]
+            if not collections:
+                return []
+            with ThreadPoolExecutor(max_workers=len(collections)) as executor:
+                results_list = list(executor.map(lambda c: c.query(**query_kwargs), collections))
         
         # Format results
         similar_code = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
+        for results in results_list:
+            similar_code.extend(_query_rows(results, 'code', with_embeddings))
+        
+        if len(results_list) > 1:
+            # Merge shard results into one global top-n
+            similar_code.sort(key=lambda r: r['distance'] if r['distance'] is not None else float('inf'))
+            similar_code = similar_code[:n_results]
+        
+        return similar_code
+    
+    def _search_code_faiss(self, query: List[float], n_results: int,
+                           with_embeddings: bool = False) -> List[Dict]:
+        """search_code() on the FAISS index, fetching documents and metadata from Chroma"""
+        collections = self.code_collections
+        hits = self._faiss_index.search(collections, query, n_results)
+        
+        ids_by_collection: Dict[int, List[str]] = {}
+        for position, record_id, _ in hits:
+            ids_by_collection.setdefault(position, []).append(record_id)
+        include = ['documents', 'metadatas', 'embeddings'] if with_embeddings else ['documents', 'metadatas']
+        records = {}
+        for position, ids in ids_by_collection.items():
+            page = collections[position].get(ids=ids, include=include)
+            embeddings = page['embeddings'] if with_embeddings else [None] * len(page['ids'])
+            for record_id, document, metadata, embedding in zip(page['ids'], page['documents'],
+                                                                 page['metadatas'], embeddings):
+                records[record_id] = (document, metadata, embedding)
+        
+        similar_code = []
+        for _, record_id, distance in hits:
+            if record_id in records:
+                document, metadata, embedding = records[record_id]
                 similar_code.append({
-                    'id': results['ids'][0][i],
-                    'code': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
+                    'id': record_id,
+                    'code': document,
+                    'metadata': metadata,
+                    'distance': distance
                 })
-        
+                if with_embeddings:
+                    similar_code[-1]['embedding'] = embedding
         return similar_code
     
     def get_code_stats(self) -> Dict:
         """Get statistics about the code collection"""
-        count = self.code_collection.count()
+        count = sum(collection.count() for collection in self.code_collections)
         return {
             'total_files': count,
             'collection_name': self.code_collection.name